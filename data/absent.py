@@ -1,7 +1,9 @@
 import sqlalchemy
+from sqlalchemy import DDL, event
 from sqlalchemy.orm import relationship
 from .db_session import SqlAlchemyBase
 from sqlalchemy_serializer import SerializerMixin
+from tools.error_book import AbsentDuplicatesError
 
 
 class Absent(SqlAlchemyBase, SerializerMixin):
@@ -10,6 +12,43 @@ class Absent(SqlAlchemyBase, SerializerMixin):
     id = sqlalchemy.Column(sqlalchemy.Integer, unique=True, primary_key=True, autoincrement=True)   # id
     date = sqlalchemy.Column(sqlalchemy.Date)   # date when student absent
     reason = sqlalchemy.Column(sqlalchemy.String)   # absent reason
-    file = sqlalchemy.Column(sqlalchemy.LargeBinary, nullable=True)    # file with proof
+    file_key = sqlalchemy.Column(sqlalchemy.String, nullable=True)    # key of file with proof in blob store
+    file_size = sqlalchemy.Column(sqlalchemy.Integer, nullable=True)    # size of file with proof in bytes
     student_id = sqlalchemy.Column(sqlalchemy.Integer, sqlalchemy.ForeignKey('students.id'))  # absent student id
-    student = relationship('Student', foreign_keys=[student_id])    # student that absent
+    student = relationship('Student', foreign_keys=[student_id], lazy='select')    # student that absent
+
+    __table_args__ = (
+        sqlalchemy.UniqueConstraint('student_id', 'date', name='uq_absents_student_id_date'),  # one absent a day
+    )
+
+
+# create_all does not add columns to existing table, proofs of old absents.file column are moved to blob store
+# by hand with python -m tools.migrations move_files
+event.listen(SqlAlchemyBase.metadata, 'after_create', DDL(
+    'ALTER TABLE absents ADD COLUMN IF NOT EXISTS file_key VARCHAR, '
+    'ADD COLUMN IF NOT EXISTS file_size INTEGER'
+))
+
+
+def create_unique_index(target, connection, **kw):
+    """
+        Function that build unique (student_id, date) index on existing table, create_all does not add constraints
+        to it. Start fails while duplicates left by old code exist, they are removed by hand with
+        python -m tools.migrations dedupe_absents
+    """
+    if connection.execute(sqlalchemy.text("SELECT to_regclass('uq_absents_student_id_date')")).scalar() is not None:
+        return
+
+    duplicates = connection.execute(sqlalchemy.text(
+        'SELECT count(*) FROM (SELECT 1 FROM absents GROUP BY student_id, date HAVING count(*) > 1) AS duplicates'
+    )).scalar()
+    if duplicates:
+        raise AbsentDuplicatesError(duplicates)
+    connection.execute(sqlalchemy.text(
+        'CREATE UNIQUE INDEX IF NOT EXISTS uq_absents_student_id_date ON absents (student_id, date)'
+    ))
+
+
+event.listen(SqlAlchemyBase.metadata, 'after_create', create_unique_index)
+# unique index makes plain (student_id, date) index redundant
+event.listen(SqlAlchemyBase.metadata, 'after_create', DDL('DROP INDEX IF EXISTS ix_absents_student_id_date'))
@@ -1,25 +1,148 @@
+import contextlib
+import contextvars
+import threading
+import time
+
 import sqlalchemy as sa
 import sqlalchemy.orm as orm
 from sqlalchemy.orm import Session
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 import sqlalchemy.ext.declarative as dec
 
 
 SqlAlchemyBase = dec.declarative_base()
 
 __factory = None
+__engine = None
+__async_factory = None
+__async_engine = None
+
+
+class PoolMetrics:
+    """Counters of connection pool checkouts and time spent waiting for a free connection"""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def add_checkout(self, wait: float):
+        with self._lock:
+            self.checkouts += 1
+            self.wait_total += wait
+            self.wait_max = max(self.wait_max, wait)
+
+    def add_timeout(self):
+        with self._lock:
+            self.timeouts += 1
+
+    def as_dict(self) -> dict:
+        with self._lock:
+            return {
+                'checkouts': self.checkouts,
+                'timeouts': self.timeouts,
+                'wait_total': round(self.wait_total, 6),
+                'wait_avg': round(self.wait_total / self.checkouts, 6) if self.checkouts else 0.0,
+                'wait_max': round(self.wait_max, 6),
+            }
+
+
+pool_metrics = PoolMetrics()
+async_pool_metrics = PoolMetrics()
+
+
+class _TimedPoolMixin:
+    """Pool mixin that measures how long each checkout waits for a free connection"""
+    metrics: PoolMetrics = None
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except sa.exc.TimeoutError:
+            self.metrics.add_timeout()
+            raise
+        self.metrics.add_checkout(time.perf_counter() - start)
+        return connection
+
+
+class TimedQueuePool(_TimedPoolMixin, QueuePool):
+    metrics = pool_metrics
+
+
+class TimedAsyncQueuePool(_TimedPoolMixin, AsyncAdaptedQueuePool):
+    metrics = async_pool_metrics
+
+
+class QueryCounter:
+    """Number of SQL statements executed inside count_queries block"""
+    def __init__(self):
+        self.count = 0
+
+
+_query_counter = contextvars.ContextVar('query_counter', default=None)
+
+
+def _count_query(conn, cursor, statement, parameters, context, executemany):
+    counter = _query_counter.get()
+    if counter is not None:
+        counter.count += 1
+
+
+# Подсчёт запросов к БД, например за время одного http запроса
+@contextlib.contextmanager
+def count_queries():
+    """
+        Context manager that counts statements of sync and async engines executed in current context
+
+        Counter is mutable object, so statements from threadpool and tasks with copied context are counted too
+    """
+    counter = QueryCounter()
+    token = _query_counter.set(counter)
+    try:
+        yield counter
+    finally:
+        _query_counter.reset(token)
 
 
 # Создание и подключение к БД
-def global_init(user, password, host, db_name):
-    global __factory
+def global_init(user, password, host, db_name, pool_size=5, max_overflow=10, pool_timeout=30,
+                pool_recycle=-1, pool_pre_ping=True, statement_timeout=0, async_pool_size=2, async_max_overflow=3):
+    global __factory, __engine, __async_factory, __async_engine
 
     if __factory:
         return
 
     conn_str = f'postgresql://{user}:{password}@{host}/{db_name}'
+    async_conn_str = f'postgresql+asyncpg://{user}:{password}@{host}/{db_name}'
+    pool_settings = {
+        'pool_size': pool_size,
+        'max_overflow': max_overflow,
+        'pool_timeout': pool_timeout,
+        'pool_recycle': pool_recycle,
+        'pool_pre_ping': pool_pre_ping,
+    }
+
+    connect_args = {}
+    async_connect_args = {}
+    if statement_timeout:
+        connect_args['options'] = f'-c statement_timeout={statement_timeout}'
+        async_connect_args['server_settings'] = {'statement_timeout': str(statement_timeout)}
 
-    engine = sa.create_engine(conn_str)
+    engine = sa.create_engine(conn_str, poolclass=TimedQueuePool, connect_args=connect_args, **pool_settings)
+    __engine = engine
     __factory = orm.sessionmaker(bind=engine)
+    sa.event.listen(engine, 'before_cursor_execute', _count_query)
+
+    # async engine for endpoints that run on the event loop
+    async_pool_settings = {**pool_settings, 'pool_size': async_pool_size, 'max_overflow': async_max_overflow}
+    async_engine = create_async_engine(async_conn_str, poolclass=TimedAsyncQueuePool,
+                                       connect_args=async_connect_args, **async_pool_settings)
+    __async_engine = async_engine
+    __async_factory = orm.sessionmaker(bind=async_engine, class_=AsyncSession, expire_on_commit=False)
+    sa.event.listen(async_engine.sync_engine, 'before_cursor_execute', _count_query)
 
     SqlAlchemyBase.metadata.create_all(engine)
 
@@ -28,3 +151,55 @@ def global_init(user, password, host, db_name):
 def create_session() -> Session:
     global __factory
     return __factory()
+
+
+# Сессия на время запроса, всегда закрывается
+def get_session():
+    """FastAPI dependency that yields a session and always closes it, rolling back on error"""
+    db_sess = create_session()
+    try:
+        yield db_sess
+    except Exception:
+        db_sess.rollback()
+        raise
+    finally:
+        db_sess.close()
+
+
+# Создание асинхронной ссесии с БД
+def create_async_session() -> AsyncSession:
+    global __async_factory
+    return __async_factory()
+
+
+# Асинхронная сессия на время запроса, всегда закрывается
+async def get_async_session():
+    """FastAPI dependency that yields an AsyncSession and always closes it, rolling back on error"""
+    async with create_async_session() as db_sess:
+        try:
+            yield db_sess
+        except Exception:
+            await db_sess.rollback()
+            raise
+
+
+def _pool_status(engine, metrics: PoolMetrics) -> dict:
+    status = metrics.as_dict()
+    if engine is not None:
+        pool = engine.pool
+        status.update({
+            'size': pool.size(),
+            'checked_in': pool.checkedin(),
+            'checked_out': pool.checkedout(),
+            'overflow': pool.overflow(),
+        })
+    return status
+
+
+# Состояние пулов соединений
+def pool_status() -> dict:
+    """Current occupancy plus checkout and wait counters of the sync and async pools"""
+    return {
+        'sync': _pool_status(__engine, pool_metrics),
+        'async': _pool_status(__async_engine.sync_engine if __async_engine else None, async_pool_metrics),
+    }
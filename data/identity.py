@@ -0,0 +1,43 @@
+import sqlalchemy
+from sqlalchemy import DDL, event
+from .db_session import SqlAlchemyBase
+from .teacher import Teacher
+from .student import Student
+
+
+# Единый индекс учителей и учеников по code и tg_user_id.
+# View over both tables, so it never goes out of sync on tg_auth, code regeneration, patch or delete:
+# a lookup is one round trip that probes the unique indexes of teachers and students.
+IDENTITY_VIEW = DDL("""
+CREATE OR REPLACE VIEW identities AS
+    SELECT 'teacher' AS type, id, code, tg_user_id, name, surname, patronymic, class_name, school_name
+    FROM teachers
+    UNION ALL
+    SELECT 'student' AS type, id, code, tg_user_id, name, surname, patronymic, class_name, school_name
+    FROM students
+""")
+event.listen(SqlAlchemyBase.metadata, 'after_create', IDENTITY_VIEW)
+
+# view is described in own metadata, so create_all does not create it as a table
+identities = sqlalchemy.Table(
+    'identities', sqlalchemy.MetaData(),
+    sqlalchemy.Column('type', sqlalchemy.String),  # teacher or student
+    sqlalchemy.Column('id', sqlalchemy.Integer),  # teacher or student id
+    sqlalchemy.Column('code', sqlalchemy.String),  # unique code
+    sqlalchemy.Column('tg_user_id', sqlalchemy.Integer),  # telegram id
+    sqlalchemy.Column('name', sqlalchemy.String),
+    sqlalchemy.Column('surname', sqlalchemy.String),
+    sqlalchemy.Column('patronymic', sqlalchemy.String),
+    sqlalchemy.Column('class_name', sqlalchemy.String),
+    sqlalchemy.Column('school_name', sqlalchemy.String),
+)
+
+
+def identity_query(code: str = None, tg_user_id: int = None):
+    """Select of teacher or student with given code or tg user id, teacher goes first"""
+    query = sqlalchemy.select(identities)
+    if not (code is None):
+        query = query.where(identities.c.code == code)
+    else:
+        query = query.where(identities.c.tg_user_id == tg_user_id)
+    return query.order_by(identities.c.type.desc()).limit(1)
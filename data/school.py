@@ -1,4 +1,5 @@
 import sqlalchemy
+from sqlalchemy import DDL, event
 from sqlalchemy.orm import relationship
 from .db_session import SqlAlchemyBase
 from sqlalchemy_serializer import SerializerMixin
@@ -9,5 +10,16 @@ class School(SqlAlchemyBase, SerializerMixin):
 
     name = sqlalchemy.Column(sqlalchemy.String, unique=True, primary_key=True)  # school name
     link = sqlalchemy.Column(sqlalchemy.String)  # link to school google spreadsheets
-    teachers = relationship("Teacher", back_populates='school', foreign_keys='Teacher.school_name')  # list of teachers
-    students = relationship("Student", back_populates='school', foreign_keys='Student.school_name')  # list of students
+    link_checked = sqlalchemy.Column(sqlalchemy.Boolean, default=True,
+                                     server_default=sqlalchemy.true())  # false until link is opened by outbox worker
+    # big collections stay lazy, routes query teachers and students by school_name instead of walking them
+    teachers = relationship("Teacher", back_populates='school', foreign_keys='Teacher.school_name',
+                            lazy='select')  # list of teachers
+    students = relationship("Student", back_populates='school', foreign_keys='Student.school_name',
+                            lazy='select')  # list of students
+
+
+# create_all does not add columns to existing table
+event.listen(SqlAlchemyBase.metadata, 'after_create', DDL(
+    'ALTER TABLE schools ADD COLUMN IF NOT EXISTS link_checked BOOLEAN NOT NULL DEFAULT true'
+))
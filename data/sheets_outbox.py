@@ -0,0 +1,18 @@
+import datetime
+import sqlalchemy
+from .db_session import SqlAlchemyBase
+from sqlalchemy_serializer import SerializerMixin
+
+
+class SheetsOutbox(SqlAlchemyBase, SerializerMixin):
+    __tablename__ = 'sheets_outbox'
+
+    id = sqlalchemy.Column(sqlalchemy.Integer, primary_key=True, autoincrement=True)  # id
+    kind = sqlalchemy.Column(sqlalchemy.String)  # operation type, e.g. absent
+    link = sqlalchemy.Column(sqlalchemy.String)  # link to school google spreadsheets
+    payload = sqlalchemy.Column(sqlalchemy.JSON)  # operation arguments
+    attempts = sqlalchemy.Column(sqlalchemy.Integer, default=0)  # failed attempts count
+    last_error = sqlalchemy.Column(sqlalchemy.String, nullable=True)  # last failure message
+    created_at = sqlalchemy.Column(sqlalchemy.DateTime, default=datetime.datetime.now)  # enqueue time
+    next_attempt_at = sqlalchemy.Column(sqlalchemy.DateTime, default=datetime.datetime.now,
+                                        index=True)  # row is not sent before this time
@@ -1,4 +1,5 @@
 import sqlalchemy
+from sqlalchemy import DDL, event
 from sqlalchemy.orm import relationship
 from .db_session import SqlAlchemyBase
 from sqlalchemy_serializer import SerializerMixin
@@ -13,8 +14,18 @@ class Student(SqlAlchemyBase, SerializerMixin):
     surname = sqlalchemy.Column(sqlalchemy.String)  # student surname
     patronymic = sqlalchemy.Column(sqlalchemy.String, nullable=True)  # student patronymic
     class_name = sqlalchemy.Column(sqlalchemy.String, sqlalchemy.ForeignKey('teachers.class_name'))  # class name
-    teacher = relationship('Teacher', foreign_keys=[class_name])  # student teacher
+    teacher = relationship('Teacher', foreign_keys=[class_name], lazy='select')  # student teacher
     code = sqlalchemy.Column(sqlalchemy.String, unique=True)  # student unique code
     school_name = sqlalchemy.Column(sqlalchemy.String, sqlalchemy.ForeignKey('schools.name'))  # student school name
-    school = relationship('School', foreign_keys=[school_name])  # student school
-    absents = relationship("Absent", back_populates='student', foreign_keys='Absent.student_id')  # student absent list
+    school = relationship('School', foreign_keys=[school_name], lazy='joined')  # student school, needed for link
+    absents = relationship("Absent", back_populates='student', foreign_keys='Absent.student_id',
+                           lazy='select')  # student absent list, routes query absents by student_id instead
+    sheet_row = sqlalchemy.Column(sqlalchemy.Integer, nullable=True)  # row of student in google spreadsheet
+    sheet_fingerprint = sqlalchemy.Column(sqlalchemy.String, nullable=True)  # hash of sheet row, see roster_sync
+
+
+# create_all does not add columns to existing table
+event.listen(SqlAlchemyBase.metadata, 'after_create', DDL(
+    'ALTER TABLE students ADD COLUMN IF NOT EXISTS sheet_row INTEGER, '
+    'ADD COLUMN IF NOT EXISTS sheet_fingerprint VARCHAR'
+))
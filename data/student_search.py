@@ -0,0 +1,45 @@
+import sqlalchemy
+from sqlalchemy import DDL, event
+from .db_session import SqlAlchemyBase
+from .student import Student
+
+
+# Нормализованное полное имя ученика для нечёткого поиска.
+# Index and queries use the same literal expression, otherwise postgres does not match them.
+SEARCH_NAME_SQL = ("replace(lower(coalesce(students.surname, '') || ' ' || coalesce(students.name, '') || ' ' || "
+                   "coalesce(students.patronymic, '')), 'ё', 'е')")
+SEARCH_NAME = sqlalchemy.literal_column(SEARCH_NAME_SQL)
+
+# trigram GIN index, IF NOT EXISTS makes it appear on already created databases too
+event.listen(SqlAlchemyBase.metadata, 'before_create', DDL('CREATE EXTENSION IF NOT EXISTS pg_trgm'))
+event.listen(SqlAlchemyBase.metadata, 'after_create', DDL(
+    f'CREATE INDEX IF NOT EXISTS ix_students_search_name ON students USING gin (({SEARCH_NAME_SQL}) gin_trgm_ops)'
+))
+
+
+def normalize_name(name: str) -> str:
+    """Search key normalized the same way as SEARCH_NAME"""
+    return ' '.join(name.lower().replace('ё', 'е').split())
+
+
+def search_students(db_sess, key: str, limit: int, threshold: float, class_name: str = None,
+                    school_name: str = None) -> list:
+    """
+        Students whose full name is similar to key, most similar first, one query on trigram index
+
+        threshold: float - minimal word similarity, 0..1
+    """
+    key = normalize_name(key)
+    rank = sqlalchemy.func.word_similarity(key, SEARCH_NAME)
+
+    query = sqlalchemy.select(Student).where(sqlalchemy.literal(key).op('<%')(SEARCH_NAME))
+    if not (class_name is None):
+        query = query.where(Student.class_name == class_name)
+    if not (school_name is None):
+        query = query.where(Student.school_name == school_name)
+    query = query.order_by(rank.desc(), Student.surname, Student.name).limit(limit)
+
+    # <% uses pg_trgm.word_similarity_threshold, set only for current transaction
+    db_sess.execute(sqlalchemy.select(sqlalchemy.func.set_config('pg_trgm.word_similarity_threshold',
+                                                                 str(threshold), True)))
+    return db_sess.execute(query).scalars().all()
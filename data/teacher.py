@@ -1,4 +1,5 @@
 import sqlalchemy
+from sqlalchemy import DDL, event
 from sqlalchemy.orm import relationship
 from .db_session import SqlAlchemyBase
 from sqlalchemy_serializer import SerializerMixin
@@ -15,5 +16,15 @@ class Teacher(SqlAlchemyBase, SerializerMixin):
     class_name = sqlalchemy.Column(sqlalchemy.String, unique=True)  # teacher class name
     code = sqlalchemy.Column(sqlalchemy.String, unique=True)  # teacher unique code
     school_name = sqlalchemy.Column(sqlalchemy.String, sqlalchemy.ForeignKey('schools.name'))  # teacher school name
-    school = relationship('School', foreign_keys=[school_name])  # teacher school
-    students = relationship("Student", back_populates='teacher', foreign_keys='Student.class_name')  # teacher student
+    school = relationship('School', foreign_keys=[school_name], lazy='joined')  # teacher school, needed for link
+    students = relationship("Student", back_populates='teacher', foreign_keys='Student.class_name',
+                            lazy='select')  # teacher students, loaded by one select for one teacher
+    sheet_row = sqlalchemy.Column(sqlalchemy.Integer, nullable=True)  # row of teacher in google spreadsheet
+    sheet_fingerprint = sqlalchemy.Column(sqlalchemy.String, nullable=True)  # hash of sheet row, see roster_sync
+
+
+# create_all does not add columns to existing table
+event.listen(SqlAlchemyBase.metadata, 'after_create', DDL(
+    'ALTER TABLE teachers ADD COLUMN IF NOT EXISTS sheet_row INTEGER, '
+    'ADD COLUMN IF NOT EXISTS sheet_fingerprint VARCHAR'
+))
@@ -0,0 +1,81 @@
+import datetime
+
+from tools.settings import SHEETS_ABSENT_LAYOUT, SHEETS_ABSENT_TAB_ROWS
+
+
+DAILY = 'daily'  # tab per date, titled 2022-02-14
+WEEKLY = 'weekly'  # tab per ISO week, titled 2022-W07, rows start with date
+MONTHLY = 'monthly'  # tab per month, titled 2022-02, rows start with date
+LAYOUTS = (DAILY, WEEKLY, MONTHLY)
+
+# header of absents worksheet, rows are: class name, surname, name, patronymic, reason, proof, code
+ABSENT_HEADER = ['Класс', 'Фамилия', 'Имя', 'Отчество', 'Причина', 'Доказательства']
+
+
+class AbsentLayout:
+    """
+        Layout of absent worksheets shared by synchronous and async Sheets clients
+
+        mode: str - daily, weekly or monthly, weekly and monthly tabs get date column before class name
+        tab_rows: int - rows of new tab, Sheets adds rows when append does not fit, so tab grows on demand
+    """
+    def __init__(self, mode: str, tab_rows: int):
+        if mode not in LAYOUTS:
+            raise ValueError(f'Unknown absent layout {mode}, expected one of {", ".join(LAYOUTS)}')
+        self.mode = mode
+        self.tab_rows = tab_rows
+
+    def title(self, date: datetime.date) -> str:
+        """Title of tab that keeps absents of date"""
+        if self.mode == WEEKLY:
+            year, week, _ = date.isocalendar()
+            return f'{year}-W{week:02d}'
+        if self.mode == MONTHLY:
+            return date.strftime('%Y-%m')
+        return str(date)
+
+    @property
+    def header(self) -> list:
+        return ABSENT_HEADER if self.mode == DAILY else ['Дата'] + ABSENT_HEADER
+
+    @property
+    def cols(self) -> int:
+        return len(self.header) + 1  # code column has no header
+
+    def row(self, date: datetime.date, row: list) -> list:
+        """Worksheet row of absent row [class name, surname, name, patronymic, reason, proof, code]"""
+        return row if self.mode == DAILY else [str(date)] + row
+
+    def next_tab_date(self, today: datetime.date):
+        """
+            Tomorrow if its absents go to another weekly or monthly tab than today's ones, otherwise None
+
+            Daily tab is never prepared ahead, it would add a tab a day to every school, also to schools without
+            absents that day, so it is created by the first absent of its date
+        """
+        if self.mode == DAILY:
+            return None
+        tomorrow = today + datetime.timedelta(days=1)
+        return tomorrow if self.title(tomorrow) != self.title(today) else None
+
+    def add_sheet_request(self, sheet_id: int, title: str) -> dict:
+        return {'addSheet': {'properties': {'sheetId': sheet_id, 'title': title,
+                                            'gridProperties': {'rowCount': self.tab_rows, 'columnCount': self.cols}}}}
+
+    def style_requests(self, sheet_id: int) -> list:
+        """batchUpdate requests that style new tab and write its header"""
+        return [
+            {'repeatCell': {'range': {'sheetId': sheet_id},
+                            'cell': {'userEnteredFormat': {'textFormat': {'fontSize': 12}}},
+                            'fields': 'userEnteredFormat.textFormat.fontSize'}},
+            {'repeatCell': {'range': {'sheetId': sheet_id, 'startRowIndex': 0, 'endRowIndex': 1},
+                            'cell': {'userEnteredFormat': {'textFormat': {'fontSize': 14, 'bold': True}}},
+                            'fields': 'userEnteredFormat.textFormat(fontSize,bold)'}},
+            {'updateCells': {'start': {'sheetId': sheet_id, 'rowIndex': 0, 'columnIndex': 0},
+                             'rows': [{'values': [{'userEnteredValue': {'stringValue': value}}
+                                                  for value in self.header]}],
+                             'fields': 'userEnteredValue'}},
+        ]
+
+
+absent_layout = AbsentLayout(SHEETS_ABSENT_LAYOUT, SHEETS_ABSENT_TAB_ROWS)
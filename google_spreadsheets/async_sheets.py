@@ -0,0 +1,245 @@
+import asyncio
+import datetime
+import time
+import random
+
+from urllib.parse import quote
+
+import httpx
+from google.auth.transport.requests import Request
+from google.oauth2.service_account import Credentials
+from gspread.auth import DEFAULT_SCOPES
+from gspread.exceptions import NoValidUrlKeyFound, APIError
+from gspread.utils import extract_id_from_url
+
+from tools.error_book import TableLinkError
+from tools.settings import SHEETS_TABLE_CACHE_SIZE, SHEETS_WORKSHEET_CACHE_TTL, SHEETS_CREDENTIALS, \
+    SHEETS_TIMEOUT, SHEETS_RETRIES, SHEETS_RETRY_BASE_DELAY, SHEETS_RETRY_MAX_DELAY, SHEETS_ASYNC, \
+    SHEETS_ASYNC_MAX_CONNECTIONS, SHEETS_BACKEND
+from tools.ttl_cache import TTLCache
+from google_spreadsheets.circuit_breaker import CircuitBreaker
+from google_spreadsheets.google_spread_sheets import google_spread_sheets, sheets_limiter, sheets_breaker, FlushMetrics
+from google_spreadsheets.absent_layout import AbsentLayout, absent_layout
+from google_spreadsheets.rate_limiter import SheetsRateLimiter, sheets_priority, backoff_delay, request_retries, \
+    PRIORITY_HIGH, PRIORITY_LOW, RETRY_STATUS_CODES, APPEND_RETRY_STATUS_CODES
+
+
+SHEETS_API_URL = 'https://sheets.googleapis.com/v4/spreadsheets/'
+
+
+class AsyncSheetsClient:
+    """
+        Sheets REST API v4 client on one keep-alive httpx.AsyncClient shared by all coroutines of event loop
+
+        Access token of service account is refreshed once under asyncio lock when it expires, concurrent calls
+        wait for that refresh instead of starting their own. Calls go through the same CircuitBreaker and
+        SheetsRateLimiter as synchronous client, 429 and 5xx are retried with full jitter exponential backoff,
+        append is retried on 429 only.
+
+        max_connections: int - connection pool size, calls over it wait for free connection
+        transport: httpx.AsyncBaseTransport - optional, e.g. httpx.MockTransport for offline tests
+        credentials: optional google.auth credentials, loaded from file_name on first call if not given
+    """
+    def __init__(self, file_name: str, limiter: SheetsRateLimiter, timeout: float, max_connections: int,
+                 retries: int, retry_base_delay: float, retry_max_delay: float, breaker: CircuitBreaker = None,
+                 transport: httpx.AsyncBaseTransport = None, credentials=None):
+        self.file_name = file_name
+        self.limiter = limiter
+        self.breaker = breaker
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self.retries = retries
+        self.retry_base_delay = retry_base_delay
+        self.retry_max_delay = retry_max_delay
+        self.transport = transport
+        self._credentials = credentials
+        self._client = None
+        self._token_lock = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                timeout=httpx.Timeout(self.timeout, pool=None),
+                limits=httpx.Limits(max_connections=self.max_connections,
+                                    max_keepalive_connections=self.max_connections),
+                transport=self.transport,
+            )
+        return self._client
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+        self._token_lock = None
+
+    async def _token(self) -> str:
+        credentials = self._credentials
+        if credentials is not None and credentials.valid:
+            return credentials.token
+
+        if self._token_lock is None:
+            self._token_lock = asyncio.Lock()
+        async with self._token_lock:
+            if self._credentials is None:
+                self._credentials = Credentials.from_service_account_file(self.file_name, scopes=DEFAULT_SCOPES)
+            if not self._credentials.valid:
+                # google-auth refresh is blocking, it runs once an hour, so thread of default executor is enough
+                await asyncio.get_running_loop().run_in_executor(None, self._credentials.refresh, Request())
+            return self._credentials.token
+
+    def _record(self, success: bool, started_at: float):
+        if self.breaker is None:
+            return
+        if success:
+            self.breaker.record_success(started_at)
+        else:
+            self.breaker.record_failure(started_at)
+
+    async def request(self, method: str, spreadsheet_id: str, path: str = '', idempotent: bool = True,
+                      **kwargs) -> dict:
+        """
+            Call of spreadsheet method, path is appended to spreadsheet url, APIError is raised on error status
+
+            idempotent: bool - False for calls that must not run twice, they are retried on 429 only
+        """
+        retries = request_retries(self.retries)
+        retry_codes = RETRY_STATUS_CODES if idempotent else APPEND_RETRY_STATUS_CODES
+        attempt = 0
+        while True:
+            started_at = None if self.breaker is None else self.breaker.before_call()
+            await self.limiter.acquire_async(spreadsheet_id)
+            headers = {'Authorization': f'Bearer {await self._token()}'}
+            url = SHEETS_API_URL + spreadsheet_id + path
+            try:
+                response = await self.client.request(method, url, headers=headers, **kwargs)
+            except httpx.TransportError:
+                # timeout or connection error is not retried as in synchronous client
+                self._record(False, started_at)
+                raise
+
+            if response.status_code < 400:
+                self._record(True, started_at)
+                return response.json()
+
+            retry = response.status_code in retry_codes and attempt < retries
+            self.limiter.metrics.add_error(response.status_code, retry)
+            self._record(response.status_code not in RETRY_STATUS_CODES, started_at)
+            if not retry:
+                raise APIError(response)
+
+            await asyncio.sleep(backoff_delay(attempt, self.retry_base_delay, self.retry_max_delay))
+            attempt += 1
+
+    async def sheets(self, spreadsheet_id: str) -> list:
+        """Properties of worksheets in sheet order"""
+        data = await self.request('GET', spreadsheet_id, params={'fields': 'sheets.properties'})
+        return [sheet['properties'] for sheet in data.get('sheets', [])]
+
+    async def values_append(self, spreadsheet_id: str, range_name: str, values: list) -> dict:
+        return await self.request('POST', spreadsheet_id, f'/values/{quote(range_name, safe="")}:append',
+                                  idempotent=False, params={'valueInputOption': 'RAW'}, json={'values': values})
+
+    async def batch_update(self, spreadsheet_id: str, requests: list) -> dict:
+        return await self.request('POST', spreadsheet_id, ':batchUpdate', json={'requests': requests})
+
+
+def _quote_title(title: str) -> str:
+    return "'" + title.replace("'", "''") + "'"
+
+
+class AsyncGoogleSpreadSheetsApi:
+    """
+        Coroutine version of absent writes of GoogleSpreadSheetsApi on AsyncSheetsClient, so absents of many
+        schools are sent concurrently from one event loop instead of one thread per call in flight.
+        Code and link check rows of outbox are few, they stay on synchronous client.
+
+        Worksheets are addressed by title in A1 ranges, so only worksheet properties are cached.
+        New absent worksheet is added, styled and gets its header in one batchUpdate call.
+    """
+    def __init__(self, client: AsyncSheetsClient, flush_metrics: FlushMetrics = None,
+                 layout: AbsentLayout = absent_layout):
+        self.client = client
+        self.layout = layout
+        self.flush_metrics = flush_metrics or FlushMetrics()
+        self._worksheets = TTLCache(SHEETS_TABLE_CACHE_SIZE, SHEETS_WORKSHEET_CACHE_TTL)  # link -> {title: props}
+
+    async def aclose(self):
+        await self.client.aclose()
+
+    @staticmethod
+    def _spreadsheet_id(link: str) -> str:
+        try:
+            return extract_id_from_url(link)
+        except NoValidUrlKeyFound:
+            raise TableLinkError(link)
+
+    async def _worksheet_index(self, link: str, refresh: bool = False) -> dict:
+        """Worksheet properties of spreadsheet by title in sheet order, refreshed after ttl or on demand"""
+        index = None if refresh else self._worksheets.get(link)
+        if index is None:
+            index = {sheet['title']: sheet for sheet in await self.client.sheets(self._spreadsheet_id(link))}
+            self._worksheets.set(link, index)
+        return index
+
+    async def _worksheet(self, link: str, position: int, refresh: bool = False) -> dict:
+        return list((await self._worksheet_index(link, refresh)).values())[position]
+
+    async def _worksheet_title(self, link: str, position: int) -> str:
+        return (await self._worksheet(link, position))['title']
+
+    async def _date_worksheet(self, link: str, title: str):
+        """Create and style absent worksheet with given title if spreadsheet has no such worksheet"""
+        if title in await self._worksheet_index(link) or title in await self._worksheet_index(link, refresh=True):
+            return
+
+        index = self._worksheets.get(link) or {}
+        sheet_ids = {sheet['sheetId'] for sheet in index.values()}
+        sheet_id = random.randint(1, 2 ** 31 - 1)
+        while sheet_id in sheet_ids:
+            sheet_id = random.randint(1, 2 ** 31 - 1)
+        try:
+            await self.client.batch_update(self._spreadsheet_id(link), [self.layout.add_sheet_request(sheet_id, title),
+                                                                        *self.layout.style_requests(sheet_id)])
+        except APIError:
+            # worksheet could be added by another process meanwhile
+            if title not in await self._worksheet_index(link, refresh=True):
+                raise
+            return
+        self._worksheets.set(link, {**index, title: {'sheetId': sheet_id, 'title': title}})
+
+    def forget(self, link: str):
+        self._worksheets.pop(link)
+
+    async def google_sheets_student_absents(self, link: str, date: datetime.date, rows: list):
+        """Adding several student absents of one date into google sheet with one append call"""
+        start = time.perf_counter()
+        title = self.layout.title(date)
+        try:
+            with sheets_priority(PRIORITY_HIGH):
+                await self._date_worksheet(link, title)
+                await self.client.values_append(self._spreadsheet_id(link), f'{_quote_title(title)}!A1',
+                                                [self.layout.row(date, row) for row in rows])
+        except APIError:
+            self.forget(link)
+            raise
+        self.flush_metrics.add_flush(len(rows), time.perf_counter() - start)
+
+    async def google_sheets_prepare_absent_worksheet(self, link: str, date: datetime.date):
+        """Creating absent worksheet of date ahead of time, so first absent of period is not slowed down"""
+        try:
+            with sheets_priority(PRIORITY_LOW):
+                await self._date_worksheet(link, self.layout.title(date))
+        except APIError:
+            self.forget(link)
+            raise
+
+
+# talks to Google over http, so fake backend keeps synchronous client
+async_google_spread_sheets = None
+if SHEETS_ASYNC and SHEETS_BACKEND == 'gspread':
+    async_google_spread_sheets = AsyncGoogleSpreadSheetsApi(
+        AsyncSheetsClient(SHEETS_CREDENTIALS, sheets_limiter, SHEETS_TIMEOUT, SHEETS_ASYNC_MAX_CONNECTIONS,
+                          SHEETS_RETRIES, SHEETS_RETRY_BASE_DELAY, SHEETS_RETRY_MAX_DELAY, sheets_breaker),
+        google_spread_sheets.flush_metrics
+    )
@@ -0,0 +1,340 @@
+import abc
+import itertools
+import json
+import os
+import random
+import re
+import threading
+import time
+
+from collections import deque
+
+import gspread
+import requests
+from gspread.exceptions import APIError, WorksheetNotFound
+from gspread.utils import a1_to_rowcol, extract_id_from_url
+
+from tools.settings import SHEETS_BACKEND, SHEETS_CREDENTIALS, SHEETS_FAKE_LATENCY, SHEETS_FAKE_ERROR_RATE, \
+    SHEETS_FAKE_QUOTA, SHEETS_FAKE_PATH, SHEETS_TIMEOUT
+
+
+class SheetsBackend(abc.ABC):
+    """
+        Google Sheets client used by GoogleSpreadSheetsApi
+
+        open_by_url returns spreadsheet object with gspread interface: worksheets, worksheet, get_worksheet,
+        add_worksheet, batch_update, values_batch_update and worksheets with id, title, append_row, append_rows,
+        update, batch_update, find, get, get_all_values and format
+    """
+    @abc.abstractmethod
+    def open_by_url(self, link: str):
+        pass
+
+
+def _set_timeout(session: requests.Session, timeout: float):
+    """Patch session so every request without explicit timeout uses given one, gspread does not pass any"""
+    request = session.request
+
+    def request_with_timeout(method, url, *args, **kwargs):
+        if kwargs.get('timeout') is None:
+            kwargs['timeout'] = timeout
+        return request(method, url, *args, **kwargs)
+
+    session.request = request_with_timeout
+
+
+class GspreadBackend(SheetsBackend):
+    """Real Google Sheets through gspread, service account is authorized on first call"""
+    def __init__(self, file_name: str, timeout: float):
+        self.file_name = file_name
+        self.timeout = timeout
+        self._gc = None
+        self._lock = threading.Lock()
+
+    @property
+    def gc(self) -> gspread.Client:
+        with self._lock:
+            if self._gc is None:
+                self._gc = gspread.service_account(filename=self.file_name)
+                _set_timeout(self._gc.session, self.timeout)
+            return self._gc
+
+    def open_by_url(self, link: str):
+        return self.gc.open_by_url(link)
+
+
+class _FakeResponse:
+    """Minimal requests.Response replacement, enough for gspread APIError"""
+    def __init__(self, code: int, message: str, status: str):
+        self.status_code = code
+        self.text = message
+        self._error = {'code': code, 'message': message, 'status': status}
+
+    def json(self):
+        return {'error': self._error}
+
+
+def _parse_range(name: str):
+    """A1 range to (first row, first col, last row, last col), last row is None for open ranges like A2:E"""
+    if '!' in name:
+        name = name.split('!', 1)[1]
+    first, _, last = name.partition(':')
+    last = last or first
+
+    row, col = a1_to_rowcol(first if re.search(r'\d', first) else first + '1')
+    if re.search(r'\d', last):
+        last_row, last_col = a1_to_rowcol(last)
+    else:
+        last_row, last_col = None, a1_to_rowcol(last + '1')[1]
+    return row, col, last_row, last_col
+
+
+class FakeWorksheet:
+    def __init__(self, spreadsheet, title: str, rows: list = None):
+        self.spreadsheet = spreadsheet
+        self.id = next(spreadsheet.sheet_ids)
+        self.title = title
+        self.rows = rows if rows is not None else []
+
+    @property
+    def row_count(self) -> int:
+        """Grid of fake worksheet is as long as its data"""
+        return len(self.rows)
+
+    def _call(self):
+        self.spreadsheet.backend.call()
+
+    def _set(self, row: int, col: int, value):
+        while len(self.rows) < row:
+            self.rows.append([])
+        line = self.rows[row - 1]
+        while len(line) < col:
+            line.append('')
+        line[col - 1] = '' if value is None else str(value)
+
+    def _write(self, range_name: str, values):
+        if not isinstance(values, list):
+            values = [[values]]
+        row, col, _, _ = _parse_range(range_name)
+        for i, line in enumerate(values):
+            for j, value in enumerate(line):
+                self._set(row + i, col + j, value)
+
+    def format(self, range_name: str, cell_format: dict):
+        self._call()
+
+    def append_row(self, values: list, **kwargs):
+        self.append_rows([values])
+
+    def append_rows(self, values: list, **kwargs):
+        self._call()
+        with self.spreadsheet.backend.lock:
+            for line in values:
+                self.rows.append(['' if value is None else str(value) for value in line])
+        self.spreadsheet.backend.save()
+
+    def update(self, range_name: str, values=None, **kwargs):
+        self._call()
+        with self.spreadsheet.backend.lock:
+            self._write(range_name, values)
+        self.spreadsheet.backend.save()
+
+    def batch_update(self, data: list, **kwargs):
+        self._call()
+        with self.spreadsheet.backend.lock:
+            for item in data:
+                self._write(item['range'], item['values'])
+        self.spreadsheet.backend.save()
+
+    def find(self, query: str, in_row: int = None, in_column: int = None):
+        self._call()
+        for i, line in enumerate(self.rows):
+            for j, value in enumerate(line):
+                if value == query and in_row in (None, i + 1) and in_column in (None, j + 1):
+                    return gspread.Cell(i + 1, j + 1, value)
+        return None
+
+    def get(self, range_name: str = None, **kwargs) -> list:
+        self._call()
+        return self._values(range_name)
+
+    def _values(self, range_name: str = None) -> list:
+        if range_name is None:
+            return [list(line) for line in self.rows]
+
+        row, col, last_row, last_col = _parse_range(range_name)
+        last_row = len(self.rows) if last_row is None else min(last_row, len(self.rows))
+        values = [self.rows[i][col - 1:last_col] for i in range(row - 1, last_row)]
+        while values and not any(values[-1]):
+            values.pop()  # Sheets API does not return trailing empty rows
+        return values
+
+    def get_all_values(self) -> list:
+        return self.get()
+
+
+class FakeSpreadsheet:
+    def __init__(self, backend, spreadsheet_id: str):
+        self.backend = backend
+        self.id = spreadsheet_id
+        self.title = spreadsheet_id
+        self.sheet_ids = itertools.count()
+        self._worksheets = []
+
+    def worksheets(self) -> list:
+        self.backend.call()
+        return list(self._worksheets)
+
+    def worksheet(self, title: str) -> FakeWorksheet:
+        self.backend.call()
+        for worksheet in self._worksheets:
+            if worksheet.title == title:
+                return worksheet
+        raise WorksheetNotFound(title)
+
+    def get_worksheet(self, index: int):
+        self.backend.call()
+        return self._worksheets[index] if index < len(self._worksheets) else None
+
+    def add_worksheet(self, title: str, rows: int = 1000, cols: int = 26, **kwargs) -> FakeWorksheet:
+        self.backend.call()
+        with self.backend.lock:
+            if any(worksheet.title == title for worksheet in self._worksheets):
+                raise self.backend.error(400, f'A sheet with the name "{title}" already exists', 'INVALID_ARGUMENT')
+            worksheet = FakeWorksheet(self, title)
+            self._worksheets.append(worksheet)
+        self.backend.save()
+        return worksheet
+
+    def batch_update(self, body: dict):
+        """Spreadsheet batchUpdate, only updateCells requests change fake sheets, formatting is ignored"""
+        self.backend.call()
+        with self.backend.lock:
+            for request in body.get('requests', []):
+                if 'updateCells' not in request:
+                    continue
+                start = request['updateCells']['start']
+                worksheet = next(ws for ws in self._worksheets if ws.id == start['sheetId'])
+                for i, line in enumerate(request['updateCells']['rows']):
+                    for j, cell in enumerate(line['values']):
+                        value = next(iter(cell.get('userEnteredValue', {'': ''}).values()))
+                        worksheet._set(start['rowIndex'] + i + 1, start['columnIndex'] + j + 1, value)
+        self.backend.save()
+
+    def _range_worksheet(self, range_name: str) -> tuple:
+        """Worksheet of A1 range with sheet title, first worksheet if title is omitted, and range without title"""
+        title, _, range_name = range_name.rpartition('!')
+        title = title.strip("'").replace("''", "'")
+        worksheet = next(ws for ws in self._worksheets if ws.title == title) if title else self._worksheets[0]
+        return worksheet, range_name
+
+    def values_batch_get(self, ranges: list, params: dict = None) -> dict:
+        self.backend.call()
+        value_ranges = []
+        with self.backend.lock:
+            for range_name in ranges:
+                worksheet, cells = self._range_worksheet(range_name)
+                values = worksheet._values(cells)
+                value_ranges.append({'range': range_name, 'values': values} if values else {'range': range_name})
+        return {'spreadsheetId': self.id, 'valueRanges': value_ranges}
+
+    def values_batch_update(self, body: dict, **kwargs):
+        self.backend.call()
+        with self.backend.lock:
+            for item in body.get('data', []):
+                worksheet, range_name = self._range_worksheet(item['range'])
+                worksheet._write(range_name, item['values'])
+        self.backend.save()
+
+
+class FakeSheetsBackend(SheetsBackend):
+    """
+        In-memory Google Sheets for offline tests and load tests, optionally persisted to json file
+
+        latency: float - seconds added to every API call, call is failed with ReadTimeout if latency exceeds timeout
+        error_rate: float - probability of 503 error on API call
+        quota_per_minute: int - API calls allowed per minute, more calls get 429, 0 - unlimited
+        path: str - json file to load and save spreadsheets, empty - memory only
+    """
+    def __init__(self, latency: float = 0.0, error_rate: float = 0.0, quota_per_minute: int = 0, path: str = '',
+                 timeout: float = 0.0):
+        self.latency = latency
+        self.timeout = timeout
+        self.error_rate = error_rate
+        self.quota_per_minute = quota_per_minute
+        self.path = path
+        self.lock = threading.RLock()
+        self.spreadsheets = {}
+        self.calls = 0
+        self._call_times = deque()
+        self._random = random.Random()
+        self.load()
+
+    @staticmethod
+    def error(code: int, message: str, status: str) -> APIError:
+        return APIError(_FakeResponse(code, message, status))
+
+    def call(self):
+        """Emulate one API request: latency, quota and random errors"""
+        if self.latency:
+            if self.timeout and self.latency > self.timeout:
+                time.sleep(self.timeout)
+                raise requests.exceptions.ReadTimeout(f'Fake sheets call timed out after {self.timeout} seconds')
+            time.sleep(self.latency)
+
+        with self.lock:
+            self.calls += 1
+            if self.quota_per_minute:
+                now = time.monotonic()
+                while self._call_times and self._call_times[0] <= now - 60:
+                    self._call_times.popleft()
+                if len(self._call_times) >= self.quota_per_minute:
+                    raise self.error(429, 'Quota exceeded for quota metric', 'RESOURCE_EXHAUSTED')
+                self._call_times.append(now)
+
+            if self.error_rate and self._random.random() < self.error_rate:
+                raise self.error(503, 'The service is currently unavailable.', 'UNAVAILABLE')
+
+    def create_spreadsheet(self, spreadsheet_id: str, titles: tuple = ('Учителя', 'Ученики')) -> FakeSpreadsheet:
+        """Create spreadsheet with teachers and students worksheets"""
+        with self.lock:
+            spreadsheet = FakeSpreadsheet(self, spreadsheet_id)
+            spreadsheet._worksheets = [FakeWorksheet(spreadsheet, title) for title in titles]
+            self.spreadsheets[spreadsheet_id] = spreadsheet
+        return spreadsheet
+
+    def open_by_url(self, link: str) -> FakeSpreadsheet:
+        spreadsheet_id = extract_id_from_url(link)
+        self.call()
+        with self.lock:
+            spreadsheet = self.spreadsheets.get(spreadsheet_id)
+            if spreadsheet is None:
+                spreadsheet = self.create_spreadsheet(spreadsheet_id)
+        return spreadsheet
+
+    def load(self):
+        if not (self.path and os.path.exists(self.path)):
+            return
+        with open(self.path, encoding='utf-8') as file:
+            data = json.load(file)
+        for spreadsheet_id, worksheets in data.items():
+            spreadsheet = FakeSpreadsheet(self, spreadsheet_id)
+            spreadsheet._worksheets = [FakeWorksheet(spreadsheet, title, rows) for title, rows in worksheets]
+            self.spreadsheets[spreadsheet_id] = spreadsheet
+
+    def save(self):
+        if not self.path:
+            return
+        with self.lock:
+            data = {spreadsheet_id: [[worksheet.title, worksheet.rows] for worksheet in spreadsheet._worksheets]
+                    for spreadsheet_id, spreadsheet in self.spreadsheets.items()}
+            with open(self.path, 'w', encoding='utf-8') as file:
+                json.dump(data, file, ensure_ascii=False)
+
+
+def create_backend() -> SheetsBackend:
+    """Backend selected by SHEETS_BACKEND setting: gspread or fake"""
+    if SHEETS_BACKEND == 'fake':
+        return FakeSheetsBackend(SHEETS_FAKE_LATENCY, SHEETS_FAKE_ERROR_RATE, SHEETS_FAKE_QUOTA, SHEETS_FAKE_PATH,
+                                 SHEETS_TIMEOUT)
+    return GspreadBackend(SHEETS_CREDENTIALS, SHEETS_TIMEOUT)
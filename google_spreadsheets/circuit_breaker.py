@@ -0,0 +1,88 @@
+import threading
+import time
+
+from tools.error_book import SheetsUnavailableError
+
+
+class CircuitBreaker:
+    """
+        Circuit breaker of Google Sheets calls shared by all threads of worker
+
+        closed - calls go through, failure_threshold failures in a row open the circuit
+        open - calls fail at once with SheetsUnavailableError for reset_timeout seconds
+        half_open - one trial call goes through, its success closes the circuit and failure opens it again
+
+        Outcome of call is reported with start time returned by before_call, calls that started before
+        the circuit opened are ignored until it is closed again, so late success of slow call does not close it
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trial_started_at = 0.0
+        self.opened = 0
+        self.rejected = 0
+
+    def before_call(self) -> float:
+        """Raise SheetsUnavailableError if call is not allowed now, return start time of allowed call"""
+        with self._lock:
+            now = time.monotonic()
+            if self.state == self.OPEN and now - self.opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                self.trial_started_at = 0.0
+
+            if self.state == self.HALF_OPEN:
+                # trial call that did not report back within reset_timeout is given up
+                if self.trial_started_at and now - self.trial_started_at < self.reset_timeout:
+                    self.rejected += 1
+                    raise SheetsUnavailableError(self.reset_timeout - (now - self.trial_started_at))
+                self.trial_started_at = now
+            elif self.state == self.OPEN:
+                self.rejected += 1
+                raise SheetsUnavailableError(self.reset_timeout - (now - self.opened_at))
+            return now
+
+    def _stale(self, started_at: float) -> bool:
+        """True if call started before the circuit that is not closed was opened, called under lock"""
+        return self.state != self.CLOSED and started_at < self.opened_at
+
+    def record_success(self, started_at: float):
+        with self._lock:
+            if self._stale(started_at):
+                return
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def record_failure(self, started_at: float):
+        with self._lock:
+            if self._stale(started_at):
+                return
+            self.failures += 1
+            if self.state == self.HALF_OPEN or (self.state == self.CLOSED and self.failures >= self.failure_threshold):
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+                self.opened += 1
+
+    def is_open(self) -> bool:
+        with self._lock:
+            return self.state == self.OPEN and time.monotonic() - self.opened_at < self.reset_timeout
+
+    def status(self) -> dict:
+        with self._lock:
+            retry_after = 0.0
+            if self.state == self.OPEN:
+                retry_after = max(0.0, self.reset_timeout - (time.monotonic() - self.opened_at))
+            return {
+                'state': self.state,
+                'failures': self.failures,
+                'retry_after': round(retry_after, 3),
+                'opened': self.opened,
+                'rejected': self.rejected,
+            }
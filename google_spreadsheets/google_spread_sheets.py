@@ -1,146 +1,296 @@
+import logging
+import math
+import threading
+import time
 import gspread
+import requests
 
 from tools.error_book import *
-from gspread.exceptions import NoValidUrlKeyFound
+from tools.settings import SHEETS_TABLE_CACHE_SIZE, SHEETS_TABLE_CACHE_TTL, SHEETS_WORKSHEET_CACHE_TTL, \
+    SHEETS_READ_CHUNK_ROWS, SHEETS_RATE_PER_MINUTE, SHEETS_SPREADSHEET_RATE_PER_MINUTE, SHEETS_RATE_WAIT_TIMEOUT, \
+    SHEETS_RETRIES, SHEETS_RETRY_BASE_DELAY, SHEETS_RETRY_MAX_DELAY, SHEETS_BREAKER_FAILURES, SHEETS_BREAKER_RESET
+from tools.ttl_cache import TTLCache
+from gspread.exceptions import NoValidUrlKeyFound, APIError
+from gspread.utils import extract_id_from_url
+from google_spreadsheets.absent_layout import AbsentLayout, absent_layout
+from google_spreadsheets.backends import SheetsBackend, create_backend
+from google_spreadsheets.circuit_breaker import CircuitBreaker
+from google_spreadsheets.rate_limiter import SheetsRateLimiter, RateLimitedBackend, sheets_priority, PRIORITY_HIGH, \
+    PRIORITY_LOW
+
+
+# positions of roster worksheets, rows are: class name, surname, name, patronymic, code
+TEACHERS_SHEET = 0
+STUDENTS_SHEET = 1
+
+# errors after which endpoints keep db changes and leave sheet update to outbox worker, if sheets_outage is true
+SHEETS_ERRORS = (SheetsUnavailableError, SheetsThrottledError, APIError, requests.RequestException)
+
+
+def sheets_outage(error: Exception) -> bool:
+    """Function that tell if error means unavailable or throttled Google Sheets, APIError only with 429 or 5xx"""
+    if isinstance(error, APIError):
+        status_code = error.response.status_code
+        return status_code == 429 or status_code >= 500
+    return isinstance(error, SHEETS_ERRORS)
+
+
+def sheets_retry_after(error: Exception) -> int:
+    """Seconds for Retry-After of response to Sheets outage: until breaker trial call, quota minute or breaker reset"""
+    if isinstance(error, SheetsUnavailableError):
+        return max(1, math.ceil(error.retry_after))
+    if isinstance(error, SheetsThrottledError) or (isinstance(error, APIError) and error.response.status_code == 429):
+        return 60
+    return math.ceil(SHEETS_BREAKER_RESET)
+
+
+def resolve_code_rows(code_cells: list, column: list) -> list:
+    """
+        Function that check code cells against values of E column before writing, return (row number, code) list
+
+        Cell given as (row number, code, old code) keeps its row only if that cell still holds old code, otherwise
+        row is found by old code in column, so moved rows and rows with unknown number are written too,
+        cell is dropped if old code is not in column. Cells given as (row number, code) are kept as is
+
+        code_cells: list - (row number, code) or (row number or None, code, old code)
+        column: list - E column values as returned by Sheets API, [[value], ...] from first row
+    """
+    code_rows = {}
+    for row, line in enumerate(column, start=1):
+        if line:
+            code_rows.setdefault(line[0], row)
+
+    resolved = []
+    for row, code, *old_code in code_cells:
+        if old_code:
+            old_code = old_code[0]
+            if row is None or row > len(column) or column[row - 1][:1] != [old_code]:
+                row = code_rows.get(old_code)
+            if row is None:
+                logging.warning(f'Code {old_code} is not found in E column, new code {code} is not written')
+                continue
+        resolved.append((row, code))
+    return resolved
+
+
+class FlushMetrics:
+    """Counters of batched absent appends: number of flushes, rows per flush and flush latency"""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.flushes = 0
+        self.rows = 0
+        self.max_rows = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+
+    def add_flush(self, rows: int, latency: float):
+        with self._lock:
+            self.flushes += 1
+            self.rows += rows
+            self.max_rows = max(self.max_rows, rows)
+            self.latency_total += latency
+            self.latency_max = max(self.latency_max, latency)
+
+    def as_dict(self) -> dict:
+        with self._lock:
+            return {
+                'flushes': self.flushes,
+                'rows': self.rows,
+                'rows_avg': round(self.rows / self.flushes, 2) if self.flushes else 0.0,
+                'rows_max': self.max_rows,
+                'latency_avg': round(self.latency_total / self.flushes, 6) if self.flushes else 0.0,
+                'latency_max': round(self.latency_max, 6),
+            }
 
 
 class GoogleSpreadSheetsApi:
-    def __init__(self, file_name):
-        self.gc = gspread.service_account(filename=file_name)
-
-    @staticmethod
-    def style_new_worksheet(worksheet):
-        worksheet.format('1:1000', {'textFormat': {"fontSize": 12}})
-        worksheet.format('1:1', {'textFormat': {"fontSize": 14, 'bold': True}})
-        worksheet.append_row(['Класс', 'Фамилия', 'Имя', 'Отчество', 'Причина', 'Доказательства'])
+    def __init__(self, backend: SheetsBackend, layout: AbsentLayout = absent_layout):
+        self.gc = backend
+        self.layout = layout
+        self.flush_metrics = FlushMetrics()
+        self._tables = TTLCache(SHEETS_TABLE_CACHE_SIZE, SHEETS_TABLE_CACHE_TTL)  # link -> Spreadsheet
+        self._worksheets = TTLCache(SHEETS_TABLE_CACHE_SIZE, SHEETS_WORKSHEET_CACHE_TTL)  # link -> {title: Worksheet}
+
+    def style_new_worksheet(self, link: str, worksheet):
+        """Style absent worksheet and write its header with one batch_update"""
+        self._open(link).batch_update({'requests': self.layout.style_requests(worksheet.id)})
+
+    def _open(self, link: str) -> gspread.Spreadsheet:
+        """Opened spreadsheet from cache, open_by_url is called only on cache miss"""
+        table = self._tables.get(link)
+        if table is None:
+            table = self.gc.open_by_url(link)
+            self._tables.set(link, table)
+        return table
+
+    def _worksheet_index(self, link: str, refresh: bool = False) -> dict:
+        """Worksheets of spreadsheet by title in sheet order, refreshed after ttl or on demand"""
+        index = None if refresh else self._worksheets.get(link)
+        if index is None:
+            index = {worksheet.title: worksheet for worksheet in self._open(link).worksheets()}
+            self._worksheets.set(link, index)
+        return index
+
+    def _get_worksheet(self, link: str, position: int, refresh: bool = False) -> gspread.Worksheet:
+        return list(self._worksheet_index(link, refresh).values())[position]
+
+    def _date_worksheet(self, link: str, date: datetime.date) -> gspread.Worksheet:
+        """Absent worksheet of date in layout, created and styled if spreadsheet has no such worksheet"""
+        title = self.layout.title(date)
+        worksheet = self._worksheet_index(link).get(title)
+        if worksheet is None:
+            worksheet = self._worksheet_index(link, refresh=True).get(title)
+        if worksheet is None:
+            worksheet = self._open(link).add_worksheet(title=title, rows=self.layout.tab_rows, cols=self.layout.cols)
+            self.style_new_worksheet(link, worksheet)
+            self._worksheets.set(link, {**self._worksheet_index(link), title: worksheet})
+        return worksheet
+
+    def forget(self, link: str):
+        """Drop cached handles of spreadsheet, e.g. after its worksheets were changed by hand"""
+        self._tables.pop(link)
+        self._worksheets.pop(link)
 
     def link_check(self, link):
         try:
-            table = self.gc.open_by_url(link)
+            self._open(link)
         except NoValidUrlKeyFound:
             raise TableLinkError(link)
+        except APIError as error:
+            # spreadsheet is not found or not shared with service account
+            if sheets_outage(error):
+                raise
+            raise TableLinkError(link)
 
-    def google_sheets_teachers_codes(self, link: str, code_list: list):
-        """Adding teachers codes into google sheet"""
-        table = self.gc.open_by_url(link)
-        worksheet = table.get_worksheet(0)
-
-        cell_range = f'E2:E{len(code_list) + 1}'
-
-        worksheet.update(cell_range, code_list)
-
-    def google_sheets_teacher_code_generate(self, link: str, old_code: str, code: str):
-        """Changing teacher code to generate one"""
-        table = self.gc.open_by_url(link)
-        worksheet = table.get_worksheet(0)
-        cell: gspread.Cell = worksheet.find(old_code)
+    @staticmethod
+    def link_validate(link: str):
+        """Checking only link format without API call, used when Google Sheets is unavailable"""
+        try:
+            extract_id_from_url(link)
+        except NoValidUrlKeyFound:
+            raise TableLinkError(link)
 
-        if cell is None:
+    @staticmethod
+    def _code_row(worksheet: gspread.Worksheet, old_code: str, row: int = None):
+        """Row of E cell with old code, known row is read first, column is searched if row is unknown or moved"""
+        if not (row is None) and worksheet.get(f'E{row}') == [[old_code]]:
+            return row
+
+        # roster codes are kept in E column, so only it is searched
+        cell: gspread.Cell = worksheet.find(old_code, in_column=5)
+        return None if cell is None else cell.row
+
+    def google_sheets_teacher_code_generate(self, link: str, old_code: str, code: str, row: int = None):
+        """Changing teacher code to generate one, cell is found by code if row is unknown or holds other code"""
+        worksheet = self._get_worksheet(link, TEACHERS_SHEET)
+        row = self._code_row(worksheet, old_code, row)
+        if row is None:
             raise TeacherNotFoundError(teacher_code=old_code, google_spread_sheet_link=link)
 
-        worksheet.update(cell.address, code)
-
-    def google_sheets_get_teachers(self, link: str, school: str):
-        """Getting teachers list"""
-        table = self.gc.open_by_url(link)
-        worksheet = table.get_worksheet(0)
-        data = worksheet.get_all_values()
-
-        if len(data) < 1:
-            raise TeachersEmptyData(link, school)
-
-        data = data[1:]
-
-        teachers_list = []
+        worksheet.update(f'E{row}', code)
 
-        for student in data:
-            teachers_list.append(
-                {
-                    'name': student[2],
-                    'surname': student[1],
-                    'patronymic': student[3],
-                    'class_name': student[0]
-                }
-            )
-
-        return teachers_list
-
-    def google_sheets_students_codes(self, link: str, code_list: list):
-        """Adding students codes into google sheet"""
-        table = self.gc.open_by_url(link)
-        worksheet = table.get_worksheet(1)
-
-        cell_range = f'E2:E{len(code_list) + 1}'
-
-        worksheet.update(cell_range, code_list)
-
-    def google_sheets_student_code_generate(self, link: str, old_code: str, code: str):
-        """Changing student code to generate one"""
-        table = self.gc.open_by_url(link)
-        worksheet = table.get_worksheet(1)
-        cell: gspread.Cell = worksheet.find(old_code)
-
-        if cell is None:
+    def google_sheets_student_code_generate(self, link: str, old_code: str, code: str, row: int = None):
+        """Changing student code to generate one, cell is found by code if row is unknown or holds other code"""
+        worksheet = self._get_worksheet(link, STUDENTS_SHEET)
+        row = self._code_row(worksheet, old_code, row)
+        if row is None:
             raise StudentNotFoundError(student_code=old_code, google_spread_sheet_link=link)
 
-        worksheet.update(cell.address, code)
-
-    def google_sheets_get_students(self, link: str, school: str):
-        """Getting students list"""
-        table = self.gc.open_by_url(link)
-        worksheet = table.get_worksheet(1)
-        data = worksheet.get_all_values()
-
-        if len(data) < 1:
-            raise StudentsEmptyData(link, school)
-
-        data = data[1:]
-
-        student_list = []
-
-        for student in data:
-            student_list.append(
-                {
-                    'name': student[2],
-                    'surname': student[1],
-                    'patronymic': student[3],
-                    'class_name': student[0]
-                }
-            )
-
-        return student_list
+        worksheet.update(f'E{row}', code)
+
+    def google_sheets_iter_roster_rows(self, link: str, position: int, chunk_rows: int = SHEETS_READ_CHUNK_ROWS):
+        """
+            Generator of roster worksheet rows as (row number, [A..E] values), header and empty rows are skipped
+
+            Rows are read by chunk_rows with ranged get up to row_count of worksheet, so rows after a long gap
+            of blank rows are read too, sync deletes records of rows it did not see. Worksheet properties are
+            refreshed first, cached row_count could miss rows added since
+        """
+        with sheets_priority(PRIORITY_LOW):
+            worksheet = self._get_worksheet(link, position, refresh=True)
+
+        row_count = worksheet.row_count
+        start = 2
+        while start <= row_count:
+            with sheets_priority(PRIORITY_LOW):
+                values = worksheet.get(f'A{start}:E{min(start + chunk_rows - 1, row_count)}')
+
+            for row, line in enumerate(values, start=start):
+                if any(value.strip() for value in line[:4]):
+                    yield row, line
+            start += chunk_rows
+
+    def google_sheets_write_codes(self, link: str, codes: dict):
+        """
+            Writing codes into E column of roster worksheets with one values_batch_update for all of them
+
+            codes: dict - worksheet position -> list of (row number, code) or (row number or None, code, old code),
+            cells with old code are checked by resolve_code_rows against E columns read with one values_batch_get,
+            consecutive rows are sent as one range
+        """
+        titles = {position: self._get_worksheet(link, position).title.replace("'", "''")
+                  for position, code_cells in codes.items() if code_cells}
+        checked = [position for position in titles if any(len(cell) > 2 for cell in codes[position])]
+        if checked:
+            value_ranges = self._open(link).values_batch_get([f"'{titles[position]}'!E:E" for position in checked])
+            for position, value_range in zip(checked, value_ranges['valueRanges']):
+                codes = {**codes, position: resolve_code_rows(codes[position], value_range.get('values', []))}
+
+        data = []
+        for position, title in titles.items():
+            ranges = []
+            for row, code in sorted(codes[position]):
+                if ranges and ranges[-1]['last'] == row - 1:
+                    ranges[-1]['last'] = row
+                    ranges[-1]['values'].append([code])
+                else:
+                    ranges.append({'first': row, 'last': row, 'values': [[code]]})
+
+            data.extend({'range': f"'{title}'!E{item['first']}:E{item['last']}", 'values': item['values']}
+                        for item in ranges)
+
+        if data:
+            self._open(link).values_batch_update({'valueInputOption': 'RAW', 'data': data})
 
     def google_sheets_student_absent(self, link: str, date: datetime.date, code: str, reason: str,
                                      name: str, surname: str, patronymic: str, class_name: str, proof: bytes = ''):
         """Adding student absent into google sheet"""
-        table = self.gc.open_by_url(link)
-        for worksheet_elem in table.worksheets():
-            if str(date) == worksheet_elem._properties['title']:
-                worksheet = table.worksheet(str(date))
-                break
-        else:
-            worksheet = table.add_worksheet(title=str(date), rows=1000, cols=7)
-            self.style_new_worksheet(worksheet)
+        self.google_sheets_student_absents(link, date, [[class_name, surname, name, patronymic, reason, proof, code]])
 
-        worksheet.append_row([class_name, surname, name, patronymic, reason, proof, code])
+    def google_sheets_student_absents(self, link: str, date: datetime.date, rows: list):
+        """Adding several student absents of one date into google sheet with one append call"""
+        start = time.perf_counter()
+        try:
+            with sheets_priority(PRIORITY_HIGH):
+                worksheet = self._date_worksheet(link, date)
+                worksheet.append_rows([self.layout.row(date, row) for row in rows])
+        except APIError:
+            self.forget(link)
+            raise
+        self.flush_metrics.add_flush(len(rows), time.perf_counter() - start)
+
+    def google_sheets_prepare_absent_worksheet(self, link: str, date: datetime.date):
+        """Creating absent worksheet of date ahead of time, so first absent of period is not slowed down"""
+        try:
+            with sheets_priority(PRIORITY_LOW):
+                self._date_worksheet(link, date)
+        except APIError:
+            self.forget(link)
+            raise
 
     def google_sheets_student_absent_patch(self, link: str, date: datetime.date, code: str, body,
                                            reason: str, class_name: str, proof: bytes = ''):
         """Change student absent into google sheet"""
-        table = self.gc.open_by_url(link)
-        for worksheet_elem in table.worksheets():
-            if str(date) == worksheet_elem._properties['title']:
-                worksheet = table.worksheet(str(date))
-                break
-        else:
-            worksheet = table.add_worksheet(title=str(date), rows=1000, cols=7)
-            self.style_new_worksheet(worksheet)
+        worksheet = self._date_worksheet(link, date)
 
-        worksheet.append_row([class_name, surname, name, patronymic, reason, proof, code])
+        worksheet.append_row(self.layout.row(date, [class_name, surname, name, patronymic, reason, proof, code]))
 
 
-
-google_spread_sheets = GoogleSpreadSheetsApi('google_spreadsheets/google_credentials.json')
+sheets_limiter = SheetsRateLimiter(SHEETS_RATE_PER_MINUTE, SHEETS_SPREADSHEET_RATE_PER_MINUTE, SHEETS_RATE_WAIT_TIMEOUT)
+sheets_breaker = CircuitBreaker(SHEETS_BREAKER_FAILURES, SHEETS_BREAKER_RESET)
+google_spread_sheets = GoogleSpreadSheetsApi(RateLimitedBackend(create_backend(), sheets_limiter, SHEETS_RETRIES,
+                                                                SHEETS_RETRY_BASE_DELAY, SHEETS_RETRY_MAX_DELAY,
+                                                                sheets_breaker))
 
 
 # google_spread_sheets.google_sheets_student_absent(
@@ -150,9 +300,6 @@ google_spread_sheets = GoogleSpreadSheetsApi('google_spreadsheets/google_credent
 #     'https://docs.google.com/spreadsheets/d/1UPO9M6_fOwzSQmmasYmnxMnSEtCiq9LC4qf3300YzEc/edit#gid=1955592902',
 #     datetime.date.today(), 'отсутствует', 'Кирилл', 'Кузьменков', 'Владимирович', '10-Г')
 #
-# google_spread_sheets.google_sheets_get_students(
-#     'https://docs.google.com/spreadsheets/d/1UPO9M6_fOwzSQmmasYmnxMnSEtCiq9LC4qf3300YzEc/edit#gid=1955592902', '1580')
-#
 # google_spread_sheets.google_sheets_teacher_code_generate(
 #     'https://docs.google.com/spreadsheets/d/1UPO9M6_fOwzSQmmasYmnxMnSEtCiq9LC4qf3300YzEc/edit#gid=1955592902', '120621',
 #     '123456')
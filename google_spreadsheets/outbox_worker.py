@@ -0,0 +1,238 @@
+import asyncio
+import datetime
+import logging
+import threading
+
+from data import db_session
+from data.school import School
+from data.sheets_outbox import SheetsOutbox
+from google_spreadsheets.google_spread_sheets import google_spread_sheets, GoogleSpreadSheetsApi, TEACHERS_SHEET
+from google_spreadsheets.async_sheets import async_google_spread_sheets, AsyncGoogleSpreadSheetsApi
+from tools.error_book import SheetsUnavailableError, TeacherNotFoundError, StudentNotFoundError
+from tools.settings import OUTBOX_POLL_INTERVAL, OUTBOX_BATCH_SIZE, OUTBOX_MAX_ATTEMPTS, OUTBOX_RETRY_DELAY, \
+    SHEETS_FLUSH_SIZE, SHEETS_FLUSH_DELAY, SHEETS_ABSENT_PREWARM
+
+
+class OutboxWorker:
+    """
+        Background thread that drains sheets_outbox table into Google Sheets
+
+        Rows are claimed with FOR UPDATE SKIP LOCKED, so workers of several processes do not send the same row.
+        Failed rows are retried with exponential backoff until max_attempts is reached, then kept for inspection.
+        Absent rows of one spreadsheet and date are coalesced into one append, the group is sent when it has
+        flush_size rows or its oldest row waits flush_delay seconds.
+        While circuit breaker is open rows are postponed without spending their attempts.
+        Due groups are sent concurrently from event loop of worker thread, through async_sheets if it is given,
+        otherwise by synchronous client in threads of default executor.
+        With prewarm, on the day before new absent worksheet period, worksheets of that period are created
+        for all schools ahead of time.
+    """
+    def __init__(self, sheets: GoogleSpreadSheetsApi, poll_interval: float, batch_size: int,
+                 max_attempts: int, retry_delay: float, flush_size: int, flush_delay: float,
+                 async_sheets: AsyncGoogleSpreadSheetsApi = None, prewarm: bool = False):
+        self.sheets = sheets
+        self.async_sheets = async_sheets
+        self.prewarm = prewarm
+        self.poll_interval = poll_interval
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.flush_size = flush_size
+        self.flush_delay = flush_delay
+        self.handlers = {
+            'code': self._send_code,
+            'codes': self._send_codes,
+            'link_check': self._check_link,
+        }
+        self.batch_handlers = {
+            'absent': self._send_absents,
+            'absent_worksheet': self._prepare_absent_worksheet,
+        }
+        self._stop = threading.Event()
+        self._thread = None
+        self._loop = None
+        self._prewarmed = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='sheets-outbox', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._loop is not None:
+            if self.async_sheets is not None:
+                self._loop.run_until_complete(self.async_sheets.aclose())
+            self._loop.close()
+            self._loop = None
+        self._prewarmed = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            today = datetime.date.today()
+            if self.prewarm and self._prewarmed != today:
+                try:
+                    self.enqueue_prewarm(today)
+                    self._prewarmed = today
+                except Exception as error:
+                    logging.exception(error)
+
+            try:
+                sent = self.drain()
+            except Exception as error:
+                logging.exception(error)
+                sent = 0
+
+            if sent < self.batch_size:
+                self._stop.wait(self.poll_interval)
+
+    def _run_async(self, coroutine):
+        """Run coroutine on event loop of worker, it lives as long as worker to keep async client connections"""
+        if self._loop is None:
+            self._loop = asyncio.new_event_loop()
+        return self._loop.run_until_complete(coroutine)
+
+    async def _send_groups(self, groups: list) -> list:
+        sends = [self.batch_handlers[kind](link, date, group) for kind, link, date, group in groups]
+        return await asyncio.gather(*sends, return_exceptions=True)
+
+    def enqueue_prewarm(self, today: datetime.date) -> int:
+        """Enqueue creation of tomorrow absent worksheets if tomorrow starts new period, return number of rows"""
+        tomorrow = self.sheets.layout.next_tab_date(today)
+        if tomorrow is None:
+            return 0
+
+        db_sess = db_session.create_session()
+        try:
+            # other worker process could enqueue them already today
+            if db_sess.query(SheetsOutbox.id).filter(
+                    SheetsOutbox.kind == 'absent_worksheet',
+                    SheetsOutbox.created_at >= datetime.datetime.combine(today, datetime.time())).first():
+                return 0
+
+            links = db_sess.query(School.link).filter(School.link.isnot(None)).distinct().all()
+            db_sess.add_all(SheetsOutbox(kind='absent_worksheet', link=link, payload={'date': str(tomorrow)})
+                            for link, in links)
+            db_sess.commit()
+            return len(links)
+        finally:
+            db_sess.close()
+
+    def drain(self) -> int:
+        """Send one batch of due rows, return number of sent rows"""
+        db_sess = db_session.create_session()
+        try:
+            now = datetime.datetime.now()
+            items = db_sess.query(SheetsOutbox) \
+                .filter(SheetsOutbox.next_attempt_at <= now, SheetsOutbox.attempts < self.max_attempts) \
+                .order_by(SheetsOutbox.id) \
+                .limit(self.batch_size) \
+                .with_for_update(skip_locked=True) \
+                .all()
+
+            sent = 0
+            groups = {}
+            for item in items:
+                if item.kind in self.batch_handlers:
+                    groups.setdefault((item.kind, item.link, item.payload.get('date')), []).append(item)
+                    continue
+
+                try:
+                    self.handlers[item.kind](db_sess, item)
+                except Exception as error:
+                    self._fail([item], error, now)
+                else:
+                    db_sess.delete(item)
+                    sent += 1
+
+            due = []
+            for (kind, link, date), group in groups.items():
+                oldest = min(item.created_at for item in group)
+                if len(group) >= self.flush_size or now - oldest >= datetime.timedelta(seconds=self.flush_delay):
+                    due.append((kind, link, date, group))
+
+            results = self._run_async(self._send_groups(due)) if due else []
+            for (kind, link, date, group), error in zip(due, results):
+                if isinstance(error, Exception):
+                    self._fail(group, error, now)
+                else:
+                    for item in group:
+                        db_sess.delete(item)
+                    sent += len(group)
+
+            db_sess.commit()
+            return sent
+        except Exception:
+            db_sess.rollback()
+            raise
+        finally:
+            db_sess.close()
+
+    def _fail(self, items: list, error: Exception, now: datetime.datetime):
+        for item in items:
+            item.last_error = str(error)
+            if isinstance(error, SheetsUnavailableError):
+                item.next_attempt_at = now + datetime.timedelta(seconds=error.retry_after)
+                continue
+
+            logging.warning(f'Sheets outbox row {item.id} failed: {error}')
+            item.attempts += 1
+            item.next_attempt_at = now + datetime.timedelta(seconds=self._backoff(item.attempts))
+
+    def _backoff(self, attempts: int) -> float:
+        return min(self.retry_delay * 2 ** (attempts - 1), 3600)
+
+    def _send_code(self, db_sess, item: SheetsOutbox):
+        payload = item.payload
+        try:
+            if payload['position'] == TEACHERS_SHEET:
+                self.sheets.google_sheets_teacher_code_generate(item.link, payload['old_code'], payload['code'],
+                                                                payload['row'])
+            else:
+                self.sheets.google_sheets_student_code_generate(item.link, payload['old_code'], payload['code'],
+                                                                payload['row'])
+        except (TeacherNotFoundError, StudentNotFoundError) as error:
+            # row with old code was removed from worksheet, there is nothing to update
+            logging.warning(error)
+
+    def _send_codes(self, db_sess, item: SheetsOutbox):
+        codes = {}
+        for position, *cell in item.payload['cells']:
+            codes.setdefault(position, []).append(tuple(cell))
+        self.sheets.google_sheets_write_codes(item.link, codes)
+
+    def _check_link(self, db_sess, item: SheetsOutbox):
+        self.sheets.link_check(item.link)
+        db_sess.query(School).filter(School.name == item.payload['school_name'], School.link == item.link) \
+            .update({School.link_checked: True}, synchronize_session=False)
+
+    async def _prepare_absent_worksheet(self, link: str, date: str, items: list):
+        date = datetime.date.fromisoformat(date)
+        if self.async_sheets is None:
+            await asyncio.get_running_loop().run_in_executor(None, self.sheets.google_sheets_prepare_absent_worksheet,
+                                                             link, date)
+        else:
+            await self.async_sheets.google_sheets_prepare_absent_worksheet(link, date)
+
+    async def _send_absents(self, link: str, date: str, items: list):
+        rows = []
+        for item in items:
+            payload = item.payload
+            rows.append([payload['class_name'], payload['surname'], payload['name'], payload['patronymic'],
+                         payload['reason'], '', payload['code']])
+        date = datetime.date.fromisoformat(date)
+        if self.async_sheets is None:
+            await asyncio.get_running_loop().run_in_executor(None, self.sheets.google_sheets_student_absents,
+                                                             link, date, rows)
+        else:
+            await self.async_sheets.google_sheets_student_absents(link, date, rows)
+
+
+outbox_worker = OutboxWorker(google_spread_sheets, OUTBOX_POLL_INTERVAL, OUTBOX_BATCH_SIZE,
+                             OUTBOX_MAX_ATTEMPTS, OUTBOX_RETRY_DELAY, SHEETS_FLUSH_SIZE, SHEETS_FLUSH_DELAY,
+                             async_google_spread_sheets, SHEETS_ABSENT_PREWARM)
@@ -0,0 +1,369 @@
+import asyncio
+import contextlib
+import contextvars
+import itertools
+import random
+import threading
+import time
+
+from gspread.exceptions import APIError
+from requests import RequestException
+from gspread.utils import extract_id_from_url
+
+from tools.error_book import SheetsThrottledError
+from google_spreadsheets.backends import SheetsBackend
+from google_spreadsheets.circuit_breaker import CircuitBreaker
+
+
+# priority classes of Sheets API calls, lower value goes first
+PRIORITY_HIGH = 0  # absent writes
+PRIORITY_NORMAL = 1  # code updates, link checks
+PRIORITY_LOW = 2  # roster reads and imports
+
+_priority = contextvars.ContextVar('sheets_priority', default=PRIORITY_NORMAL)
+_request_limits = contextvars.ContextVar('sheets_request_limits', default=None)  # (retries, wait timeout)
+
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+# append is not idempotent: after 5xx rows may be written already, so only 429 that rejects call before it runs
+# is retried
+APPEND_RETRY_STATUS_CODES = (429,)
+APPEND_METHODS = ('append_row', 'append_rows', 'values_append')
+
+
+@contextlib.contextmanager
+def sheets_priority(priority: int):
+    """Context manager that sets priority of Sheets API calls made inside it"""
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+@contextlib.contextmanager
+def sheets_request_limits(retries: int, wait_timeout: float):
+    """Context manager that caps retries and quota wait of Sheets API calls made inside it, e.g. in http request"""
+    token = _request_limits.set((retries, wait_timeout))
+    try:
+        yield
+    finally:
+        _request_limits.reset(token)
+
+
+def request_retries(retries: int) -> int:
+    """Retries of call, capped inside sheets_request_limits"""
+    limits = _request_limits.get()
+    return retries if limits is None else min(retries, limits[0])
+
+
+def request_wait_timeout(timeout: float) -> float:
+    """Max quota wait of call, capped inside sheets_request_limits"""
+    limits = _request_limits.get()
+    return timeout if limits is None else min(timeout, limits[1])
+
+
+def backoff_delay(attempt: int, base: float, max_delay: float) -> float:
+    """Full jitter exponential backoff: random delay in [0, min(max_delay, base * 2 ** attempt)]"""
+    return random.uniform(0, min(max_delay, base * 2 ** attempt))
+
+
+class TokenBucket:
+    """
+        Token bucket refilled by rate_per_minute tokens a minute, holds up to one minute of tokens
+
+        Not thread-safe, SheetsRateLimiter calls it under its lock
+    """
+    def __init__(self, rate_per_minute: int):
+        self.rate = rate_per_minute / 60
+        self.capacity = float(rate_per_minute)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now: float) -> float:
+        """Seconds until one token is available, 0 if it is available now"""
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+
+class LimiterMetrics:
+    """Counters of Sheets API calls: time waited for quota, throttled calls, retries and errors by status"""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.throttled = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.retries = 0
+        self.errors = {}
+
+    def add_call(self, wait: float):
+        with self._lock:
+            self.calls += 1
+            if wait > 0.001:
+                self.throttled += 1
+            self.wait_total += wait
+            self.wait_max = max(self.wait_max, wait)
+
+    def add_timeout(self):
+        with self._lock:
+            self.timeouts += 1
+
+    def add_error(self, status_code: int, retried: bool):
+        with self._lock:
+            self.errors[status_code] = self.errors.get(status_code, 0) + 1
+            if retried:
+                self.retries += 1
+
+    def as_dict(self) -> dict:
+        with self._lock:
+            return {
+                'calls': self.calls,
+                'throttled': self.throttled,
+                'timeouts': self.timeouts,
+                'wait_avg': round(self.wait_total / self.calls, 6) if self.calls else 0.0,
+                'wait_max': round(self.wait_max, 6),
+                'retries': self.retries,
+                'errors': {str(code): count for code, count in self.errors.items()},
+            }
+
+
+class SheetsRateLimiter:
+    """
+        Token buckets of service account and of every spreadsheet shared by all threads of one worker process,
+        buckets are not shared between processes, with n workers each one is given 1/n of quota
+
+        Call waits until both buckets have a token and no call ahead of it that could run is waiting,
+        calls are ordered by priority and then by arrival.
+        account_rate, spreadsheet_rate: int - calls per minute, 0 - unlimited
+        timeout: float - max seconds call waits for quota before SheetsThrottledError
+    """
+    def __init__(self, account_rate: int, spreadsheet_rate: int, timeout: float):
+        self.account_rate = account_rate
+        self.spreadsheet_rate = spreadsheet_rate
+        self.timeout = timeout
+        self.metrics = LimiterMetrics()
+        self._cond = threading.Condition()
+        self._account = TokenBucket(account_rate) if account_rate else None
+        self._spreadsheets = {}
+        self._waiting = []
+        self._seq = itertools.count()
+
+    def _spreadsheet_bucket(self, spreadsheet_id: str) -> TokenBucket:
+        bucket = self._spreadsheets.get(spreadsheet_id)
+        if bucket is None:
+            bucket = self._spreadsheets[spreadsheet_id] = TokenBucket(self.spreadsheet_rate)
+        return bucket
+
+    def _buckets(self, spreadsheet_id: str) -> list:
+        buckets = [] if self._account is None else [self._account]
+        if self.spreadsheet_rate:
+            buckets.append(self._spreadsheet_bucket(spreadsheet_id))
+        return buckets
+
+    def _blocked(self, entry: tuple, now: float) -> bool:
+        """True if call of higher priority or earlier call of same priority has its spreadsheet quota and goes first"""
+        return any(other[:2] < entry[:2] and
+                   (not self.spreadsheet_rate or self._spreadsheet_bucket(other[2]).wait_time(now) == 0)
+                   for other in self._waiting)
+
+    def _try_take(self, entry: tuple, now: float) -> float:
+        """Take tokens for waiting entry and return 0 or return seconds to wait, called under lock"""
+        buckets = self._buckets(entry[2])
+        wait = max(bucket.wait_time(now) for bucket in buckets)
+        if wait == 0 and self._blocked(entry, now):
+            wait = 0.05
+        if wait == 0:
+            for bucket in buckets:
+                bucket.take()
+        return wait
+
+    def _entry(self, spreadsheet_id: str, priority: int = None) -> tuple:
+        priority = _priority.get() if priority is None else priority
+        return priority, next(self._seq), spreadsheet_id
+
+    def acquire(self, spreadsheet_id: str, priority: int = None):
+        """Wait for quota of one call, raise SheetsThrottledError after timeout"""
+        if self._account is None and not self.spreadsheet_rate:
+            self.metrics.add_call(0.0)
+            return
+
+        start = time.monotonic()
+        timeout = request_wait_timeout(self.timeout)
+        entry = self._entry(spreadsheet_id, priority)
+        with self._cond:
+            self._waiting.append(entry)
+            try:
+                while True:
+                    now = time.monotonic()
+                    wait = self._try_take(entry, now)
+                    if wait == 0:
+                        break
+
+                    left = start + timeout - now
+                    if left <= 0:
+                        self.metrics.add_timeout()
+                        raise SheetsThrottledError(spreadsheet_id, timeout)
+                    self._cond.wait(min(max(wait, 0.05), left))
+            finally:
+                self._waiting.remove(entry)
+                self._cond.notify_all()
+
+        self.metrics.add_call(time.monotonic() - start)
+
+    async def acquire_async(self, spreadsheet_id: str, priority: int = None):
+        """acquire for coroutines: waits with asyncio.sleep, so event loop keeps running other calls"""
+        if self._account is None and not self.spreadsheet_rate:
+            self.metrics.add_call(0.0)
+            return
+
+        start = time.monotonic()
+        timeout = request_wait_timeout(self.timeout)
+        entry = self._entry(spreadsheet_id, priority)
+        with self._cond:
+            self._waiting.append(entry)
+        try:
+            while True:
+                now = time.monotonic()
+                with self._cond:
+                    wait = self._try_take(entry, now)
+                if wait == 0:
+                    break
+
+                left = start + timeout - now
+                if left <= 0:
+                    self.metrics.add_timeout()
+                    raise SheetsThrottledError(spreadsheet_id, timeout)
+                await asyncio.sleep(min(max(wait, 0.05), left))
+        finally:
+            with self._cond:
+                self._waiting.remove(entry)
+                self._cond.notify_all()
+
+        self.metrics.add_call(time.monotonic() - start)
+
+    def stats(self) -> dict:
+        return {
+            'account_rate': self.account_rate,
+            'spreadsheet_rate': self.spreadsheet_rate,
+            'waiting': len(self._waiting),
+            **self.metrics.as_dict(),
+        }
+
+
+class _LimitedCall:
+    """
+        Sheets API call under circuit breaker and rate limiter, 429 and 5xx are retried with full jitter
+        exponential backoff, they and timeouts count as failures for circuit breaker, appends are retried on 429 only
+    """
+    def __init__(self, backend, spreadsheet_id: str):
+        self.backend = backend
+        self.spreadsheet_id = spreadsheet_id
+
+    def call(self, method, *args, **kwargs):
+        backend = self.backend
+        retries = request_retries(backend.retries)
+        retry_codes = APPEND_RETRY_STATUS_CODES if getattr(method, '__name__', '') in APPEND_METHODS \
+            else RETRY_STATUS_CODES
+        attempt = 0
+        while True:
+            started_at = None if backend.breaker is None else backend.breaker.before_call()
+            backend.limiter.acquire(self.spreadsheet_id)
+            try:
+                result = method(*args, **kwargs)
+            except APIError as error:
+                status_code = error.response.status_code
+                retry = status_code in retry_codes and attempt < retries
+                backend.limiter.metrics.add_error(status_code, retry)
+                self._record(status_code not in RETRY_STATUS_CODES, started_at)
+                if not retry:
+                    raise
+            except RequestException:
+                # timeout or connection error is not retried, it would hold request thread even longer
+                self._record(False, started_at)
+                raise
+            else:
+                self._record(True, started_at)
+                return result
+
+            time.sleep(backoff_delay(attempt, backend.retry_base_delay, backend.retry_max_delay))
+            attempt += 1
+
+    def _record(self, success: bool, started_at: float):
+        breaker = self.backend.breaker
+        if breaker is None:
+            return
+        if success:
+            breaker.record_success(started_at)
+        else:
+            breaker.record_failure(started_at)
+
+
+class LimitedWorksheet(_LimitedCall):
+    """Worksheet whose API methods go through rate limiter, attributes are read from wrapped worksheet"""
+    def __init__(self, backend, spreadsheet_id: str, worksheet):
+        super().__init__(backend, spreadsheet_id)
+        self.worksheet = worksheet
+
+    def __getattr__(self, name: str):
+        attr = getattr(self.worksheet, name)
+        if not callable(attr):
+            return attr
+        return lambda *args, **kwargs: self.call(attr, *args, **kwargs)
+
+
+class LimitedSpreadsheet(_LimitedCall):
+    """Spreadsheet whose API methods go through rate limiter, returned worksheets are limited too"""
+    def __init__(self, backend, spreadsheet):
+        super().__init__(backend, spreadsheet.id)
+        self.spreadsheet = spreadsheet
+
+    def __getattr__(self, name: str):
+        attr = getattr(self.spreadsheet, name)
+        if not callable(attr):
+            return attr
+        return lambda *args, **kwargs: self.call(attr, *args, **kwargs)
+
+    def _worksheet(self, worksheet):
+        return None if worksheet is None else LimitedWorksheet(self.backend, self.spreadsheet_id, worksheet)
+
+    def worksheets(self) -> list:
+        return [self._worksheet(worksheet) for worksheet in self.call(self.spreadsheet.worksheets)]
+
+    def worksheet(self, title: str):
+        return self._worksheet(self.call(self.spreadsheet.worksheet, title))
+
+    def get_worksheet(self, index: int):
+        return self._worksheet(self.call(self.spreadsheet.get_worksheet, index))
+
+    def add_worksheet(self, *args, **kwargs):
+        return self._worksheet(self.call(self.spreadsheet.add_worksheet, *args, **kwargs))
+
+
+class RateLimitedBackend(SheetsBackend):
+    """
+        Backend wrapper that sends every API call of wrapped backend through CircuitBreaker and SheetsRateLimiter
+
+        breaker: CircuitBreaker - optional, when open calls fail at once with SheetsUnavailableError
+        retries: int - retries of call failed with 429 or 5xx, of append failed with 429
+        retry_base_delay, retry_max_delay: float - backoff before retry is random in [0, min(max, base * 2 ** n)]
+    """
+    def __init__(self, backend: SheetsBackend, limiter: SheetsRateLimiter, retries: int,
+                 retry_base_delay: float, retry_max_delay: float, breaker: CircuitBreaker = None):
+        self.backend = backend
+        self.limiter = limiter
+        self.breaker = breaker
+        self.retries = retries
+        self.retry_base_delay = retry_base_delay
+        self.retry_max_delay = retry_max_delay
+
+    def open_by_url(self, link: str) -> LimitedSpreadsheet:
+        spreadsheet = _LimitedCall(self, extract_id_from_url(link)).call(self.backend.open_by_url, link)
+        return LimitedSpreadsheet(self, spreadsheet)
@@ -1,7 +1,7 @@
 import logging
 
 from data import db_session
-from fastapi import Depends, FastAPI
+from fastapi import Depends, FastAPI, Request
 
 from routers.auth.auth import token_check
 from routers.auth.auth_router import auth_router
@@ -9,6 +9,10 @@ from routers.teacher.teacher_router import teacher_router
 from routers.student.student_router import student_router
 from routers.school.school_router import school_router
 from routers.user.user_router import user_router
+from routers.metrics.metrics_router import metrics_router
+from routers.health.health_router import health_router
+from google_spreadsheets.outbox_worker import outbox_worker
+from google_spreadsheets.rate_limiter import sheets_request_limits
 
 from tools.settings import *
 
@@ -23,6 +27,35 @@ app.include_router(user_router, prefix='/v1', tags=['User'])
 app.include_router(teacher_router, prefix="/v1", tags=["Teacher"], dependencies=[Depends(token_check)])
 app.include_router(student_router, prefix="/v1", tags=["Student"], dependencies=[Depends(token_check)])
 app.include_router(school_router, prefix="/v1", tags=["School"], dependencies=[Depends(token_check)])
+app.include_router(metrics_router, prefix="/v1", tags=["Metrics"], dependencies=[Depends(token_check)])
+app.include_router(health_router, prefix="/v1", tags=["Metrics"])
 
 
-db_session.global_init(DB_USER, DB_PASSWORD, DB_HOST, DB_NAME)
+@app.middleware('http')
+async def count_db_queries(request: Request, call_next):
+    with db_session.count_queries() as counter:
+        response = await call_next(request)
+
+    if QUERY_COUNT_WARN and counter.count > QUERY_COUNT_WARN:
+        logger.warning(f'{request.method} {request.url.path} made {counter.count} database queries')
+    return response
+
+
+@app.middleware('http')
+async def limit_sheets_calls(request: Request, call_next):
+    # sheets calls of request do not hold threadpool worker for minutes of quota waits and retries
+    with sheets_request_limits(SHEETS_REQUEST_RETRIES, SHEETS_REQUEST_WAIT_TIMEOUT):
+        return await call_next(request)
+
+
+db_session.global_init(DB_USER, DB_PASSWORD, DB_HOST, DB_NAME, **DB_POOL_SETTINGS)
+
+
+@app.on_event('startup')
+def start_outbox_worker():
+    outbox_worker.start()
+
+
+@app.on_event('shutdown')
+def stop_outbox_worker():
+    outbox_worker.stop()
@@ -2,14 +2,24 @@ from jose import JWTError, jwt
 from fastapi import status, HTTPException, Depends
 from fastapi.security import OAuth2PasswordBearer
 from data import db_session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from data.user import User
 from tools.settings import *
+from tools.ttl_cache import TTLCache
 
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/v1/token")
+token_cache = TTLCache(TOKEN_CACHE_SIZE, TOKEN_CACHE_TTL)  # (login, token_id) -> token is valid
 
 
-async def token_check(token: str = Depends(oauth2_scheme)):
+def invalidate_user(login: str):
+    """Drop cached token state of user, must be called after user or token_id change"""
+    token_cache.discard_if(lambda key: key[0] == login)
+
+
+async def token_check(token: str = Depends(oauth2_scheme),
+                      db_sess: AsyncSession = Depends(db_session.get_async_session)):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -26,7 +36,15 @@ async def token_check(token: str = Depends(oauth2_scheme)):
     except JWTError:
         raise credentials_exception
 
-    db_sess = db_session.create_session()
-    user = db_sess.query(User).filter(User.login == login).first()
-    if user is None or not user.enabled or user.token_id != token_id:
+    valid = token_cache.get((login, token_id))
+    if valid is None:
+        result = await db_sess.execute(select(User.enabled, User.token_id).where(User.login == login))
+        user = result.first()
+        if user is None:
+            raise credentials_exception
+
+        valid = user.enabled and user.token_id == token_id
+        token_cache.set((login, token_id), valid)
+
+    if not valid:
         raise credentials_exception
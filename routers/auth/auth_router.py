@@ -1,6 +1,10 @@
 from data import db_session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from data.user import User
-from tools.tools import create_access_token, check_password
+from tools.tools import create_access_token, check_password_async
+from tools.error_book import ExecutorOverloadError
+from routers.auth.auth import invalidate_user
 from fastapi import APIRouter, status, HTTPException, Depends
 from fastapi.security import OAuth2PasswordRequestForm
 
@@ -9,20 +13,31 @@ auth_router = APIRouter()
 
 
 @auth_router.post("/token")
-async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends()):
+async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(),
+                                 db_sess: AsyncSession = Depends(db_session.get_async_session)):
     """
         Generate JWT token for user
     """
-    db_sess = db_session.create_session()
-    user = db_sess.query(User).filter(User.login == form_data.username).first()
+    result = await db_sess.execute(select(User).where(User.login == form_data.username))
+    user = result.scalars().first()
 
-    if not (user and check_password(form_data.password, user.hashed_password)):
+    try:
+        password_ok = user is not None and await check_password_async(form_data.password, user.hashed_password)
+    except ExecutorOverloadError:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many login attempts, try again later",
+            headers={"Retry-After": "1"},
+        )
+
+    if not password_ok:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
     user.token_id += 1
-    db_sess.commit()
+    await db_sess.commit()
+    invalidate_user(user.login)
     access_token = create_access_token(user.login, user.token_id)
     return {"access_token": access_token, "token_type": "bearer"}
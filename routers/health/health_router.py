@@ -0,0 +1,24 @@
+from fastapi import APIRouter, status
+from fastapi.responses import JSONResponse
+from google_spreadsheets.google_spread_sheets import sheets_breaker
+
+
+health_router = APIRouter()
+
+
+@health_router.get('/health',
+                   summary='Get service health',
+                   status_code=status.HTTP_200_OK)
+def health_get():
+    """
+        Get service health, no parameters and no token needed
+
+        - **status**: ok or degraded, degraded means Google Sheets is unavailable and sheet updates are queued
+        - **sheets**: circuit breaker state, failures in a row, seconds before trial call, times opened, rejected calls
+    """
+    sheets = sheets_breaker.status()
+    content = {
+        'status': 'ok' if sheets['state'] == sheets_breaker.CLOSED else 'degraded',
+        'sheets': sheets,
+    }
+    return JSONResponse(content=content, status_code=status.HTTP_200_OK)
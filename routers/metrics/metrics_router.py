@@ -0,0 +1,32 @@
+from fastapi import APIRouter, status
+from fastapi.responses import JSONResponse
+from data import db_session
+from tools.tools import hashing_executor
+from routers.auth.auth import token_cache
+from google_spreadsheets.google_spread_sheets import google_spread_sheets, sheets_limiter
+
+
+metrics_router = APIRouter()
+
+
+@metrics_router.get('/metrics',
+                    summary='Get service metrics',
+                    status_code=status.HTTP_200_OK)
+def metrics_get():
+    """
+        Get service metrics of current worker, no parameters needed
+
+        - **db_pool**: sync and async connection pools size, checkouts and time spent waiting for connection
+        - **hashing**: password hashing pool load and rejected tasks
+        - **token_cache**: token_check cache size, hits and misses
+        - **sheets_flush**: batched absent appends, rows per flush and flush latency
+        - **sheets_quota**: Sheets API calls, time waited for quota, throttled calls, retries and errors by status
+    """
+    content = {
+        'db_pool': db_session.pool_status(),
+        'hashing': hashing_executor.stats(),
+        'token_cache': token_cache.stats(),
+        'sheets_flush': google_spread_sheets.flush_metrics.as_dict(),
+        'sheets_quota': sheets_limiter.stats(),
+    }
+    return JSONResponse(content=content, status_code=status.HTTP_200_OK)
@@ -74,19 +74,42 @@ class AbsentGet(BaseModel):
     code: str
     date: str
     reason: str
-    file: Optional[bytes]
+    file_size: Optional[int]
 
 
 class AbsentGetList(BaseModel):
     absents: List[AbsentGet]
 
 
+class AbsentPage(BaseModel):
+    absents: List[AbsentGet]
+    next_cursor: Optional[str]
+
+
 class AbsentPatch(BaseModel):
     new_date: str
     new_reason: str
     new_file: Optional[bytes]
 
 
+class DeletedCount(BaseModel):
+    schools: int = 0
+    teachers: int = 0
+    students: int = 0
+    absents: int = 0
+
+
+class CodeCount(BaseModel):
+    teachers: int = 0
+    students: int = 0
+
+
+class SyncCount(BaseModel):
+    inserted: int = 0
+    updated: int = 0
+    deleted: int = 0
+
+
 class StudentPost(BaseModel):
     name: str
     surname: str
@@ -124,6 +147,7 @@ class StudentPatch(BaseModel):
 class School(BaseModel):
     school_name: str
     link: str
+    link_checked: Optional[bool]
 
 
 class SchoolPatch(BaseModel):
@@ -24,3 +24,13 @@ class Unauthorized(BaseModel):
 class NotFound(BaseModel):
     status_code: int = 404
     content: str
+
+
+class ServiceUnavailable(BaseModel):
+    status_code: int = 503
+    content: str
+
+
+class RangeNotSatisfiable(BaseModel):
+    status_code: int = 416
+    content: str
@@ -1,28 +1,50 @@
 import logging
 import routers.models as schemas
 
-from fastapi import APIRouter, status
+from fastapi import APIRouter, status, Depends, Query
 from fastapi.responses import JSONResponse
 from tools.error_book import *
 from data import db_session
+from sqlalchemy import delete, select, tuple_, update
+from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from data.school import School
 from data.teacher import Teacher
 from data.student import Student
+from data.absent import Absent
+from data.identity import identity_query
+from data.student_search import search_students
 from routers.responses import *
-from tools.settings import string_date_format
-from tools.tools import generate_unique_code
-from google_spreadsheets.google_spread_sheets import google_spread_sheets
+from tools.settings import string_date_format, STUDENT_SEARCH_THRESHOLD
+from tools.tools import delete_students, generate_unique_codes
+from tools.roster_sync import sync_roster, import_roster
+from data.sheets_outbox import SheetsOutbox
+from google_spreadsheets.google_spread_sheets import google_spread_sheets, TEACHERS_SHEET, STUDENTS_SHEET, \
+    SHEETS_ERRORS, sheets_outage, sheets_retry_after
 
 
 school_router = APIRouter()
 
 
+def _enqueue_codes(db_sess: Session, link: str, codes: dict):
+    """Add outbox row with code cells to transaction that changed codes, cells are written by outbox worker"""
+    cells = [[position, *cell] for position, code_cells in codes.items() for cell in code_cells]
+    if cells:
+        db_sess.add(SheetsOutbox(kind='codes', link=link, payload={'cells': cells}))
+
+
+def _sheets_unavailable(error: Exception) -> JSONResponse:
+    """503 response to Sheets outage, Retry-After tells when roster can be read again"""
+    return JSONResponse(**ServiceUnavailable(content=str(error)).dict(),
+                        headers={'Retry-After': str(sheets_retry_after(error))})
+
+
 @school_router.put('/school',
                    summary='Add new school',
                    status_code=status.HTTP_201_CREATED,
                    responses={201: {"model": CreatedResponse, "description": "School has been added"},
                               400: {"model": BadRequest}})
-def school_put(body: schemas.School):
+def school_put(body: schemas.School, db_sess: Session = Depends(db_session.get_session)):
     """
         Add new school
 
@@ -31,18 +53,26 @@ def school_put(body: schemas.School):
         - **link**: link to google spreadsheets
     """
     try:
-        db_sess = db_session.create_session()
-
         school = db_sess.query(School).get(body.school_name)
         if school is not None:
             raise SchoolDuplicateError(body.school_name)
 
-        google_spread_sheets.link_check(body.link)
-
         school = School(
             name=body.school_name,
             link=body.link
         )
+
+        try:
+            google_spread_sheets.link_check(body.link)
+        except SHEETS_ERRORS as error:
+            if not sheets_outage(error):
+                raise
+            # school is added while Google Sheets is unavailable, link is opened later by outbox worker
+            logging.warning(error)
+            google_spread_sheets.link_validate(body.link)
+            school.link_checked = False
+            db_sess.add(SheetsOutbox(kind='link_check', link=body.link, payload={'school_name': body.school_name}))
+
         db_sess.add(school)
         db_sess.commit()
 
@@ -57,7 +87,7 @@ def school_put(body: schemas.School):
                    status_code=status.HTTP_200_OK,
                    responses={200: {"model": schemas.School},
                               400: {"model": BadRequest}})
-def school_get(name: str):
+def school_get(name: str, db_sess: Session = Depends(db_session.get_session)):
     """
         Get information about school by name
 
@@ -65,13 +95,12 @@ def school_get(name: str):
         - **school_name**: school name, required
     """
     try:
-        db_sess = db_session.create_session()
-
         school = db_sess.query(School).get(name)
         if school is None:
             raise SchoolNotFoundError(name)
 
-        return JSONResponse(content=schemas.School(school_name=name, link=school.link).dict(),
+        return JSONResponse(content=schemas.School(school_name=name, link=school.link,
+                                                           link_checked=school.link_checked).dict(),
                             status_code=status.HTTP_200_OK)
     except SchoolNotFoundError as error:
         logging.warning(error)
@@ -83,18 +112,17 @@ def school_get(name: str):
                    status_code=status.HTTP_200_OK,
                    responses={200: {"model": schemas.SchoolList},
                               400: {"model": BadRequest}})
-def schools_get():
+def schools_get(db_sess: Session = Depends(db_session.get_session)):
     """
         Get school list, no parameters needed
     """
     try:
-        db_sess = db_session.create_session()
-
         school_list = db_sess.query(School).all()
 
         response_dict = schemas.SchoolList(schools=[])
         for school in school_list:
-            response_dict.schools.append(schemas.School(school_name=school.name, link=school.link))
+            response_dict.schools.append(schemas.School(school_name=school.name, link=school.link,
+                                                        link_checked=school.link_checked))
 
         return JSONResponse(content=response_dict.dict(), status_code=status.HTTP_200_OK)
     except SchoolDuplicateError as error:
@@ -107,8 +135,9 @@ def schools_get():
                    status_code=status.HTTP_201_CREATED,
                    responses={201: {"model": CreatedResponse, "description": "Teachers has been added"},
                               400: {"model": BadRequest},
-                              404: {"model": NotFound}})
-def teachers_put(body: schemas.TeacherListPost):
+                              404: {"model": NotFound},
+                              503: {"model": ServiceUnavailable}})
+def teachers_put(body: schemas.TeacherListPost, db_sess: Session = Depends(db_session.get_session)):
     """
         Add teacher list to given school:
 
@@ -117,45 +146,70 @@ def teachers_put(body: schemas.TeacherListPost):
         - **teachers**: list of teachers, not required, if not given, teachers will take from Google spreadsheets
     """
     try:
-        db_sess = db_session.create_session()
-        from_sheet_flag = False
-
         school_name = body.school_name
         school = db_sess.query(School).get(school_name)
         if school is None:
             raise SchoolNotFoundError(school_name)
 
+        # sheet rows are read by chunks and inserted by batches, so whole roster is never in memory
         if body.teachers is None:
-            body.teachers = google_spread_sheets.google_sheets_get_teachers(school.link, school_name)
-            from_sheet_flag = True
-
-        teacher_list = []
-        teacher_code_list = []
-        for teacher_json in body.teachers:
-            code = generate_unique_code(db_sess)
-
-            teacher_list.append(Teacher(
-                **teacher_json,
-                school_name=school_name,
-                code=code
-            ))
-
-            teacher_code_list.append([code])
+            rows = google_spread_sheets.google_sheets_iter_roster_rows(school.link, TEACHERS_SHEET)
+        else:
+            rows = ((None, [item.class_name, item.surname, item.name, item.patronymic]) for item in body.teachers)
 
-        db_sess.add_all(teacher_list)
+        count, code_cells = import_roster(db_sess, Teacher, school_name, rows)
+        if count == 0 and body.teachers is None:
+            raise TeachersEmptyData(school.link, school_name)
+        _enqueue_codes(db_sess, school.link, {TEACHERS_SHEET: code_cells})
         db_sess.commit()
 
-        if from_sheet_flag:
-            link = school.link
-            google_spread_sheets.google_sheets_teachers_codes(link, teacher_code_list)
-
         return JSONResponse(**CreatedResponse(content='Teachers added').dict())
-    except StudentNotFoundError as error:
+    except SchoolNotFoundError as error:
         logging.warning(error)
         return JSONResponse(**NotFound(content=str(error)).dict())
     except TeachersEmptyData as error:
         logging.warning(error)
         return JSONResponse(**BadRequest(content=str(error)).dict())
+    except SHEETS_ERRORS as error:
+        if not sheets_outage(error):
+            raise
+        logging.warning(error)
+        return _sheets_unavailable(error)
+
+
+@school_router.post('/school/teachers/sync',
+                    summary='Sync teachers with Google spreadsheets',
+                    status_code=status.HTTP_200_OK,
+                    responses={200: {"model": schemas.SyncCount},
+                               404: {"model": NotFound},
+                               503: {"model": ServiceUnavailable}})
+def teachers_sync(school_name: str, db_sess: Session = Depends(db_session.get_session)):
+    """
+        Sync teachers of given school with teachers worksheet: changed rows are updated, new rows are added,
+        teachers removed from worksheet are deleted, existing codes are kept and only missing codes are written back
+
+        ### Query:
+        - **school_name**: school name, required
+    """
+    try:
+        school = db_sess.query(School).get(school_name)
+        if school is None:
+            raise SchoolNotFoundError(school_name)
+
+        rows = google_spread_sheets.google_sheets_iter_roster_rows(school.link, TEACHERS_SHEET)
+        count, code_cells = sync_roster(db_sess, Teacher, school_name, rows)
+        _enqueue_codes(db_sess, school.link, {TEACHERS_SHEET: code_cells})
+        db_sess.commit()
+
+        return JSONResponse(content=schemas.SyncCount(**count).dict(), status_code=status.HTTP_200_OK)
+    except SchoolNotFoundError as error:
+        logging.warning(error)
+        return JSONResponse(**NotFound(content=str(error)).dict())
+    except SHEETS_ERRORS as error:
+        if not sheets_outage(error):
+            raise
+        logging.warning(error)
+        return _sheets_unavailable(error)
 
 
 @school_router.get('/school/teachers',
@@ -164,7 +218,7 @@ def teachers_put(body: schemas.TeacherListPost):
                    responses={200: {"model": schemas.TeacherListGet},
                               400: {"model": BadRequest},
                               404: {"model": NotFound}})
-def teachers_get(school_name: str):
+def teachers_get(school_name: str, db_sess: Session = Depends(db_session.get_session)):
     """
         Get teacher list from given school
 
@@ -172,8 +226,6 @@ def teachers_get(school_name: str):
         - **school_name**: school name, required
     """
     try:
-        db_sess = db_session.create_session()
-
         school = db_sess.query(School).get(school_name)
         if school is None:
             raise SchoolNotFoundError(school_name)
@@ -205,46 +257,69 @@ def teachers_get(school_name: str):
 @school_router.get('/school/absents',
                    summary='Get absent list',
                    status_code=status.HTTP_200_OK,
-                   responses={200: {"model": schemas.AbsentGetList},
+                   responses={200: {"model": schemas.AbsentPage},
                               400: {"model": BadRequest},
                               404: {"model": NotFound}})
-def absents_get(school_name: str):
+def absents_get(school_name: str, class_name: str = None,
+                date_from: str = Query(None, alias='from'), date_to: str = Query(None, alias='to'),
+                cursor: str = None, limit: int = Query(100, ge=1, le=1000),
+                db_sess: Session = Depends(db_session.get_session)):
     """
-       Get absent list from given school:
+       Get absent list from given school, ordered by date, page by page:
 
         ### Query:
         - **school_name**: school name, required
+        - **class_name**: only absents of given class, not required
+        - **from**: first absent date, not required
+        - **to**: last absent date, not required
+        - **cursor**: next_cursor from previous page, not required
+        - **limit**: page size, 100 by default
+
+        Files with proof are downloaded one by one from /student/absent/file
    """
     try:
-        db_sess = db_session.create_session()
-
         school = db_sess.query(School).get(school_name)
         if school is None:
             raise SchoolNotFoundError(school_name)
 
-        students = db_sess.query(Student).filter(Student.school_name == school_name).all()
-        absents = []
-        for student in students:
-            absents += student.absents
-
-        absent_json_list = schemas.AbsentGetList(absents=[])
-        for absent in absents:
-            student = absent.student
+        query = select(Absent.id, Absent.date, Absent.reason, Absent.file_size, Student.code) \
+            .join(Student, Absent.student_id == Student.id) \
+            .where(Student.school_name == school_name)
+
+        if not (class_name is None):
+            query = query.where(Student.class_name == class_name)
+        if not (date_from is None):
+            query = query.where(Absent.date >= datetime.datetime.strptime(date_from, string_date_format).date())
+        if not (date_to is None):
+            query = query.where(Absent.date <= datetime.datetime.strptime(date_to, string_date_format).date())
+        if not (cursor is None):
+            cursor_date, cursor_id = cursor.split('_')
+            cursor_date = datetime.datetime.strptime(cursor_date, string_date_format).date()
+            query = query.where(tuple_(Absent.date, Absent.id) > tuple_(cursor_date, int(cursor_id)))
+
+        rows = db_sess.execute(query.order_by(Absent.date, Absent.id).limit(limit + 1)).all()
+
+        absent_page = schemas.AbsentPage(absents=[])
+        for row in rows[:limit]:
             absent_json = schemas.AbsentGet(
-                date=datetime.date.strftime(absent.date, string_date_format),
-                reason=absent.reason,
-                code=student.code
+                date=datetime.date.strftime(row.date, string_date_format),
+                reason=row.reason,
+                code=row.code,
+                file_size=row.file_size
             )
+            absent_page.absents.append(absent_json)
 
-            if not (absent.file is None):
-                absent_json.file = str(absent.file)
+        if len(rows) > limit:
+            last = rows[limit - 1]
+            absent_page.next_cursor = f'{datetime.date.strftime(last.date, string_date_format)}_{last.id}'
 
-            absent_json_list.absents.append(absent_json)
-
-        return JSONResponse(content=absent_json_list.dict(), status_code=status.HTTP_200_OK)
+        return JSONResponse(content=absent_page.dict(), status_code=status.HTTP_200_OK)
     except SchoolNotFoundError as error:
         logging.warning(error)
         return JSONResponse(**NotFound(content=str(error)).dict())
+    except ValueError as error:
+        logging.warning(error)
+        return JSONResponse(**BadRequest(content=str(error)).dict())
 
 
 @school_router.put('/school/students',
@@ -252,8 +327,9 @@ def absents_get(school_name: str):
                    status_code=status.HTTP_201_CREATED,
                    responses={201: {"model": CreatedResponse, "description": "Students has been added"},
                               400: {"model": BadRequest},
-                              404: {"model": NotFound}})
-def students_put(body: schemas.StudentListPost):
+                              404: {"model": NotFound},
+                              503: {"model": ServiceUnavailable}})
+def students_put(body: schemas.StudentListPost, db_sess: Session = Depends(db_session.get_session)):
     """
         Add student list to given school
 
@@ -262,46 +338,72 @@ def students_put(body: schemas.StudentListPost):
         - **teachers**: list of students, not required, if not given, teachers will take from Google spreadsheets
     """
     try:
-        db_sess = db_session.create_session()
-        from_sheet_flag = False
-
         school_name = body.school_name
         school = db_sess.query(School).get(school_name)
         if school is None:
             raise SchoolNotFoundError(school_name)
 
+        # sheet rows are read by chunks and inserted by batches, so whole roster is never in memory
         if body.students is None:
-            body.students = google_spread_sheets.google_sheets_get_students(school.link, school_name)
-            from_sheet_flag = True
+            rows = google_spread_sheets.google_sheets_iter_roster_rows(school.link, STUDENTS_SHEET)
+        else:
+            rows = ((None, [item.class_name, item.surname, item.name, item.patronymic]) for item in body.students)
 
-        student_list = []
-        student_code_list = []
+        count, code_cells = import_roster(db_sess, Student, school_name, rows)
+        if count == 0 and body.students is None:
+            raise StudentsEmptyData(school.link, school_name)
+        _enqueue_codes(db_sess, school.link, {STUDENTS_SHEET: code_cells})
+        db_sess.commit()
 
-        for student_json in body.students:
-            code = generate_unique_code(db_sess)
+        return JSONResponse(**CreatedResponse(content='Students added').dict())
+    except SchoolNotFoundError as error:
+        logging.warning(error)
+        return JSONResponse(**NotFound(content=str(error)).dict())
+    except StudentsEmptyData as error:
+        logging.warning(error)
+        return JSONResponse(**BadRequest(content=str(error)).dict())
+    except SHEETS_ERRORS as error:
+        if not sheets_outage(error):
+            raise
+        logging.warning(error)
+        return _sheets_unavailable(error)
 
-            student_list.append(Student(
-                **student_json,
-                school_name=school_name,
-                code=code
-            ))
 
-            student_code_list.append([code])
+@school_router.post('/school/students/sync',
+                    summary='Sync students with Google spreadsheets',
+                    status_code=status.HTTP_200_OK,
+                    responses={200: {"model": schemas.SyncCount},
+                               404: {"model": NotFound},
+                               503: {"model": ServiceUnavailable}})
+def students_sync(school_name: str, absents: bool = False, db_sess: Session = Depends(db_session.get_session)):
+    """
+        Sync students of given school with students worksheet: changed rows are updated, new rows are added,
+        students removed from worksheet are deleted, existing codes are kept and only missing codes are written back.
+        Teachers should be synced first, students reference their classes
 
-        db_sess.add_all(student_list)
-        db_sess.commit()
+        ### Query:
+        - **school_name**: school name, required
+        - **absents**: flag when true absents of deleted students will delete, not required
+    """
+    try:
+        school = db_sess.query(School).get(school_name)
+        if school is None:
+            raise SchoolNotFoundError(school_name)
 
-        if from_sheet_flag:
-            link = school.link
-            google_spread_sheets.google_sheets_students_codes(link, student_code_list)
+        rows = google_spread_sheets.google_sheets_iter_roster_rows(school.link, STUDENTS_SHEET)
+        count, code_cells = sync_roster(db_sess, Student, school_name, rows, absents)
+        _enqueue_codes(db_sess, school.link, {STUDENTS_SHEET: code_cells})
+        db_sess.commit()
 
-        return JSONResponse(**BadRequest(content='Students added').dict())
+        return JSONResponse(content=schemas.SyncCount(**count).dict(), status_code=status.HTTP_200_OK)
     except SchoolNotFoundError as error:
         logging.warning(error)
         return JSONResponse(**NotFound(content=str(error)).dict())
-    except StudentsEmptyData as error:
+    except SHEETS_ERRORS as error:
+        if not sheets_outage(error):
+            raise
         logging.warning(error)
-        return JSONResponse(**BadRequest(content=str(error)).dict())
+        return _sheets_unavailable(error)
 
 
 @school_router.get('/school/students',
@@ -310,7 +412,7 @@ def students_put(body: schemas.StudentListPost):
                    responses={200: {"model": schemas.StudentListGet, "description": "Success response"},
                               400: {"model": BadRequest},
                               404: {"model": NotFound}})
-def students_get(school_name: str):
+def students_get(school_name: str, db_sess: Session = Depends(db_session.get_session)):
     """
         Get student list from given school:
 
@@ -318,8 +420,6 @@ def students_get(school_name: str):
         - **school_name**: school name, required
     """
     try:
-        db_sess = db_session.create_session()
-
         school = db_sess.query(School).get(school_name)
         if school is None:
             SchoolNotFoundError(school_name)
@@ -348,13 +448,110 @@ def students_get(school_name: str):
         return JSONResponse(**NotFound(content=str(error)).dict())
 
 
+@school_router.get('/school/students_by_name',
+                   summary='Get school students by name',
+                   status_code=status.HTTP_200_OK,
+                   responses={200: {"model": schemas.FindByNameResponse},
+                              400: {"model": BadRequest},
+                              404: {"model": NotFound}})
+def students_get_by_name(school_name: str, name: str, class_name: str = None, limit: int = Query(10, ge=1, le=100),
+                         db_sess: Session = Depends(db_session.get_session)):
+    """
+        Get students of given school with given name, most similar first
+
+        ### Query:
+        - **school_name**: school name, required
+        - **name**: student name, required
+        - **class_name**: search only in given class, not required
+        - **limit**: max number of students, 10 by default
+    """
+    try:
+        if db_sess.query(School.name).filter(School.name == school_name).first() is None:
+            raise SchoolNotFoundError(school_name)
+
+        student_list = search_students(db_sess, name, limit, STUDENT_SEARCH_THRESHOLD,
+                                       class_name=class_name, school_name=school_name)
+
+        response_json = schemas.FindByNameResponse(students=[])
+        for student in student_list:
+            response_json.students.append(schemas.StudentGet(
+                name=student.name,
+                surname=student.surname,
+                patronymic=student.patronymic,
+                class_name=student.class_name,
+                school_name=student.school_name,
+                code=student.code,
+                tg_user_id=student.tg_user_id
+            ))
+
+        return JSONResponse(content=response_json.dict(), status_code=status.HTTP_200_OK)
+    except SchoolNotFoundError as error:
+        logging.warning(error)
+        return JSONResponse(**NotFound(content=str(error)).dict())
+
+
+@school_router.post('/school/codes',
+                    summary='Generating new codes for school or class',
+                    status_code=status.HTTP_200_OK,
+                    responses={200: {"model": schemas.CodeCount},
+                               404: {"model": NotFound}})
+def school_codes(school_name: str, class_name: str = None, teachers: bool = False, students: bool = True,
+                 db_sess: Session = Depends(db_session.get_session)):
+    """
+        Generating new codes for all teachers and students of given school or class, codes are changed
+        in one transaction with outbox row, outbox worker writes them to Google spreadsheets with one request
+
+        ### Query:
+        - **school_name**: school name, required
+        - **class_name**: only teacher and students of given class, not required
+        - **teachers**: flag when true teachers get new codes, not required
+        - **students**: flag when true students get new codes, true by default
+    """
+    try:
+        school = db_sess.query(School).get(school_name)
+        if school is None:
+            raise SchoolNotFoundError(school_name)
+
+        count = schemas.CodeCount()
+        codes = {}
+        for flag, model, position in ((teachers, Teacher, TEACHERS_SHEET), (students, Student, STUDENTS_SHEET)):
+            if not flag:
+                continue
+
+            query = select(model.id, model.code, model.sheet_row).where(model.school_name == school_name)
+            if not (class_name is None):
+                query = query.where(model.class_name == class_name)
+            records = db_sess.execute(query).all()
+
+            # bulk update is flushed at once, so codes of next model are checked against these too
+            new_codes = generate_unique_codes(db_sess, len(records))
+            db_sess.bulk_update_mappings(model, [{'id': record.id, 'code': code}
+                                                 for record, code in zip(records, new_codes)])
+
+            # cell is checked by old code before writing, rows without number are found by it
+            codes[position] = [(record.sheet_row, code, record.code) for record, code in zip(records, new_codes)]
+            if model is Teacher:
+                count.teachers = len(records)
+            else:
+                count.students = len(records)
+
+        _enqueue_codes(db_sess, school.link, codes)
+        db_sess.commit()
+
+        return JSONResponse(content=count.dict(), status_code=status.HTTP_200_OK)
+    except SchoolNotFoundError as error:
+        logging.warning(error)
+        return JSONResponse(**NotFound(content=str(error)).dict())
+
+
 @school_router.get('/school/find_by_code',
                    summary='Get information about teacher',
                    status_code=status.HTTP_200_OK,
                    responses={200: {"model": schemas.StudentTeacher},
                               400: {"model": BadRequest},
                               404: {"model": NotFound}})
-def find_by_code(code: str = None, tg_user_id: int = None):
+async def find_by_code(code: str = None, tg_user_id: int = None,
+                       db_sess: AsyncSession = Depends(db_session.get_async_session)):
     """
         Get information about teacher or student with given code or tg user id
 
@@ -363,74 +560,30 @@ def find_by_code(code: str = None, tg_user_id: int = None):
         - **tg_user_id**: unique telegram user id
     """
     try:
-        db_sess = db_session.create_session()
-
-        if not (code is None):
-            teacher = db_sess.query(Teacher).filter(Teacher.code == code).first()
-            student = db_sess.query(Student).filter(Student.code == code).first()
-
-            if not (teacher is None):
-                response_body = schemas.StudentTeacher(
-                    name=teacher.name,
-                    surname=teacher.surname,
-                    patronymic=teacher.patronymic,
-                    class_name=teacher.class_name,
-                    school_name=teacher.school_name,
-                    type='teacher'
-                )
-
-                if not (teacher.tg_user_id is None):
-                    response_body.tg_user_id = teacher.tg_user_id
-
-            elif not (student is None):
-                response_body = schemas.StudentTeacher(
-                    name=student.name,
-                    surname=student.surname,
-                    patronymic=student.patronymic,
-                    class_name=student.class_name,
-                    school_name=student.school_name,
-                    type='student'
-                )
-
-                if not (student.tg_user_id is None):
-                    response_body.tg_user_id = student.tg_user_id
+        if code is None and tg_user_id is None:
+            raise RequestDataKeysError([], ['code', 'tg_user_id'])
 
-            else:
+        result = await db_sess.execute(identity_query(code=code, tg_user_id=tg_user_id))
+        identity = result.first()
+
+        if identity is None:
+            if not (code is None):
                 raise StudentTeacherNotFoundError(code=code)
+            raise StudentTeacherNotFoundError(tg_user_id=tg_user_id)
+
+        response_body = schemas.StudentTeacher(
+            name=identity.name,
+            surname=identity.surname,
+            patronymic=identity.patronymic,
+            class_name=identity.class_name,
+            school_name=identity.school_name,
+            type=identity.type
+        )
 
-            return JSONResponse(content=response_body.dict(), status_code=status.HTTP_200_OK)
-
-        elif not (tg_user_id is None):
-            teacher = db_sess.query(Teacher).filter(Teacher.tg_user_id == tg_user_id).first()
-            student = db_sess.query(Student).filter(Student.tg_user_id == tg_user_id).first()
-
-            if not (teacher is None):
-                response_body = schemas.StudentTeacher(
-                    name=teacher.name,
-                    surname=teacher.surname,
-                    patronymic=teacher.patronymic,
-                    class_name=teacher.class_name,
-                    school_name=teacher.school_name,
-                    tg_user_id=teacher.tg_user_id,
-                    type='teacher'
-                )
-
-            elif not (student is None):
-                response_body = schemas.StudentTeacher(
-                    name=student.name,
-                    surname=student.surname,
-                    patronymic=student.patronymic,
-                    class_name=student.class_name,
-                    school_name=student.school_name,
-                    tg_user_id=student.tg_user_id,
-                    type='student'
-                )
-            else:
-                raise StudentTeacherNotFoundError(tg_user_id=tg_user_id)
+        if not (identity.tg_user_id is None):
+            response_body.tg_user_id = identity.tg_user_id
 
-            return JSONResponse(content=response_body.dict(), status_code=status.HTTP_200_OK)
-        else:
-            raise RequestDataKeysError([], ['code', 'tg_user_id'])
+        return JSONResponse(content=response_body.dict(), status_code=status.HTTP_200_OK)
 
     except RequestDataKeysError as error:
         logging.warning(error)
@@ -443,10 +596,11 @@ def find_by_code(code: str = None, tg_user_id: int = None):
 @school_router.delete('/school',
                       summary='Delete school',
                       status_code=status.HTTP_200_OK,
-                      responses={200: {"model": SuccessfulResponse},
+                      responses={200: {"model": schemas.DeletedCount},
                                  400: {"model": BadRequest},
                                  404: {"model": NotFound}})
-def school_del(name: str, teachers: bool = False, students: bool = False, absents: bool = False):
+def school_del(name: str, teachers: bool = False, students: bool = False, absents: bool = False,
+               db_sess: Session = Depends(db_session.get_session)):
     """
         Delete school with given name
 
@@ -457,26 +611,31 @@ def school_del(name: str, teachers: bool = False, students: bool = False, absent
         - **absents**: flag when true absents from given school will delete, not required
     """
     try:
-        db_sess = db_session.create_session()
-        school = db_sess.query(School).get(name)
-
-        if school is None:
+        if db_sess.query(School.name).filter(School.name == name).first() is None:
             raise SchoolNotFoundError(school_name=name)
 
-        if teachers:
-            for teacher in school.teachers:
-                db_sess.delete(teacher)
-
+        # set based statements in one transaction, rows that are kept lose reference to deleted ones
+        count = schemas.DeletedCount()
         if students:
-            for student in school.students:
-                if absents:
-                    for absent in student.absents:
-                        db_sess.delete(absent)
-                db_sess.delete(student)
+            count.students, count.absents = delete_students(db_sess, Student.school_name == name, absents)
+        else:
+            db_sess.execute(update(Student).where(Student.school_name == name).values(school_name=None)
+                            .execution_options(synchronize_session=False))
+
+        if teachers:
+            class_names = select(Teacher.class_name).where(Teacher.school_name == name)
+            db_sess.execute(update(Student).where(Student.class_name.in_(class_names)).values(class_name=None)
+                            .execution_options(synchronize_session=False))
+            count.teachers = db_sess.execute(delete(Teacher).where(Teacher.school_name == name)
+                                             .execution_options(synchronize_session=False)).rowcount
+        else:
+            db_sess.execute(update(Teacher).where(Teacher.school_name == name).values(school_name=None)
+                            .execution_options(synchronize_session=False))
 
-        db_sess.delete(school)
+        count.schools = db_sess.execute(delete(School).where(School.name == name)
+                                        .execution_options(synchronize_session=False)).rowcount
         db_sess.commit()
-        return JSONResponse(**SuccessfulResponse(content='School deleted').dict())
+        return JSONResponse(content=count.dict(), status_code=status.HTTP_200_OK)
     except SchoolNotFoundError as error:
         logging.warning(error)
         return JSONResponse(**NotFound(content=str(error)).dict())
@@ -488,7 +647,7 @@ def school_del(name: str, teachers: bool = False, students: bool = False, absent
                      responses={200: {"model": SuccessfulResponse},
                                 400: {"model": BadRequest},
                                 404: {"model": NotFound}})
-def school_patch(name: str, body: schemas.SchoolPatch):
+def school_patch(name: str, body: schemas.SchoolPatch, db_sess: Session = Depends(db_session.get_session)):
     """
         Change school with given name
 
@@ -500,7 +659,6 @@ def school_patch(name: str, body: schemas.SchoolPatch):
         - **new_link**: new link name, not required
     """
     try:
-        db_sess = db_session.create_session()
         school = db_sess.query(School).get(name)
 
         if school is None:
@@ -510,8 +668,17 @@ def school_patch(name: str, body: schemas.SchoolPatch):
             school.school_name = body.new_name
 
         if body.new_link:
-            google_spread_sheets.link_check(body.new_link)
             school.link = body.new_link
+            school.link_checked = True
+            try:
+                google_spread_sheets.link_check(body.new_link)
+            except SHEETS_ERRORS as error:
+                if not sheets_outage(error):
+                    raise
+                logging.warning(error)
+                google_spread_sheets.link_validate(body.new_link)
+                school.link_checked = False
+                db_sess.add(SheetsOutbox(kind='link_check', link=body.new_link, payload={'school_name': name}))
 
         db_sess.commit()
         return JSONResponse(**SuccessfulResponse(content='School changed').dict())
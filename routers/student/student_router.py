@@ -1,31 +1,101 @@
-import base64
 import logging
 import routers.models as schemas
 
-from fastapi import APIRouter, status
-from fastapi.responses import JSONResponse
+from fastapi import APIRouter, status, Depends, File, Form, Header, UploadFile
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from tools.error_book import *
 from data import db_session
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from tools.settings import *
 from routers.responses import *
 from data.student import Student
 from data.absent import Absent
-from tools.tools import generate_unique_code
-from google_spreadsheets.google_spread_sheets import google_spread_sheets
+from data.sheets_outbox import SheetsOutbox
+from tools.tools import generate_unique_code, decode_proof, parse_byte_range, delete_students
+from tools.blob_store import blob_store
+from google_spreadsheets.google_spread_sheets import google_spread_sheets, STUDENTS_SHEET, SHEETS_ERRORS, sheets_outage
 
 
 student_router = APIRouter()
 
 
+def _get_student(db_sess: Session, code: str = None, tg_user_id: int = None) -> Student:
+    """Student with given code or tg user id, raise StudentNotFoundError or RequestDataKeysError"""
+    if not (code is None):
+        student = db_sess.query(Student).filter(Student.code == code).first()
+
+        if student is None:
+            raise StudentNotFoundError(student_code=code)
+    elif not (tg_user_id is None):
+        student = db_sess.query(Student).filter(Student.tg_user_id == tg_user_id).first()
+
+        if student is None:
+            raise StudentNotFoundError(student_tg_user_id=tg_user_id)
+    else:
+        raise RequestDataKeysError([], ['code', 'tg_user_id'])
+
+    return student
+
+
+def _drop_unused_blob(db_sess: Session, file_key: str):
+    """Delete blob stored for rejected absent, blobs are shared by equal files, so only if no absent keeps it"""
+    if file_key is None:
+        return
+    if db_sess.query(Absent.id).filter(Absent.file_key == file_key).first() is None:
+        blob_store.delete(file_key)
+
+
+def _add_absent(db_sess: Session, student: Student, date: datetime.date, reason: str,
+                file_key: str = None, file_size: int = None):
+    """
+        Insert absent with outbox row for google sheets and commit, raise StudentDuplicateAbsent
+
+        Proof is stored before insert, its key is known only then, so blob of duplicate absent is dropped
+    """
+    # uq_absents_student_id_date rejects duplicate even for concurrent requests
+    inserted = db_sess.execute(
+        insert(Absent)
+        .values(date=date, reason=reason, file_key=file_key, file_size=file_size, student_id=student.id)
+        .on_conflict_do_nothing(index_elements=['student_id', 'date'])
+    ).rowcount
+
+    if not inserted:
+        _drop_unused_blob(db_sess, file_key)
+        raise StudentDuplicateAbsent(date, student.id)
+
+    # google sheets row is written by outbox worker after commit
+    outbox = SheetsOutbox(
+        kind='absent',
+        link=student.school.link,
+        payload={
+            'date': date.isoformat(),
+            'code': student.code,
+            'reason': reason,
+            'name': student.name,
+            'surname': student.surname,
+            'patronymic': student.patronymic,
+            'class_name': student.class_name
+        }
+    )
+
+    db_sess.add(outbox)
+    db_sess.commit()
+
+
 @student_router.put('/student/absent',
                     summary='Add student absent',
                     status_code=status.HTTP_201_CREATED,
                     responses={201: {"model": CreatedResponse, "description": "Absent has been added"},
                                400: {"model": BadRequest},
                                404: {"model": NotFound}})
-def student_absent_put(body: schemas.Absent, code: str = None, tg_user_id: int = None):
+def student_absent_put(body: schemas.Absent, code: str = None, tg_user_id: int = None,
+                       db_sess: Session = Depends(db_session.get_session)):
     """
-        Add student absent in db and google spreadsheets
+        Add student absent in db, google spreadsheets row is added in background
 
         ### Query (_only one parameter required_):
         - **code**: unique code, all students have this code
@@ -33,68 +103,58 @@ def student_absent_put(body: schemas.Absent, code: str = None, tg_user_id: int =
         ### Body:
         - **date**: date when student will absent, required
         - **reason** absent`s reason, required
-        - **file** photo or file of official proof, not required
+        - **file** photo or file of official proof, not required, big files should be sent
+        to /student/absent/upload
     """
     try:
-        db_sess = db_session.create_session()
-        student_id = 0
-        student = None
-        link = ''
-
         date = datetime.datetime.strptime(body.date, string_date_format).date()
+        student = _get_student(db_sess, code, tg_user_id)
 
-        if not (code is None):
-            student_code = code
-            student = db_sess.query(Student).filter(Student.code == student_code).first()
-
-            if student is None:
-                raise StudentNotFoundError(student_code=student_code)
-
-            student_id = student.id
-            school = student.school
-            link = school.link
-
-        elif not (tg_user_id is None):
-            tg_user_id = tg_user_id
-            student = db_sess.query(Student).filter(Student.tg_user_id == tg_user_id).first()
+        file_key, file_size = None, None
+        if not (body.file is None):
+            file_key, file_size = blob_store.put(decode_proof(body.file))
 
-            if student is None:
-                raise StudentNotFoundError(student_tg_user_id=tg_user_id)
+        _add_absent(db_sess, student, date, body.reason, file_key, file_size)
 
-            student_id = student.id
-            school = student.school
-            link = school.link
-        else:
-            raise RequestDataKeysError([], ['code', 'tg_user_id'])
+        return JSONResponse(**CreatedResponse(content='Absent added').dict())
 
-        absents = db_sess.query(Absent).filter(Absent.student_id == student_id).all()
+    except (StudentDuplicateAbsent, RequestDataKeysError, ValueError) as error:
+        logging.warning(error)
+        return JSONResponse(**BadRequest(content=str(error)).dict())
+    except StudentNotFoundError as error:
+        logging.warning(error)
+        return JSONResponse(**NotFound(content=str(error)).dict())
 
-        for absent in absents:
-            if absent.date == date:
-                raise StudentDuplicateAbsent(date, student_id)
 
-        absent = Absent(
-            date=date,
-            reason=body.reason,
-            student_id=student_id
-        )
+@student_router.put('/student/absent/upload',
+                    summary='Add student absent with file',
+                    status_code=status.HTTP_201_CREATED,
+                    responses={201: {"model": CreatedResponse, "description": "Absent has been added"},
+                               400: {"model": BadRequest},
+                               404: {"model": NotFound}})
+def student_absent_upload(date: str = Form(...), reason: str = Form(...), file: UploadFile = File(None),
+                          code: str = None, tg_user_id: int = None,
+                          db_sess: Session = Depends(db_session.get_session)):
+    """
+        Add student absent with proof file sent as multipart/form-data, file is streamed to storage by chunks
 
-        name = student.name
-        surname = student.surname
-        patronymic = student.patronymic
-        class_name = student.class_name
+        ### Query (_only one parameter required_):
+        - **code**: unique code, all students have this code
+        - **tg_user_id**: unique telegram user id
+        ### Form:
+        - **date**: date when student will absent, required
+        - **reason** absent`s reason, required
+        - **file** photo or file of official proof, not required
+    """
+    try:
+        absent_date = datetime.datetime.strptime(date, string_date_format).date()
+        student = _get_student(db_sess, code, tg_user_id)
 
-        if not (body.file is None):
-            file = body.file
-            absent.file = base64.b64encode(file)
-            google_spread_sheets.google_sheets_student_absent(link, date, body.reason, name, surname,
-                                                              patronymic, class_name)
-        else:
-            google_spread_sheets.google_sheets_student_absent(link, date, body.reason, name, surname,
-                                                              patronymic, class_name)
+        file_key, file_size = None, None
+        if not (file is None):
+            file_key, file_size = blob_store.put_stream(file.file)
 
-        db_sess.add(absent)
-        db_sess.commit()
+        _add_absent(db_sess, student, absent_date, reason, file_key, file_size)
 
         return JSONResponse(**CreatedResponse(content='Absent added').dict())
 
@@ -112,7 +172,7 @@ def student_absent_put(body: schemas.Absent, code: str = None, tg_user_id: int =
                     responses={200: {"model": schemas.AbsentGetList, "description": "Successful Response"},
                                400: {"model": BadRequest},
                                404: {"model": NotFound}})
-def student_absent_get(code: str = None, tg_user_id: int = None):
+def student_absent_get(code: str = None, tg_user_id: int = None, db_sess: Session = Depends(db_session.get_session)):
     """
         Get student absents by code or tg user id
 
@@ -121,8 +181,6 @@ def student_absent_get(code: str = None, tg_user_id: int = None):
         - **tg_user_id**: unique telegram user id
     """
     try:
-        db_sess = db_session.create_session()
-
         if not (code is None):
             student = db_sess.query(Student).filter(Student.code == code).first()
 
@@ -138,16 +196,12 @@ def student_absent_get(code: str = None, tg_user_id: int = None):
 
         absent_list = schemas.AbsentGetList(absents=[])
         for absent in student.absents:
-            absent = schemas.AbsentGet(
+            absent_list.absents.append(schemas.AbsentGet(
                 date=datetime.date.strftime(absent.date, string_date_format),
                 reason=absent.reason,
-                code=student.code
-            )
-
-            if not (absent.file is None):
-                absent.file = str(absent.file)
-
-            absent_list.absents.append(absent)
+                code=student.code,
+                file_size=absent.file_size
+            ))
 
         return JSONResponse(content=absent_list.dict(), status_code=status.HTTP_200_OK)
 
@@ -165,7 +219,8 @@ def student_absent_get(code: str = None, tg_user_id: int = None):
                       responses={200: {"model": schemas.Absent},
                                  400: {"model": BadRequest},
                                  404: {"model": NotFound}})
-def student_absent_patch(body: schemas.AbsentPatch, date: str, code: str = None, tg_user_id: int = None):
+def student_absent_patch(body: schemas.AbsentPatch, date: str, code: str = None, tg_user_id: int = None,
+                         db_sess: Session = Depends(db_session.get_session)):
     """
         Change student absent in given date by code or tg user id
 
@@ -180,8 +235,6 @@ def student_absent_patch(body: schemas.AbsentPatch, date: str, code: str = None,
         - **new_file**: new file for absent, not required
     """
     try:
-        db_sess = db_session.create_session()
-
         if not (code is None):
             student = db_sess.query(Student).filter(Student.code == code).first()
 
@@ -196,34 +249,122 @@ def student_absent_patch(body: schemas.AbsentPatch, date: str, code: str = None,
         else:
             raise RequestDataKeysError([], ['code', 'tg_user_id'])
 
-        school = student.school
-        code = student.code
-        for absent in student.absents:
-            if absent.date == datetime.datetime.strptime(date, string_date_format):
-                if body.new_reason:
-                    absent.reason = body.new_reason
-                if body.new_date:
-                    absent.date = body.new_date
-                if body.new_file:
-                    absent.file = body.new_file
-                break
+        absent_date = datetime.datetime.strptime(date, string_date_format).date()
+        absent = db_sess.query(Absent).filter(Absent.student_id == student.id, Absent.date == absent_date).first()
+        if absent is None:
+            raise AbsentNotFoundError(absent_date, student_code=code, student_tg_user_id=tg_user_id)
+
+        if body.new_reason:
+            absent.reason = body.new_reason
+        if body.new_date:
+            absent.date = datetime.datetime.strptime(body.new_date, string_date_format).date()
+        file_key = None
+        if body.new_file:
+            file_key, absent.file_size = blob_store.put(decode_proof(body.new_file))
+            absent.file_key = file_key
+
+        try:
+            db_sess.commit()
+        except IntegrityError:
+            error = StudentDuplicateAbsent(absent.date, student.id)
+            db_sess.rollback()
+            _drop_unused_blob(db_sess, file_key)
+            raise error
 
         return JSONResponse(**SuccessfulResponse(content='Absent Changed').dict())
-    except RequestDataKeysError as error:
+    except (RequestDataKeysError, StudentDuplicateAbsent, ValueError) as error:
         logging.warning(error)
         return JSONResponse(**BadRequest(content=str(error)).dict())
-    except StudentNotFoundError as error:
+    except (StudentNotFoundError, AbsentNotFoundError) as error:
         logging.warning(error)
         return JSONResponse(**NotFound(content=str(error)).dict())
 
 
+@student_router.get('/student/absent/file',
+                    summary='Get absent file',
+                    status_code=status.HTTP_200_OK,
+                    response_class=StreamingResponse,
+                    responses={200: {"content": {"application/octet-stream": {}}},
+                               206: {"content": {"application/octet-stream": {}}, "description": "Part of file"},
+                               304: {"description": "File not modified"},
+                               400: {"model": BadRequest},
+                               404: {"model": NotFound},
+                               416: {"model": RangeNotSatisfiable}})
+def student_absent_file_get(date: str, code: str = None, tg_user_id: int = None,
+                            range_header: str = Header(None, alias='Range'),
+                            if_none_match: str = Header(None),
+                            db_sess: Session = Depends(db_session.get_session)):
+    """
+        Download file with proof of student absent in given date
+
+        ### Query:
+        - **code**: unique code, all students have this code
+        - **tg_user_id**: unique telegram user id
+        - **date**: absent date, required
+
+        ### Headers:
+        - **Range**: single byte range, e.g. bytes=0-1023, not required
+        - **If-None-Match**: ETag of cached file, not required
+    """
+    try:
+        if not (code is None):
+            student_filter = Student.code == code
+        elif not (tg_user_id is None):
+            student_filter = Student.tg_user_id == tg_user_id
+        else:
+            raise RequestDataKeysError([], ['code', 'tg_user_id'])
+
+        absent_date = datetime.datetime.strptime(date, string_date_format).date()
+        absent = db_sess.execute(
+            select(Absent.file_key, Absent.file_size)
+            .join(Student, Absent.student_id == Student.id)
+            .where(student_filter, Absent.date == absent_date)
+        ).first()
+
+        if absent is None or absent.file_key is None:
+            raise AbsentNotFoundError(absent_date, student_code=code, student_tg_user_id=tg_user_id)
+
+        # file key is sha256 of content, so it is a strong ETag
+        etag = f'"{absent.file_key}"'
+        headers = {'ETag': etag, 'Accept-Ranges': 'bytes'}
+        if not (if_none_match is None) and (if_none_match.strip() == '*' or
+                                             etag in map(str.strip, if_none_match.split(','))):
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+        byte_range = parse_byte_range(range_header, absent.file_size)
+        file = blob_store.open(absent.file_key)
+        if byte_range is None:
+            headers['Content-Length'] = str(absent.file_size)
+            return StreamingResponse(blob_store.iter_chunks(file),
+                                     media_type='application/octet-stream',
+                                     headers=headers)
+
+        start, end = byte_range
+        headers['Content-Length'] = str(end - start + 1)
+        headers['Content-Range'] = f'bytes {start}-{end}/{absent.file_size}'
+        return StreamingResponse(blob_store.iter_chunks(file, start, end - start + 1),
+                                 status_code=status.HTTP_206_PARTIAL_CONTENT,
+                                 media_type='application/octet-stream',
+                                 headers=headers)
+    except (RequestDataKeysError, ValueError) as error:
+        logging.warning(error)
+        return JSONResponse(**BadRequest(content=str(error)).dict())
+    except (AbsentNotFoundError, BlobNotFoundError) as error:
+        logging.warning(error)
+        return JSONResponse(**NotFound(content=str(error)).dict())
+    except RangeNotSatisfiableError as error:
+        logging.warning(error)
+        return JSONResponse(**RangeNotSatisfiable(content=str(error)).dict(),
+                            headers={'Content-Range': f'bytes */{error.size}'})
+
+
 @student_router.post('/student/tg_auth',
                      summary='',
                      status_code=status.HTTP_200_OK,
                      responses={200: {"model": SuccessfulResponse, "description": "Tg user id has been bind"},
                                 400: {"model": BadRequest},
                                 404: {"model": NotFound}})
-def student_tg_auth(body: schemas.TgAuth):
+def student_tg_auth(body: schemas.TgAuth, db_sess: Session = Depends(db_session.get_session)):
     """
         Binding telegram user id to student code
 
@@ -235,8 +376,6 @@ def student_tg_auth(body: schemas.TgAuth):
         code = body.code
         tg_id = body.tg_user_id
 
-        db_sess = db_session.create_session()
-
         student = db_sess.query(Student).filter(Student.code == code).first()
         if student is None:
             raise StudentNotFoundError(code)
@@ -263,7 +402,7 @@ def student_tg_auth(body: schemas.TgAuth):
                      responses={200: {"model": SuccessfulResponse, "description": "New code generate success"},
                                 400: {"model": BadRequest},
                                 404: {"model": NotFound}})
-def student_pass(body: schemas.CodeTgUserId):
+def student_pass(body: schemas.CodeTgUserId, db_sess: Session = Depends(db_session.get_session)):
     """
         Generating new code for student with given code or telegram id
 
@@ -275,7 +414,6 @@ def student_pass(body: schemas.CodeTgUserId):
         link = ''
         old_code = ''
 
-        db_sess = db_session.create_session()
         gen_code = generate_unique_code(db_sess)
         if not (body.code is None):
             code = body.code
@@ -304,9 +442,26 @@ def student_pass(body: schemas.CodeTgUserId):
         else:
             raise RequestDataKeysError([], ['code', 'tg_user_id'])
 
+        sheet_row = student.sheet_row
         db_sess.commit()
 
-        google_spread_sheets.google_sheets_student_code_generate(link, old_code, gen_code)
+        try:
+            google_spread_sheets.google_sheets_student_code_generate(link, old_code, gen_code, sheet_row)
+        except StudentNotFoundError as error:
+            # new code is already saved, student row was removed from worksheet
+            logging.warning(error)
+        except SHEETS_ERRORS as error:
+            if not sheets_outage(error):
+                raise
+            # new code is already saved, sheet cell is updated later by outbox worker
+            logging.warning(error)
+            db_sess.add(SheetsOutbox(kind='code', link=link, payload={
+                'position': STUDENTS_SHEET,
+                'row': sheet_row,
+                'old_code': old_code,
+                'code': gen_code
+            }))
+            db_sess.commit()
 
         return JSONResponse(**SuccessfulResponse(content='New code generate success').dict())
     except RequestDataKeysError as error:
@@ -324,7 +479,8 @@ def student_pass(body: schemas.CodeTgUserId):
                     responses={200: {"model": schemas.StudentGet},
                                400: {"model": BadRequest},
                                404: {"model": NotFound}})
-def student_get(code: str = None, tg_user_id: int = None):
+async def student_get(code: str = None, tg_user_id: int = None,
+                      db_sess: AsyncSession = Depends(db_session.get_async_session)):
     """
         Get information about student with given code or tg user id
 
@@ -333,9 +489,9 @@ def student_get(code: str = None, tg_user_id: int = None):
         - **tg_user_id**: unique telegram user id
     """
     try:
-        db_sess = db_session.create_session()
         if not (code is None):
-            student = db_sess.query(Student).filter(Student.code == code).first()
+            result = await db_sess.execute(select(Student).where(Student.code == code))
+            student = result.scalars().first()
 
             if student is None:
                 raise StudentNotFoundError(student_code=code)
@@ -355,7 +511,8 @@ def student_get(code: str = None, tg_user_id: int = None):
             return JSONResponse(content=response_body.dict(), status_code=status.HTTP_200_OK)
 
         elif not (tg_user_id is None):
-            student = db_sess.query(Student).filter(Student.tg_user_id == tg_user_id).first()
+            result = await db_sess.execute(select(Student).where(Student.tg_user_id == tg_user_id))
+            student = result.scalars().first()
 
             if student is None:
                 raise StudentNotFoundError(student_tg_user_id=tg_user_id)
@@ -386,10 +543,11 @@ def student_get(code: str = None, tg_user_id: int = None):
 @student_router.delete('/student',
                        summary='Delete student',
                        status_code=status.HTTP_200_OK,
-                       responses={200: {"model": schemas.StudentGet},
+                       responses={200: {"model": SuccessfulResponse},
                                   400: {"model": BadRequest},
                                   404: {"model": NotFound}})
-def student_delete(code: str = None, tg_user_id: int = None, absents: bool = False):
+def student_delete(code: str = None, tg_user_id: int = None, absents: bool = False,
+                   db_sess: Session = Depends(db_session.get_session)):
     """
         Delete student with given code or tg user id
 
@@ -399,22 +557,16 @@ def student_delete(code: str = None, tg_user_id: int = None, absents: bool = Fal
         - **absents**: flag, when true absents from given student will delete, not required
     """
     try:
-        db_sess = db_session.create_session()
         if not (code is None):
-            student = db_sess.query(Student).filter(Student.code == code).first()
+            condition = Student.code == code
         elif not (tg_user_id is None):
-            student = db_sess.query(Student).filter(Student.tg_user_id == tg_user_id).first()
+            condition = Student.tg_user_id == tg_user_id
         else:
             raise RequestDataKeysError([], ['code', 'tg_user_id'])
 
-        if student is None:
-            raise StudentNotFoundError(student_code=code)
-
-        if absents:
-            for absent in student.absents:
-                db_sess.delete(absent)
-
-        db_sess.delete(student)
+        deleted, _ = delete_students(db_sess, condition, absents)
+        if not deleted:
+            raise StudentNotFoundError(student_code=code, student_tg_user_id=tg_user_id)
         db_sess.commit()
 
         return JSONResponse(**SuccessfulResponse(content='Student deleted').dict())
@@ -433,7 +585,8 @@ def student_delete(code: str = None, tg_user_id: int = None, absents: bool = Fal
                       responses={200: {"model": schemas.StudentGet},
                                  400: {"model": BadRequest},
                                  404: {"model": NotFound}})
-def student_patch(body: schemas.StudentPatch, code: str = None, tg_user_id: int = None):
+def student_patch(body: schemas.StudentPatch, code: str = None, tg_user_id: int = None,
+                  db_sess: Session = Depends(db_session.get_session)):
     """
         Patch student with given code or tg user id
 
@@ -449,8 +602,6 @@ def student_patch(body: schemas.StudentPatch, code: str = None, tg_user_id: int
         - **new_school_name**: new school name for student, not required
     """
     try:
-        db_sess = db_session.create_session()
-
         if not (code is None):
             student = db_sess.query(Student).filter(Student.code == code).first()
         elif not (tg_user_id is None):
@@ -1,15 +1,22 @@
 import logging
 
 
-from fastapi import APIRouter, status
+from fastapi import APIRouter, status, Depends, Query
 from fastapi.responses import JSONResponse
 from data.student import Student
 from tools.error_book import *
 from routers.responses import *
 from data import db_session
+from sqlalchemy import delete, select, update
+from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from data.teacher import Teacher
-from tools.tools import generate_unique_code, find_student
-from google_spreadsheets.google_spread_sheets import google_spread_sheets
+from data.absent import Absent
+from data.student_search import search_students
+from tools.settings import string_date_format, STUDENT_SEARCH_THRESHOLD
+from tools.tools import generate_unique_code, delete_students
+from data.sheets_outbox import SheetsOutbox
+from google_spreadsheets.google_spread_sheets import google_spread_sheets, TEACHERS_SHEET, SHEETS_ERRORS, sheets_outage
 import routers.models as schemas
 
 
@@ -22,7 +29,7 @@ teacher_router = APIRouter()
                      responses={200: {"model": SuccessfulResponse, "description": "Tg user id has been bind"},
                                 400: {"model": BadRequest},
                                 404: {"model": NotFound}})
-def teacher_tg_auth(body: schemas.TgAuth):
+def teacher_tg_auth(body: schemas.TgAuth, db_sess: Session = Depends(db_session.get_session)):
     """
         Binding tg user id to teacher code
 
@@ -34,8 +41,6 @@ def teacher_tg_auth(body: schemas.TgAuth):
         code = body.code
         tg_id = body.tg_user_id
 
-        db_sess = db_session.create_session()
-
         teacher = db_sess.query(Teacher).filter(Teacher.code == code).first()
         if teacher is None:
             raise TeacherNotFoundError(code)
@@ -61,7 +66,7 @@ def teacher_tg_auth(body: schemas.TgAuth):
                      responses={200: {"model": SuccessfulResponse},
                                 400: {"model": BadRequest},
                                 404: {"model": NotFound}})
-def teacher_pass(body: schemas.CodeTgUserId):
+def teacher_pass(body: schemas.CodeTgUserId, db_sess: Session = Depends(db_session.get_session)):
     """
         Generating new code for teacher:
 
@@ -70,7 +75,6 @@ def teacher_pass(body: schemas.CodeTgUserId):
         - **tg_user_id**: unique telegram user id
     """
     try:
-        db_sess = db_session.create_session()
         gen_code = generate_unique_code(db_sess)
         if not (body.code is None):
             code = body.code
@@ -98,9 +102,26 @@ def teacher_pass(body: schemas.CodeTgUserId):
         else:
             raise RequestDataKeysError([], ['code', 'tg_user_id'])
 
+        sheet_row = teacher.sheet_row
         db_sess.commit()
 
-        google_spread_sheets.google_sheets_teacher_code_generate(link, old_code, gen_code)
+        try:
+            google_spread_sheets.google_sheets_teacher_code_generate(link, old_code, gen_code, sheet_row)
+        except TeacherNotFoundError as error:
+            # new code is already saved, teacher row was removed from worksheet
+            logging.warning(error)
+        except SHEETS_ERRORS as error:
+            if not sheets_outage(error):
+                raise
+            # new code is already saved, sheet cell is updated later by outbox worker
+            logging.warning(error)
+            db_sess.add(SheetsOutbox(kind='code', link=link, payload={
+                'position': TEACHERS_SHEET,
+                'row': sheet_row,
+                'old_code': old_code,
+                'code': gen_code
+            }))
+            db_sess.commit()
 
         return JSONResponse(**SuccessfulResponse(content='New code generate success').dict())
     except TeacherNotFoundError as error:
@@ -118,7 +139,8 @@ def teacher_pass(body: schemas.CodeTgUserId):
                     responses={200: {"model": schemas.TeacherGet},
                                400: {"model": BadRequest},
                                404: {"model": NotFound}})
-def teacher_get(code: str = None, tg_user_id: int = None):
+async def teacher_get(code: str = None, tg_user_id: int = None,
+                      db_sess: AsyncSession = Depends(db_session.get_async_session)):
     """
         Get information about teacher with given code or tg user id
 
@@ -127,10 +149,9 @@ def teacher_get(code: str = None, tg_user_id: int = None):
         - **tg_user_id**: unique telegram user id
     """
     try:
-        db_sess = db_session.create_session()
-
         if not (code is None):
-            teacher = db_sess.query(Teacher).filter(Teacher.code == code).first()
+            result = await db_sess.execute(select(Teacher).where(Teacher.code == code))
+            teacher = result.scalars().first()
 
             if teacher is None:
                 raise TeacherNotFoundError(teacher_code=code)
@@ -149,7 +170,8 @@ def teacher_get(code: str = None, tg_user_id: int = None):
 
             return JSONResponse(content=response_body.dict(), status_code=status.HTTP_200_OK)
         elif not (tg_user_id is None):
-            teacher = db_sess.query(Teacher).filter(Teacher.tg_user_id == tg_user_id).first()
+            result = await db_sess.execute(select(Teacher).where(Teacher.tg_user_id == tg_user_id))
+            teacher = result.scalars().first()
 
             if teacher is None:
                 raise TeacherNotFoundError(teacher_tg_user_id=tg_user_id)
@@ -183,18 +205,19 @@ def teacher_get(code: str = None, tg_user_id: int = None):
                     responses={200: {"model": schemas.FindByNameResponse},
                                400: {"model": BadRequest},
                                404: {"model": NotFound}})
-def teacher_get_student_by_name(name: str, code: str = None, tg_user_id: int = None):
+def teacher_get_student_by_name(name: str, code: str = None, tg_user_id: int = None,
+                                limit: int = Query(5, ge=1, le=50),
+                                db_sess: Session = Depends(db_session.get_session)):
     """
-        Get information about teacher students with given name
+        Get information about teacher students with given name, most similar first
 
         ### Query:
         - **code**: unique code, all teachers have this code
         - **tg_user_id**: unique telegram user id
         - **name**: student name, required
+        - **limit**: max number of students, 5 by default
     """
     try:
-        db_sess = db_session.create_session()
-
         if not (code is None):
             teacher = db_sess.query(Teacher).filter(Teacher.code == code).first()
 
@@ -210,15 +233,10 @@ def teacher_get_student_by_name(name: str, code: str = None, tg_user_id: int = N
         else:
             raise RequestDataKeysError([], ['code', 'tg_user_id'])
 
-        student_list = []
-        for student in teacher.students:
-            student_list.append((f'{student.surname} {student.name} {student.patronymic}', student.code))
-
-        response_list = find_student(student_list, name)
+        student_list = search_students(db_sess, name, limit, STUDENT_SEARCH_THRESHOLD, class_name=teacher.class_name)
 
         response_json = schemas.FindByNameResponse(students=[])
-        for code in response_list:
-            student = db_sess.query(Student).filter(Student.code == code).first()
+        for student in student_list:
             student_json = schemas.StudentGet(
                 name=student.name,
                 surname=student.surname,
@@ -247,7 +265,8 @@ def teacher_get_student_by_name(name: str, code: str = None, tg_user_id: int = N
                     responses={200: {"model": schemas.StudentListGet},
                                400: {"model": BadRequest},
                                404: {"model": NotFound}})
-def teacher_get_student_by_name(code: str = None, tg_user_id: int = None):
+def teacher_get_student_by_name(code: str = None, tg_user_id: int = None,
+                                db_sess: Session = Depends(db_session.get_session)):
     """
         Get information about teacher students with given code or tg user id:
 
@@ -256,7 +275,6 @@ def teacher_get_student_by_name(code: str = None, tg_user_id: int = None):
         - **tg_user_id**: unique telegram user id
     """
     try:
-        db_sess = db_session.create_session()
         teacher = None
 
         if not (code is None):
@@ -300,54 +318,62 @@ def teacher_get_student_by_name(code: str = None, tg_user_id: int = None):
                     responses={200: {"model": schemas.AbsentGetList},
                                400: {"model": BadRequest},
                                404: {"model": NotFound}})
-def teacher_students_absents(date: str, code: str = None, tg_user_id: int = None):
+def teacher_students_absents(date: str = None, date_from: str = Query(None, alias='from'),
+                             date_to: str = Query(None, alias='to'), code: str = None, tg_user_id: int = None,
+                             db_sess: Session = Depends(db_session.get_session)):
     """
         Get student absents from teacher with given code or tg user id
 
         ### Query:
         - **code**: unique code, all teachers have this code
         - **tg_user_id**: unique telegram user id
-        - **date**: absent date, required
+        - **date**: absent date, not required
+        - **from**: first absent date of range, not required
+        - **to**: last absent date of range, not required
     """
     try:
-        db_sess = db_session.create_session()
         response_dict = schemas.AbsentGetList(absents=[])
 
         if not (code is None):
-            teacher = db_sess.query(Teacher).filter(Teacher.code == code).first()
-            if teacher is None:
-                raise TeacherNotFoundError(teacher_code=code)
-
+            teacher_filter = Teacher.code == code
         elif not (tg_user_id is None):
-            teacher = db_sess.query(Teacher).filter(Teacher.tg_user_id == tg_user_id).first()
-            if teacher is None:
-                raise TeacherNotFoundError(teacher_tg_user_id=tg_user_id)
-
+            teacher_filter = Teacher.tg_user_id == tg_user_id
         else:
             raise RequestDataKeysError([], ['code', 'tg_user_id'])
 
-        for student in teacher.students:
-            for absent in student.absents:
-                if date is None:
-                    response_dict.absents.append(schemas.AbsentGet(
-                        date=absent.date.isoformat(),
-                        reason=absent.reason,
-                        code=student.code
-                    ))
-                    continue
-
-                if absent.date.isoformat() == date:
-                    response_dict.absents.append(schemas.AbsentGet(
-                        date=absent.date.isoformat(),
-                        reason=absent.reason,
-                        code=student.code,
-                    ))
+        query = select(Absent.date, Absent.reason, Student.code) \
+            .select_from(Teacher) \
+            .join(Student, Student.class_name == Teacher.class_name) \
+            .join(Absent, Absent.student_id == Student.id) \
+            .where(teacher_filter)
+
+        if not (date is None):
+            query = query.where(Absent.date == datetime.datetime.strptime(date, string_date_format).date())
+        if not (date_from is None):
+            query = query.where(Absent.date >= datetime.datetime.strptime(date_from, string_date_format).date())
+        if not (date_to is None):
+            query = query.where(Absent.date <= datetime.datetime.strptime(date_to, string_date_format).date())
+
+        rows = db_sess.execute(query.order_by(Absent.date, Student.surname, Student.name)).all()
+
+        # empty result needs one more query to tell missing teacher from no absents
+        if not rows and db_sess.query(Teacher.id).filter(teacher_filter).first() is None:
+            if not (code is None):
+                raise TeacherNotFoundError(teacher_code=code)
+            raise TeacherNotFoundError(teacher_tg_user_id=tg_user_id)
+
+        for row in rows:
+            response_dict.absents.append(schemas.AbsentGet(
+                date=row.date.isoformat(),
+                reason=row.reason,
+                code=row.code
+            ))
 
         return JSONResponse(content=response_dict.dict(), status_code=status.HTTP_200_OK)
     except TeacherNotFoundError as error:
         logging.warning(error)
         return JSONResponse(**NotFound(content=str(error)).dict())
-    except RequestDataKeysError as error:
+    except (RequestDataKeysError, ValueError) as error:
         logging.warning(error)
         return JSONResponse(**BadRequest(content=str(error)).dict())
 
@@ -355,10 +381,11 @@ def teacher_students_absents(date: str, code: str = None, tg_user_id: int = None
 @teacher_router.delete('/teacher',
                        summary='Delete teacher',
                        status_code=status.HTTP_200_OK,
-                       responses={200: {"model": SuccessfulResponse},
+                       responses={200: {"model": schemas.DeletedCount},
                                   400: {"model": BadRequest},
                                   404: {"model": NotFound}})
-def teacher_delete(code: str = None, tg_user_id: int = None, students: bool = False, absents: bool = False):
+def teacher_delete(code: str = None, tg_user_id: int = None, students: bool = False, absents: bool = False,
+                   db_sess: Session = Depends(db_session.get_session)):
     """
         Delete teacher with given code or tg user id, only one of parameters is required
 
@@ -369,29 +396,31 @@ def teacher_delete(code: str = None, tg_user_id: int = None, students: bool = Fa
         - **absents**: flag when true absents from given teacher will delete, not required
     """
     try:
-        db_sess = db_session.create_session()
-
         if not (code is None):
-            teacher = db_sess.query(Teacher).filter(Teacher.code == code).first()
+            teacher = db_sess.query(Teacher.id, Teacher.class_name).filter(Teacher.code == code).first()
         elif not (tg_user_id is None):
-            teacher = db_sess.query(Teacher).filter(Teacher.tg_user_id == tg_user_id).first()
+            teacher = db_sess.query(Teacher.id, Teacher.class_name).filter(Teacher.tg_user_id == tg_user_id).first()
         else:
             raise RequestDataKeysError([], ['code', 'tg_user_id'])
 
         if teacher is None:
             raise TeacherNotFoundError(teacher_code=code, teacher_tg_user_id=tg_user_id)
 
-        if students:
-            for student in teacher.students:
-                if absents:
-                    for absent in student.absents:
-                        db_sess.delete(absent)
-                db_sess.delete(student)
-
-        db_sess.delete(teacher)
+        # set based statements in one transaction, kept students lose their class, teacher without class has no
+        # students, class_name == None would match all students without class
+        count = schemas.DeletedCount()
+        in_class = Student.class_name == teacher.class_name
+        if not (teacher.class_name is None) and students:
+            count.students, count.absents = delete_students(db_sess, in_class, absents)
+        elif not (teacher.class_name is None):
+            db_sess.execute(update(Student).where(in_class).values(class_name=None)
+                            .execution_options(synchronize_session=False))
+
+        count.teachers = db_sess.execute(delete(Teacher).where(Teacher.id == teacher.id)
+                                         .execution_options(synchronize_session=False)).rowcount
         db_sess.commit()
 
-        return JSONResponse(**SuccessfulResponse(content='Teacher deleted').dict())
+        return JSONResponse(content=count.dict(), status_code=status.HTTP_200_OK)
     except TeacherNotFoundError as error:
         logging.warning(error)
         return JSONResponse(**NotFound(content=str(error)).dict())
@@ -406,7 +435,8 @@ def teacher_delete(code: str = None, tg_user_id: int = None, students: bool = Fa
                       responses={200: {"model": SuccessfulResponse},
                                  400: {"model": BadRequest},
                                  404: {"model": NotFound}})
-def teacher_patch(body: schemas.TeacherPatch, code: str = None, tg_user_id: int = None):
+def teacher_patch(body: schemas.TeacherPatch, code: str = None, tg_user_id: int = None,
+                  db_sess: Session = Depends(db_session.get_session)):
     """
         Patch teacher with given code or tg user id
 
@@ -423,8 +453,6 @@ def teacher_patch(body: schemas.TeacherPatch, code: str = None, tg_user_id: int
 
     """
     try:
-        db_sess = db_session.create_session()
-
         if not (code is None):
             teacher = db_sess.query(Teacher).filter(Teacher.code == code).first()
         elif not (tg_user_id is None):
@@ -3,14 +3,14 @@ import routers.user.schemas as schemas
 
 from tools.error_book import *
 from tools.settings import *
-from tools.tools import generate_hashed_password
+from tools.tools import generate_hashed_password_pooled
 from routers.responses import *
 from fastapi import APIRouter, status, Depends
 from fastapi.responses import JSONResponse
 from data import db_session
+from sqlalchemy.orm import Session
 from data.user import User
-from jose import jwt
-from routers.auth.auth import token_check
+from routers.auth.auth import token_check, invalidate_user
 
 
 user_router = APIRouter()
@@ -20,8 +20,9 @@ user_router = APIRouter()
                  summary='Add user',
                  status_code=status.HTTP_201_CREATED,
                  responses={201: {"model": CreatedResponse, "description": "User added"},
-                            400: {"model": BadRequest}})
-def user_put(body: schemas.User):
+                            400: {"model": BadRequest},
+                            503: {"model": ServiceUnavailable}})
+def user_put(body: schemas.User, db_sess: Session = Depends(db_session.get_session)):
     """
         Add new user
 
@@ -31,13 +32,12 @@ def user_put(body: schemas.User):
         - **email**: user email
     """
     try:
-        db_sess = db_session.create_session()
         user = db_sess.query(User).filter(User.login == body.login).first()
 
         if not (user is None):
             raise UserExistError(login=body.login)
 
-        hashed_password = generate_hashed_password(body.password)
+        hashed_password = generate_hashed_password_pooled(body.password)
         db_sess.add(User(
             email=body.email,
             login=body.login,
@@ -49,6 +49,9 @@ def user_put(body: schemas.User):
     except UserExistError as error:
         logging.warning(error)
         return JSONResponse(**BadRequest(content=str(error)).dict())
+    except ExecutorOverloadError as error:
+        logging.warning(error)
+        return JSONResponse(**ServiceUnavailable(content=str(error)).dict())
 
 
 @user_router.get("/user/{login}",
@@ -56,7 +59,7 @@ def user_put(body: schemas.User):
                  status_code=status.HTTP_200_OK,
                  responses={200: {"model": schemas.UserGet},
                             404: {"model": NotFound}})
-def user_get(login: str):
+def user_get(login: str, db_sess: Session = Depends(db_session.get_session)):
     """
         Get information about user with given login:
 
@@ -64,7 +67,6 @@ def user_get(login: str):
         - **login**: user login, required
     """
     try:
-        db_sess = db_session.create_session()
         user = db_sess.query(User).filter(User.login == login).first()
 
         if user is None:
@@ -82,10 +84,9 @@ def user_get(login: str):
                  status_code=status.HTTP_200_OK,
                  responses={200: {"model": schemas.UserGetList},
                             404: {"model": NotFound}})
-def user_get():
+def user_get(db_sess: Session = Depends(db_session.get_session)):
     """Get information about users"""
     try:
-        db_sess = db_session.create_session()
         users = db_sess.query(User).all()
 
         response = schemas.UserGetList(users=[])
@@ -106,8 +107,9 @@ def user_get():
                    dependencies=[Depends(token_check)],
                    responses={200: {"model": SuccessfulResponse},
                               404: {"model": NotFound},
-                              400: {"model": BadRequest}})
-def user_patch(login: str, body: schemas.UserPatch):
+                              400: {"model": BadRequest},
+                              503: {"model": ServiceUnavailable}})
+def user_patch(login: str, body: schemas.UserPatch, db_sess: Session = Depends(db_session.get_session)):
     """
         Patch user with given login
 
@@ -121,7 +123,6 @@ def user_patch(login: str, body: schemas.UserPatch):
         - **new_info**: new info for user, not required
     """
     try:
-        db_sess = db_session.create_session()
         user = db_sess.query(User).filter(User.login == login).first()
 
         if user is None:
@@ -132,15 +133,21 @@ def user_patch(login: str, body: schemas.UserPatch):
         if not (body.new_email is None):
             user.email = body.new_email
         if not (body.new_password is None):
-            user.hashed_password = jwt.encode({'password': body.new_password}, SECRET_KEY, ALGORITHM)
+            user.hashed_password = generate_hashed_password_pooled(body.new_password)
         if not (body.new_info is None):
             user.info = body.new_info
 
         db_sess.commit()
+        invalidate_user(login)
+        if not (body.new_login is None):
+            invalidate_user(body.new_login)
         return JSONResponse(**SuccessfulResponse(content='User changed').dict())
     except UserNotFountError as error:
         logging.warning(error)
         return JSONResponse(**NotFound(content=str(error)).dict())
+    except ExecutorOverloadError as error:
+        logging.warning(error)
+        return JSONResponse(**ServiceUnavailable(content=str(error)).dict())
 
 
 @user_router.delete("/user/{login}",
@@ -149,7 +156,7 @@ def user_patch(login: str, body: schemas.UserPatch):
                     dependencies=[Depends(token_check)],
                     responses={200: {"model": SuccessfulResponse},
                                404: {"model": NotFound}})
-def user_delete(login: str):
+def user_delete(login: str, db_sess: Session = Depends(db_session.get_session)):
     """
         Delete user with given login
 
@@ -157,7 +164,6 @@ def user_delete(login: str):
         - **login**: user login, required
     """
     try:
-        db_sess = db_session.create_session()
         user = db_sess.query(User).filter(User.login == login).first()
 
         if user is None:
@@ -165,6 +171,7 @@ def user_delete(login: str):
 
         db_sess.delete(user)
         db_sess.commit()
+        invalidate_user(login)
 
         return JSONResponse(**SuccessfulResponse(content='User deleted').dict())
     except UserNotFountError as error:
@@ -0,0 +1,120 @@
+import datetime
+import os
+import sys
+
+import pytest
+import sqlalchemy as sa
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# settings are read on import, sheets are faked so tests never reach Google
+os.environ.update({
+    'SECRET_KEY': 'test', 'ALGORITHM': 'HS256', 'DB_USER': 'test', 'DB_PASSWORD': 'test', 'DB_HOST': 'localhost',
+    'DB_NAME': 'test', 'SHEETS_BACKEND': 'fake', 'SHEETS_FAKE_PATH': '', 'SHEETS_RATE_PER_MINUTE': '0',
+})
+
+from data import db_session  # noqa: E402
+from data.identity import IDENTITY_VIEW  # noqa: E402
+from data.school import School  # noqa: E402
+from data.teacher import Teacher  # noqa: E402
+from data.student import Student  # noqa: E402
+from data.absent import Absent  # noqa: E402
+from routers.teacher.teacher_router import teacher_router  # noqa: E402
+from routers.student.student_router import student_router  # noqa: E402
+from routers.school.school_router import school_router  # noqa: E402
+from google_spreadsheets.rate_limiter import sheets_request_limits  # noqa: E402
+from tools.settings import SHEETS_REQUEST_RETRIES, SHEETS_REQUEST_WAIT_TIMEOUT  # noqa: E402
+
+
+@pytest.fixture
+def engines(tmp_path):
+    """Sync and async engines on one sqlite file, tables are created one by one without postgres only DDL"""
+    path = tmp_path / 'test.db'
+    engine = sa.create_engine(f'sqlite:///{path}')
+    async_engine = create_async_engine(f'sqlite+aiosqlite:///{path}')
+    for table in db_session.SqlAlchemyBase.metadata.sorted_tables:
+        table.create(engine)
+    with engine.begin() as connection:
+        connection.execute(sa.text(IDENTITY_VIEW.statement.replace('CREATE OR REPLACE VIEW', 'CREATE VIEW')))
+
+    sa.event.listen(engine, 'before_cursor_execute', db_session._count_query)
+    sa.event.listen(async_engine.sync_engine, 'before_cursor_execute', db_session._count_query)
+    yield engine, async_engine
+    engine.dispose()
+
+
+@pytest.fixture
+def db_sess(engines):
+    session = sessionmaker(bind=engines[0])()
+    yield session
+    session.close()
+
+
+@pytest.fixture
+def client(engines):
+    """App with school, teacher and student routers, last_query_count is set by every request"""
+    engine, async_engine = engines
+    factory = sessionmaker(bind=engine)
+    async_factory = sessionmaker(bind=async_engine, class_=AsyncSession, expire_on_commit=False)
+
+    def get_session():
+        session = factory()
+        try:
+            yield session
+        finally:
+            session.close()
+
+    async def get_async_session():
+        async with async_factory() as session:
+            yield session
+
+    app = FastAPI()
+    app.include_router(teacher_router, prefix='/v1')
+    app.include_router(student_router, prefix='/v1')
+    app.include_router(school_router, prefix='/v1')
+    app.dependency_overrides[db_session.get_session] = get_session
+    app.dependency_overrides[db_session.get_async_session] = get_async_session
+
+    # same as main.limit_sheets_calls and main.count_db_queries middlewares
+    @app.middleware('http')
+    async def limit_sheets_calls(request: Request, call_next):
+        with sheets_request_limits(SHEETS_REQUEST_RETRIES, SHEETS_REQUEST_WAIT_TIMEOUT):
+            return await call_next(request)
+
+    @app.middleware('http')
+    async def count_db_queries(request: Request, call_next):
+        with db_session.count_queries() as counter:
+            response = await call_next(request)
+        app.state.last_query_count = counter.count
+        return response
+
+    with TestClient(app) as test_client:
+        yield test_client
+
+
+@pytest.fixture
+def add_school(db_sess):
+    """Factory of school with a teacher per class, students per class and absents per student on consecutive days"""
+    def add(name: str = 'school', classes: int = 1, students: int = 1, absents: int = 1,
+            link: str = 'https://docs.google.com/spreadsheets/d/test/edit') -> School:
+        db_sess.add(School(name=name, link=link))
+        for class_index in range(classes):
+            class_name = f'{name}-{class_index}'
+            db_sess.add(Teacher(name='Teacher', surname=class_name, patronymic='', class_name=class_name,
+                                code=f't-{class_name}', school_name=name))
+            for student_index in range(students):
+                student = Student(name=f'Student{student_index}', surname=class_name, patronymic='',
+                                  class_name=class_name, code=f's-{class_name}-{student_index}', school_name=name)
+                db_sess.add(student)
+                db_sess.flush()
+                db_sess.add_all(Absent(student_id=student.id, reason='ill',
+                                       date=datetime.date(2022, 2, 1) + datetime.timedelta(days=day))
+                                for day in range(absents))
+        db_sess.commit()
+        return db_sess.query(School).get(name)
+
+    return add
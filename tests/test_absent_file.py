@@ -0,0 +1,114 @@
+import hashlib
+
+import pytest
+
+from data.absent import Absent
+from routers.student import student_router
+from tools.blob_store import LocalBlobStore
+from tools.error_book import BlobNotFoundError
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    store = LocalBlobStore(str(tmp_path / 'blobs'))
+    monkeypatch.setattr(student_router, 'blob_store', store)
+    return store
+
+
+def attach_file(db_sess, key: str, size: int):
+    absent = db_sess.query(Absent).first()
+    absent.file_key, absent.file_size = key, size
+    db_sess.commit()
+
+
+def test_file_and_range(client, db_sess, add_school, store):
+    add_school()
+    attach_file(db_sess, *store.put(b'0123456789'))
+
+    response = client.get('/v1/student/absent/file', params={'code': 's-school-0-0', 'date': '2022-02-01'})
+    assert response.status_code == 200
+    assert response.content == b'0123456789'
+
+    response = client.get('/v1/student/absent/file', params={'code': 's-school-0-0', 'date': '2022-02-01'},
+                          headers={'Range': 'bytes=2-4'})
+    assert response.status_code == 206
+    assert response.content == b'234'
+    assert response.headers['Content-Range'] == 'bytes 2-4/10'
+
+
+@pytest.mark.parametrize('range_header', [None, 'bytes=0-1'])
+def test_missing_blob_is_not_found(client, db_sess, add_school, store, range_header):
+    add_school()
+    attach_file(db_sess, 'a' * 64, 10)
+
+    headers = {} if range_header is None else {'Range': range_header}
+    response = client.get('/v1/student/absent/file', params={'code': 's-school-0-0', 'date': '2022-02-01'},
+                          headers=headers)
+    assert response.status_code == 404
+
+
+def upload(client, content: bytes, date: str = '2022-03-01'):
+    return client.put('/v1/student/absent/upload', params={'code': 's-school-0-0'},
+                      data={'date': date, 'reason': 'ill'}, files={'file': ('proof.jpg', content)})
+
+
+def test_upload_streams_file_to_store(client, db_sess, add_school, store):
+    add_school()
+
+    response = upload(client, b'proof' * 100000)
+
+    assert response.status_code == 201
+    absent = db_sess.query(Absent).filter(Absent.file_key.isnot(None)).one()
+    assert absent.file_size == 500000
+    with store.open(absent.file_key) as file:
+        assert file.read() == b'proof' * 100000
+
+
+def test_duplicate_upload_leaves_no_blob(client, db_sess, add_school, store):
+    add_school()
+    key, _ = store.put(b'shared')
+    attach_file(db_sess, key, 6)  # absent of 2022-02-01 keeps blob of same content
+
+    assert upload(client, b'duplicate', date='2022-02-01').status_code == 400
+    assert upload(client, b'shared', date='2022-02-01').status_code == 400
+
+    with pytest.raises(BlobNotFoundError):
+        store.open(hashlib.sha256(b'duplicate').hexdigest())
+    with store.open(key) as file:
+        assert file.read() == b'shared'
+
+
+def test_cached_file_is_not_modified(client, db_sess, add_school, store):
+    add_school()
+    key, size = store.put(b'0123456789')
+    attach_file(db_sess, key, size)
+    params = {'code': 's-school-0-0', 'date': '2022-02-01'}
+
+    etag = client.get('/v1/student/absent/file', params=params).headers['ETag']
+    response = client.get('/v1/student/absent/file', params=params, headers={'If-None-Match': f'"other", {etag}'})
+
+    assert response.status_code == 304
+    assert response.content == b''
+    assert client.get('/v1/student/absent/file', params=params,
+                      headers={'If-None-Match': '"other"'}).status_code == 200
+
+
+@pytest.mark.parametrize('range_header, code, content', [
+    ('bytes=-3', 206, b'789'),
+    ('bytes=-20', 206, b'0123456789'),
+    ('bytes=8-', 206, b'89'),
+    ('bytes=a-3', 200, b'0123456789'),
+    ('bytes=0-1,4-5', 200, b'0123456789'),
+    ('bytes=10-', 416, None),
+    ('bytes=-0', 416, None),
+])
+def test_suffix_and_invalid_range(client, db_sess, add_school, store, range_header, code, content):
+    add_school()
+    attach_file(db_sess, *store.put(b'0123456789'))
+
+    response = client.get('/v1/student/absent/file', params={'code': 's-school-0-0', 'date': '2022-02-01'},
+                          headers={'Range': range_header})
+
+    assert response.status_code == code
+    if content is not None:
+        assert response.content == content
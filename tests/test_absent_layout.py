@@ -0,0 +1,45 @@
+import datetime
+
+import pytest
+from sqlalchemy.orm import sessionmaker
+
+from data import db_session
+from data.sheets_outbox import SheetsOutbox
+from google_spreadsheets.absent_layout import AbsentLayout
+from google_spreadsheets.backends import FakeSheetsBackend
+from google_spreadsheets.google_spread_sheets import GoogleSpreadSheetsApi
+from google_spreadsheets.outbox_worker import OutboxWorker
+
+SUNDAY = datetime.date(2022, 2, 27)  # last day of ISO week
+MONDAY = datetime.date(2022, 2, 28)  # last day of month
+
+LAYOUT_TABS = [
+    ('daily', {SUNDAY: None, MONDAY: None}),
+    ('weekly', {SUNDAY: MONDAY, MONDAY: None}),
+    ('monthly', {SUNDAY: None, MONDAY: datetime.date(2022, 3, 1)}),
+]
+
+
+@pytest.mark.parametrize('mode, next_tabs', LAYOUT_TABS)
+def test_next_tab_date(mode, next_tabs):
+    layout = AbsentLayout(mode, 100)
+
+    assert {today: layout.next_tab_date(today) for today in next_tabs} == next_tabs
+
+
+@pytest.mark.parametrize('mode, next_tabs', LAYOUT_TABS)
+def test_enqueue_prewarm(engines, db_sess, add_school, monkeypatch, mode, next_tabs):
+    monkeypatch.setattr(db_session, 'create_session', sessionmaker(bind=engines[0]))
+    add_school('first', link='https://docs.google.com/spreadsheets/d/first/edit')
+    add_school('second', link='https://docs.google.com/spreadsheets/d/second/edit')
+    worker = OutboxWorker(GoogleSpreadSheetsApi(FakeSheetsBackend(), AbsentLayout(mode, 100)), 1, 10, 3, 1, 10, 1,
+                          prewarm=True)
+
+    for today, tomorrow in next_tabs.items():
+        db_sess.query(SheetsOutbox).delete()
+        db_sess.commit()
+
+        assert worker.enqueue_prewarm(today) == (0 if tomorrow is None else 2)
+        assert worker.enqueue_prewarm(today) == 0  # once a day
+        dates = db_sess.query(SheetsOutbox.payload).filter(SheetsOutbox.kind == 'absent_worksheet').all()
+        assert [payload['date'] for payload, in dates] == ([] if tomorrow is None else [str(tomorrow)] * 2)
@@ -0,0 +1,113 @@
+import asyncio
+import datetime
+import json
+
+import httpx
+import pytest
+from gspread.exceptions import APIError
+
+from google_spreadsheets.absent_layout import AbsentLayout
+from google_spreadsheets.async_sheets import AsyncSheetsClient, AsyncGoogleSpreadSheetsApi
+from google_spreadsheets.rate_limiter import SheetsRateLimiter
+
+LINK = 'https://docs.google.com/spreadsheets/d/test/edit'
+SHEETS = {'sheets': [{'properties': {'sheetId': 1, 'title': '2022-W09'}}]}
+
+
+class FakeCredentials:
+    """google.auth credentials whose refresh gives next token"""
+    def __init__(self):
+        self.token = None
+        self.valid = False
+        self.refreshes = 0
+
+    def refresh(self, request):
+        self.refreshes += 1
+        self.token = f'token-{self.refreshes}'
+        self.valid = True
+
+
+def error_response(code: int) -> httpx.Response:
+    return httpx.Response(code, json={'error': {'code': code, 'message': 'test', 'status': 'TEST'}})
+
+
+def sheets_client(handler, credentials=None) -> AsyncSheetsClient:
+    return AsyncSheetsClient('', SheetsRateLimiter(0, 0, 1), 1, 2, 2, 0, 0, transport=httpx.MockTransport(handler),
+                             credentials=credentials or FakeCredentials())
+
+
+def replies(*responses):
+    """MockTransport handler that answers with given responses in turn and keeps requests"""
+    requests = []
+    responses = iter(responses)
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        return next(responses)
+
+    return handler, requests
+
+
+def test_token_is_refreshed_once_for_concurrent_calls():
+    credentials = FakeCredentials()
+    handler, requests = replies(*[httpx.Response(200, json=SHEETS)] * 4)
+    client = sheets_client(handler, credentials)
+
+    async def calls():
+        await asyncio.gather(*[client.sheets('test') for _ in range(3)])
+        credentials.valid = False  # token expired
+        await client.sheets('test')
+        await client.aclose()
+
+    asyncio.run(calls())
+
+    assert credentials.refreshes == 2
+    assert [request.headers['Authorization'] for request in requests] == ['Bearer token-1'] * 3 + ['Bearer token-2']
+
+
+def test_server_error_is_retried():
+    handler, requests = replies(error_response(503), error_response(429), httpx.Response(200, json=SHEETS))
+
+    assert asyncio.run(sheets_client(handler).sheets('test')) == [SHEETS['sheets'][0]['properties']]
+    assert len(requests) == 3
+
+
+def test_retries_are_limited():
+    handler, requests = replies(*[error_response(500)] * 4)
+
+    with pytest.raises(APIError):
+        asyncio.run(sheets_client(handler).sheets('test'))
+    assert len(requests) == 3
+
+
+@pytest.mark.parametrize('code', [500, 503])
+def test_append_is_not_retried_on_server_error(code):
+    handler, requests = replies(error_response(code), httpx.Response(200, json={}))
+
+    with pytest.raises(APIError):
+        asyncio.run(sheets_client(handler).values_append('test', 'A1', [['x']]))
+    assert len(requests) == 1
+
+
+def test_append_is_retried_on_quota_error():
+    handler, requests = replies(error_response(429), error_response(429), httpx.Response(200, json={}))
+
+    asyncio.run(sheets_client(handler).values_append('test', 'A1', [['x']]))
+
+    assert len(requests) == 3
+
+
+def test_absents_are_sent_in_one_append():
+    handler, requests = replies(httpx.Response(200, json=SHEETS), httpx.Response(200, json={}))
+    sheets = AsyncGoogleSpreadSheetsApi(sheets_client(handler), layout=AbsentLayout('weekly', 100))
+    rows = [['1-А', 'Иванов', 'Иван', 'Иванович', 'ill', '', 's-1'],
+            ['1-А', 'Петров', 'Петр', 'Петрович', 'ill', '', 's-2']]
+
+    asyncio.run(sheets.google_sheets_student_absents(LINK, datetime.date(2022, 2, 28), rows))
+
+    append = requests[-1]
+    assert append.method == 'POST'
+    assert append.url.path == "/v4/spreadsheets/test/values/'2022-W09'!A1:append"
+    assert append.url.params['valueInputOption'] == 'RAW'
+    assert json.loads(append.content) == {'values': [['2022-02-28', *row] for row in rows]}
+    assert sheets.flush_metrics.as_dict()['rows'] == 2
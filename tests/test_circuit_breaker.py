@@ -0,0 +1,95 @@
+import types
+
+import pytest
+
+from google_spreadsheets import circuit_breaker
+from google_spreadsheets.circuit_breaker import CircuitBreaker
+from tools.error_book import SheetsUnavailableError
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = types.SimpleNamespace(now=1000.0)
+    monkeypatch.setattr(circuit_breaker, 'time', types.SimpleNamespace(monotonic=lambda: clock.now))
+    return clock
+
+
+def open_breaker(breaker: CircuitBreaker):
+    for _ in range(breaker.failure_threshold):
+        breaker.record_failure(breaker.before_call())
+
+
+def test_failures_in_a_row_open_circuit(clock):
+    breaker = CircuitBreaker(3, 30)
+    breaker.record_failure(breaker.before_call())
+    breaker.record_success(breaker.before_call())  # success resets count
+    breaker.record_failure(breaker.before_call())
+    breaker.record_failure(breaker.before_call())
+    assert breaker.state == CircuitBreaker.CLOSED
+
+    breaker.record_failure(breaker.before_call())
+
+    assert breaker.state == CircuitBreaker.OPEN
+    clock.now += 10
+    with pytest.raises(SheetsUnavailableError) as error:
+        breaker.before_call()
+    assert error.value.retry_after == pytest.approx(20)
+    assert breaker.status()['rejected'] == 1
+
+
+def test_trial_call_success_closes_circuit(clock):
+    breaker = CircuitBreaker(2, 30)
+    open_breaker(breaker)
+    clock.now += 30
+
+    started_at = breaker.before_call()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    with pytest.raises(SheetsUnavailableError):
+        breaker.before_call()  # only one trial call
+
+    breaker.record_success(started_at)
+    assert breaker.state == CircuitBreaker.CLOSED
+    breaker.before_call()
+
+
+def test_trial_call_failure_opens_circuit_again(clock):
+    breaker = CircuitBreaker(2, 30)
+    open_breaker(breaker)
+    clock.now += 30
+
+    breaker.record_failure(breaker.before_call())
+
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.status()['opened'] == 2
+    with pytest.raises(SheetsUnavailableError):
+        breaker.before_call()
+
+
+def test_lost_trial_call_is_given_up(clock):
+    breaker = CircuitBreaker(2, 30)
+    open_breaker(breaker)
+    clock.now += 30
+    breaker.before_call()  # trial call never reports back
+
+    clock.now += 30
+    breaker.before_call()
+
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+
+
+@pytest.mark.parametrize('trial', [False, True])
+def test_late_success_of_call_started_before_opening_is_ignored(clock, trial):
+    breaker = CircuitBreaker(2, 30)
+    slow_call = breaker.before_call()
+    clock.now += 1
+    open_breaker(breaker)
+    if trial:
+        clock.now += 30
+        breaker.before_call()
+
+    clock.now += 1
+    breaker.record_success(slow_call)
+    breaker.record_failure(slow_call)
+
+    assert breaker.state == (CircuitBreaker.HALF_OPEN if trial else CircuitBreaker.OPEN)
+    assert breaker.status()['opened'] == 1
@@ -0,0 +1,45 @@
+import time
+
+from data import db_session
+from data.student import Student
+from tools import tools
+from tools.tools import generate_unique_codes, CODE_LENGTH
+
+
+def test_codes_are_unique_and_use_one_query(db_sess):
+    with db_session.count_queries() as counter:
+        codes = generate_unique_codes(db_sess, 5000)
+
+    assert len(codes) == len(set(codes)) == 5000
+    assert all(len(code) == CODE_LENGTH for code in codes)
+    assert counter.count == 1
+
+
+def test_only_collisions_are_regenerated(db_sess, add_school, monkeypatch):
+    add_school(students=1)
+    taken = db_sess.query(Student.code).scalar()
+    drawn = iter([taken, 'fresh-0001', 'fresh-0002'])
+    monkeypatch.setattr(tools, 'generate_random_code', lambda: next(drawn))
+
+    with db_session.count_queries() as counter:
+        codes = generate_unique_codes(db_sess, 2)
+
+    assert sorted(codes) == ['fresh-0001', 'fresh-0002']
+    assert counter.count == 2  # second round checks only the regenerated code
+
+
+def test_import_5k_rows(client, add_school):
+    """5k students import: query count does not grow with rows, one code query per insert batch"""
+    add_school(students=0, absents=0)
+    students = [{'name': f'Name{i}', 'surname': 'Surname', 'patronymic': '', 'class_name': 'school-0'}
+                for i in range(5000)]
+
+    start = time.perf_counter()
+    response = client.put('/v1/school/students', json={'school_name': 'school', 'students': students})
+    elapsed = time.perf_counter() - start
+
+    assert response.status_code == 201
+    # school lookup, code check and insert for each of 10 batches of 500 rows
+    assert client.app.state.last_query_count == 1 + 2 * 10
+    # loose bound so slow CI machines pass, batched import takes under a second
+    assert elapsed < 15
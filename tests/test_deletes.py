@@ -0,0 +1,30 @@
+from data.student import Student
+from data.teacher import Teacher
+
+
+def add_classless(db_sess):
+    db_sess.add(Teacher(name='T', surname='T', patronymic='', code='t-none', school_name='school'))
+    db_sess.add(Student(name='S', surname='S', patronymic='', code='s-none', school_name='school'))
+    db_sess.commit()
+
+
+def test_teacher_without_class_keeps_students_without_class(client, db_sess, add_school):
+    add_school()
+    add_classless(db_sess)
+
+    response = client.delete('/v1/teacher', params={'code': 't-none', 'students': True, 'absents': True})
+
+    assert response.status_code == 200
+    assert response.json()['students'] == 0
+    assert sorted(code for code, in db_sess.query(Student.code)) == ['s-none', 's-school-0-0']
+    assert db_sess.query(Teacher.code).scalar() == 't-school-0'
+
+
+def test_student_delete_response(client, db_sess, add_school):
+    add_school()
+
+    response = client.delete('/v1/student', params={'code': 's-school-0-0'})
+
+    assert response.status_code == 200
+    assert response.json() == 'Student deleted'
+    assert db_sess.query(Student).count() == 0
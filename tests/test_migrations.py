@@ -0,0 +1,79 @@
+import base64
+import os
+
+import pytest
+import sqlalchemy as sa
+
+from tools import migrations
+from tools.blob_store import LocalBlobStore
+
+
+@pytest.fixture
+def connection(tmp_path):
+    """absents table of old schema: file column and no unique (student_id, date)"""
+    engine = sa.create_engine(f'sqlite:///{tmp_path / "old.db"}')
+    with engine.begin() as connection:
+        connection.execute(sa.text(
+            'CREATE TABLE absents (id INTEGER PRIMARY KEY, date DATE, reason VARCHAR, file BLOB, '
+            'file_key VARCHAR, file_size INTEGER, student_id INTEGER)'
+        ))
+        yield connection
+    engine.dispose()
+
+
+@pytest.fixture
+def store(tmp_path):
+    return LocalBlobStore(str(tmp_path / 'blobs'))
+
+
+def add_absent(connection, absent_id: int, student_id: int = 1, date: str = '2022-02-01', file: bytes = None,
+               reason: str = 'ill'):
+    connection.execute(sa.text('INSERT INTO absents (id, date, reason, file, student_id) '
+                               'VALUES (:id, :date, :reason, :file, :student_id)'),
+                       {'id': absent_id, 'date': date, 'reason': reason, 'file': file, 'student_id': student_id})
+
+
+def files(connection) -> list:
+    return connection.execute(sa.text('SELECT id, file IS NOT NULL, file_key, file_size FROM absents ORDER BY id')).all()
+
+
+def test_files_are_copied_and_cleared_after_check(connection, store):
+    add_absent(connection, 1, file=base64.b64encode(base64.b64encode(b'proof')))
+    add_absent(connection, 2, date='2022-02-02', file=base64.b64encode(b'other'))
+    add_absent(connection, 3, date='2022-02-03')
+
+    assert migrations.move_files(connection, store) == (2, 0)
+    key, _ = store.put(b'proof')
+    # files are kept until blobs are checked again
+    assert files(connection)[0] == (1, 1, key, 5)
+    assert [row[1] for row in files(connection)] == [1, 1, 0]
+
+    assert migrations.drop_moved_files(connection, store) == (2, 0)
+    assert [row[1] for row in files(connection)] == [0, 0, 0]
+    with store.open(key) as file:
+        assert file.read() == b'proof'
+
+
+def test_file_is_kept_if_blob_is_lost(connection, store):
+    add_absent(connection, 1, file=base64.b64encode(b'proof'))
+    migrations.move_files(connection, store)
+    key, _ = store.put(b'proof')
+    os.remove(store._path(key))
+
+    assert migrations.drop_moved_files(connection, store) == (0, 1)
+    assert files(connection)[0][1] == 1
+
+
+def test_dedupe_keeps_proof_then_newest(connection):
+    add_absent(connection, 1, file=b'proof', reason='first')
+    add_absent(connection, 2, reason='second')
+    add_absent(connection, 3, date='2022-02-02', reason='old')
+    add_absent(connection, 4, date='2022-02-02', reason='new')
+    add_absent(connection, 5, student_id=2)
+
+    assert [row.id for row in migrations.dedupe_absents(connection, dry_run=True)] == [2, 3]
+    assert connection.execute(sa.text('SELECT count(*) FROM absents')).scalar() == 5
+
+    assert [row.id for row in migrations.dedupe_absents(connection)] == [2, 3]
+    assert connection.execute(sa.text('SELECT id FROM absents ORDER BY id')).scalars().all() == [1, 4, 5]
+    assert migrations.dedupe_absents(connection) == []
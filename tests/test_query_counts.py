@@ -0,0 +1,37 @@
+"""Query count of routes must not depend on data size, a route that falls back into N+1 fails here"""
+import pytest
+
+
+SIZES = [(1, 1, 1), (3, 15, 4)]
+
+
+@pytest.mark.parametrize('classes, students, absents', SIZES)
+def test_teacher_students_absents(client, add_school, classes, students, absents):
+    add_school(classes=classes, students=students, absents=absents)
+
+    response = client.get('/v1/teacher/absents', params={'code': 't-school-0'})
+
+    assert response.status_code == 200
+    assert len(response.json()['absents']) == students * absents
+    assert client.app.state.last_query_count == 1
+
+
+def test_teacher_students_absents_not_found(client, add_school):
+    add_school()
+
+    response = client.get('/v1/teacher/absents', params={'code': 'missing'})
+
+    assert response.status_code == 404
+    assert client.app.state.last_query_count == 2  # empty join and teacher check
+
+
+@pytest.mark.parametrize('classes, students, absents', SIZES)
+@pytest.mark.parametrize('code, kind', [('t-school-0', 'teacher'), ('s-school-0-0', 'student')])
+def test_find_by_code(client, add_school, classes, students, absents, code, kind):
+    add_school(classes=classes, students=students, absents=absents)
+
+    response = client.get('/v1/school/find_by_code', params={'code': code})
+
+    assert response.status_code == 200
+    assert response.json()['type'] == kind
+    assert client.app.state.last_query_count == 1
@@ -0,0 +1,144 @@
+import types
+
+import pytest
+from gspread.exceptions import APIError
+
+from google_spreadsheets import rate_limiter
+from google_spreadsheets.backends import FakeSheetsBackend
+from google_spreadsheets.rate_limiter import RateLimitedBackend, SheetsRateLimiter, TokenBucket, backoff_delay, \
+    PRIORITY_HIGH, PRIORITY_LOW
+
+LINK = 'https://docs.google.com/spreadsheets/d/test/edit'
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(rate_limiter, 'time', types.SimpleNamespace(monotonic=clock.monotonic, sleep=clock.sleep))
+    # backoff takes its upper bound instead of random jitter
+    monkeypatch.setattr(rate_limiter.random, 'uniform', lambda low, high: high)
+    return clock
+
+
+def test_bucket_refills_by_rate_up_to_capacity(clock):
+    bucket = TokenBucket(60)
+    for _ in range(60):
+        assert bucket.wait_time(clock.now) == 0
+        bucket.take()
+
+    assert bucket.wait_time(clock.now) == pytest.approx(1.0)
+    assert bucket.wait_time(clock.now + 0.25) == pytest.approx(0.75)
+    assert bucket.wait_time(clock.now + 1) == 0
+
+    bucket.wait_time(clock.now + 3600)
+    assert bucket.tokens == 60
+
+
+def test_limiter_waits_for_token_and_times_out(clock, monkeypatch):
+    limiter = SheetsRateLimiter(60, 0, 2)
+    monkeypatch.setattr(limiter._cond, 'wait', clock.sleep)
+    limiter._account.tokens = 0
+    limiter.acquire('test')
+    assert clock.sleeps == [1]  # token of 60 a minute comes in a second
+
+    limiter._account.tokens = -2
+
+    with pytest.raises(rate_limiter.SheetsThrottledError):
+        limiter.acquire('test')
+    assert limiter.stats()['timeouts'] == 1
+    assert limiter.stats()['calls'] == 1
+
+
+def test_higher_priority_goes_first(clock):
+    limiter = SheetsRateLimiter(60, 0, 10)
+    limiter._account.tokens = 0
+    low = limiter._entry('test', PRIORITY_LOW)
+    high = limiter._entry('test', PRIORITY_HIGH)
+    limiter._waiting.extend([low, high])
+
+    clock.now += 1  # one token for two waiting calls
+    assert limiter._try_take(low, clock.now) > 0
+    assert limiter._try_take(high, clock.now) == 0
+    limiter._waiting.remove(high)
+
+    assert limiter._try_take(low, clock.now) > 0  # token was taken by high
+    clock.now += 1
+    assert limiter._try_take(low, clock.now) == 0
+
+
+def test_spreadsheet_without_quota_is_not_blocked_by_other_spreadsheet(clock):
+    limiter = SheetsRateLimiter(0, 60, 10)
+    limiter._spreadsheet_bucket('busy').tokens = 0
+    busy = limiter._entry('busy', PRIORITY_HIGH)
+    free = limiter._entry('free', PRIORITY_LOW)
+    limiter._waiting.extend([busy, free])
+
+    assert limiter._try_take(busy, clock.now) > 0
+    assert limiter._try_take(free, clock.now) == 0
+
+
+def test_backoff_is_exponential_up_to_max(clock):
+    assert [backoff_delay(attempt, 1, 5) for attempt in range(5)] == [1, 2, 4, 5, 5]
+
+
+def failing_backend(monkeypatch, method: str, codes: list) -> FakeSheetsBackend:
+    """Fake backend whose worksheet method fails with given statuses and then succeeds"""
+    backend = FakeSheetsBackend()
+    worksheet = backend.open_by_url(LINK).get_worksheet(0)
+    original = getattr(worksheet, method)
+    errors = iter(codes)
+
+    def call(*args, **kwargs):
+        code = next(errors, None)
+        if code is not None:
+            raise FakeSheetsBackend.error(code, 'test', 'TEST')
+        return original(*args, **kwargs)
+
+    call.__name__ = method
+    monkeypatch.setattr(worksheet, method, call)
+    return backend
+
+
+def limited_worksheet(backend):
+    return RateLimitedBackend(backend, SheetsRateLimiter(0, 0, 1), 4, 1, 3).open_by_url(LINK).get_worksheet(0)
+
+
+def test_call_is_retried_with_backoff(clock, monkeypatch):
+    backend = failing_backend(monkeypatch, 'update', [503, 429, 500, 502])
+
+    limited_worksheet(backend).update('A1', [['x']])
+
+    assert clock.sleeps == [1, 2, 3, 3]
+
+
+@pytest.mark.parametrize('code', [500, 503])
+def test_append_is_not_retried_on_server_error(clock, monkeypatch, code):
+    backend = failing_backend(monkeypatch, 'append_rows', [code])
+    worksheet = limited_worksheet(backend)
+
+    with pytest.raises(APIError):
+        worksheet.append_rows([['x']])
+    assert clock.sleeps == []
+
+
+def test_append_is_retried_on_quota_error(clock, monkeypatch):
+    backend = failing_backend(monkeypatch, 'append_rows', [429, 429])
+    worksheet = limited_worksheet(backend)
+
+    worksheet.append_rows([['x']])
+
+    assert clock.sleeps == [1, 2]
+    assert worksheet.rows[-1] == ['x']
@@ -0,0 +1,17 @@
+from google_spreadsheets.backends import FakeSheetsBackend
+from google_spreadsheets.google_spread_sheets import GoogleSpreadSheetsApi
+
+LINK = 'https://docs.google.com/spreadsheets/d/roster/edit'
+
+
+def test_rows_after_blank_chunk_are_read():
+    backend = FakeSheetsBackend()
+    worksheet = backend.create_spreadsheet('roster').worksheets()[0]
+    worksheet.rows = [['Фамилия', 'Имя', 'Отчество', 'Класс', 'Код'],
+                      ['A', 'B', 'C', '1-А', 'code-1'],
+                      [''] * 5, [''] * 5, [''] * 5,
+                      ['D', 'E', 'F', '1-А', 'code-2']]
+
+    rows = list(GoogleSpreadSheetsApi(backend).google_sheets_iter_roster_rows(LINK, 0, chunk_rows=2))
+
+    assert [(row, line[4]) for row, line in rows] == [(2, 'code-1'), (6, 'code-2')]
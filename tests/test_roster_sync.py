@@ -0,0 +1,122 @@
+import pytest
+
+from data.sheets_outbox import SheetsOutbox
+from data.student import Student
+from data.teacher import Teacher
+from google_spreadsheets.backends import FakeSheetsBackend
+from google_spreadsheets.google_spread_sheets import GoogleSpreadSheetsApi, TEACHERS_SHEET, STUDENTS_SHEET
+from google_spreadsheets.outbox_worker import OutboxWorker
+from routers.school import school_router
+
+HEADER = ['Класс', 'Фамилия', 'Имя', 'Отчество', 'Код']
+
+
+@pytest.fixture
+def sheets(monkeypatch):
+    sheets = GoogleSpreadSheetsApi(FakeSheetsBackend())
+    monkeypatch.setattr(school_router, 'google_spread_sheets', sheets)
+    return sheets
+
+
+@pytest.fixture
+def sync(client, db_sess, sheets):
+    """Sync roster of school and write queued codes into worksheet, returns counts and number of codes rows"""
+    worker = OutboxWorker(sheets, 1, 10, 3, 1, 10, 1)
+
+    def run(kind: str = 'teachers') -> tuple:
+        response = client.post(f'/v1/school/{kind}/sync', params={'school_name': 'school'})
+        assert response.status_code == 200
+        items = db_sess.query(SheetsOutbox).filter(SheetsOutbox.kind == 'codes').all()
+        for item in items:
+            worker.handlers[item.kind](db_sess, item)
+            db_sess.delete(item)
+        db_sess.commit()
+        db_sess.expire_all()
+        return response.json(), len(items)
+
+    return run
+
+
+def roster(sheets, link: str, position: int, rows: list):
+    worksheet = sheets.gc.open_by_url(link).worksheets()[position]
+    worksheet.rows = [HEADER] + rows
+    return worksheet
+
+
+def teacher_codes(db_sess) -> dict:
+    return {teacher.surname: teacher.code for teacher in db_sess.query(Teacher)}
+
+
+def counts(inserted: int = 0, updated: int = 0, deleted: int = 0) -> dict:
+    return {'inserted': inserted, 'updated': updated, 'deleted': deleted}
+
+
+def test_new_rows_are_inserted_and_get_codes(db_sess, add_school, sheets, sync):
+    school = add_school(classes=0)
+    worksheet = roster(sheets, school.link, TEACHERS_SHEET, [['1-А', 'A', 'A', '', ''], ['1-Б', 'B', 'B', '', '']])
+
+    assert sync() == (counts(inserted=2), 1)
+
+    teachers = teacher_codes(db_sess)
+    assert [line[4] for line in worksheet.rows[1:]] == [teachers['A'], teachers['B']]
+
+
+def test_rerun_without_changes_changes_nothing(db_sess, add_school, sheets, sync):
+    school = add_school(classes=0)
+    roster(sheets, school.link, TEACHERS_SHEET, [['1-А', 'A', 'A', '', ''], ['1-Б', 'B', 'B', '', '']])
+    sync()
+    teachers = teacher_codes(db_sess)
+
+    assert sync() == (counts(), 0)
+    assert teacher_codes(db_sess) == teachers
+
+
+def test_renamed_row_keeps_code(db_sess, add_school, sheets, sync):
+    school = add_school(classes=0)
+    worksheet = roster(sheets, school.link, TEACHERS_SHEET, [['1-А', 'A', 'A', '', '']])
+    sync()
+    code = worksheet.rows[1][4]
+
+    worksheet.rows[1][1] = 'Renamed'
+
+    assert sync() == (counts(updated=1), 0)
+    assert teacher_codes(db_sess) == {'Renamed': code}
+
+
+def test_moved_teacher_takes_students_to_new_class(db_sess, add_school, sheets, sync):
+    school = add_school(classes=1, students=2)
+    roster(sheets, school.link, TEACHERS_SHEET, [['school-1', 'school-0', 'Teacher', '', 't-school-0']])
+
+    assert sync() == (counts(updated=1), 0)
+    assert db_sess.query(Teacher.class_name).scalar() == 'school-1'
+    assert sorted(class_name for class_name, in db_sess.query(Student.class_name)) == ['school-1', 'school-1']
+
+
+def test_removed_row_is_deleted(db_sess, add_school, sheets, sync):
+    school = add_school(classes=0)
+    worksheet = roster(sheets, school.link, TEACHERS_SHEET, [['1-А', 'A', 'A', '', ''], ['1-Б', 'B', 'B', '', '']])
+    sync()
+    code = worksheet.rows[2][4]
+
+    del worksheet.rows[1]
+
+    assert sync() == (counts(updated=1, deleted=1), 0)  # B moved from row 3 to row 2
+    assert teacher_codes(db_sess) == {'B': code}
+
+
+def test_body_imported_records_keep_codes(db_sess, add_school, sheets, sync):
+    school = add_school(classes=2, students=1)
+    # records of add_school have no sheet row and no fingerprint, worksheet does not hold their codes
+    teachers = roster(sheets, school.link, TEACHERS_SHEET, [['school-0', ' school-0 ', 'Teacher', '', ''],
+                                                           ['school-1', 'school-1', 'Teacher', '', '']])
+    students = roster(sheets, school.link, STUDENTS_SHEET, [['school-0', 'school-0', 'Student0', '', ''],
+                                                           ['school-1', 'school-1', 'Student0', '', '']])
+
+    assert sync() == (counts(updated=2), 1)
+    assert sync('students') == (counts(updated=2), 1)
+
+    assert [line[4] for line in teachers.rows[1:]] == ['t-school-0', 't-school-1']
+    assert [line[4] for line in students.rows[1:]] == ['s-school-0-0', 's-school-1-0']
+    assert db_sess.query(Student).count() == 2
+    assert sync() == (counts(), 0)
+    assert sync('students') == (counts(), 0)
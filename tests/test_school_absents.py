@@ -0,0 +1,28 @@
+import pytest
+
+
+@pytest.mark.parametrize('classes, students, absents', [(1, 1, 1), (3, 20, 5)])
+def test_query_count_does_not_grow_with_school(client, add_school, classes, students, absents):
+    add_school(classes=classes, students=students, absents=absents)
+
+    response = client.get('/v1/school/absents', params={'school_name': 'school', 'limit': 1000})
+
+    assert response.status_code == 200
+    assert len(response.json()['absents']) == classes * students * absents
+    # school check and one joined select of the page
+    assert client.app.state.last_query_count == 2
+
+
+def test_pages_and_filters(client, add_school):
+    add_school(classes=2, students=3, absents=4)
+    params = {'school_name': 'school', 'class_name': 'school-1', 'from': '2022-02-02', 'to': '2022-02-03', 'limit': 4}
+
+    first = client.get('/v1/school/absents', params=params).json()
+    second = client.get('/v1/school/absents', params={**params, 'cursor': first['next_cursor']}).json()
+
+    assert client.app.state.last_query_count == 2
+    absents = first['absents'] + second['absents']
+    assert len(absents) == 3 * 2
+    assert second.get('next_cursor') is None
+    assert all(item['code'].startswith('s-school-1-') for item in absents)
+    assert [item['date'] for item in absents] == ['2022-02-02'] * 3 + ['2022-02-03'] * 3
@@ -0,0 +1,84 @@
+import pytest
+
+from data.sheets_outbox import SheetsOutbox
+from data.teacher import Teacher
+from google_spreadsheets.backends import FakeSheetsBackend
+from google_spreadsheets.google_spread_sheets import GoogleSpreadSheetsApi, TEACHERS_SHEET
+from google_spreadsheets.outbox_worker import OutboxWorker
+from routers.school import school_router
+
+HEADER = ['Класс', 'Фамилия', 'Имя', 'Отчество', 'Код']
+
+
+@pytest.fixture
+def sheets(monkeypatch):
+    sheets = GoogleSpreadSheetsApi(FakeSheetsBackend())
+    monkeypatch.setattr(school_router, 'google_spread_sheets', sheets)
+    return sheets
+
+
+@pytest.fixture
+def worker(sheets):
+    return OutboxWorker(sheets, 1, 10, 3, 1, 10, 1)
+
+
+def teachers_worksheet(sheets, link: str, rows: list):
+    worksheet = sheets.gc.open_by_url(link).worksheets()[TEACHERS_SHEET]
+    worksheet.rows = [HEADER] + rows
+    return worksheet
+
+
+def test_sync_queues_codes_in_its_transaction(client, db_sess, add_school, sheets, worker):
+    school = add_school(classes=0)
+    worksheet = teachers_worksheet(sheets, school.link, [['1-А', 'Иванов', 'Иван', 'Иванович', '']])
+
+    response = client.post('/v1/school/teachers/sync', params={'school_name': 'school'})
+
+    assert response.status_code == 200
+    assert worksheet.rows[1][4] == ''  # nothing is written in request
+    item = db_sess.query(SheetsOutbox).filter(SheetsOutbox.kind == 'codes').one()
+    worker.handlers[item.kind](db_sess, item)
+    assert worksheet.rows[1][4] == db_sess.query(Teacher.code).scalar()
+
+
+def test_school_codes_find_moved_and_unknown_rows(client, db_sess, add_school, sheets, worker):
+    school = add_school(classes=3, students=0)
+    db_sess.query(Teacher).filter(Teacher.code == 't-school-0').update({Teacher.sheet_row: 2})
+    db_sess.query(Teacher).filter(Teacher.code == 't-school-1').update({Teacher.sheet_row: 3})
+    db_sess.commit()
+    # t-school-0 was moved from row 2 to row 4 by hand, t-school-2 has no row number
+    worksheet = teachers_worksheet(sheets, school.link, [['', '', '', '', 'other'],
+                                                         ['school-1', 'T', 'T', '', 't-school-1'],
+                                                         ['school-0', 'T', 'T', '', 't-school-0'],
+                                                         ['school-2', 'T', 'T', '', 't-school-2']])
+
+    response = client.post('/v1/school/codes', params={'school_name': 'school', 'teachers': True, 'students': False})
+
+    assert response.status_code == 200
+    item = db_sess.query(SheetsOutbox).filter(SheetsOutbox.kind == 'codes').one()
+    worker.handlers[item.kind](db_sess, item)
+    db_sess.expire_all()
+    codes = {teacher.class_name: teacher.code for teacher in db_sess.query(Teacher)}
+    assert [line[4] for line in worksheet.rows[1:]] == ['other', codes['school-1'], codes['school-0'],
+                                                        codes['school-2']]
+
+
+def test_code_generate_checks_row_before_writing(add_school, sheets):
+    school = add_school(classes=0)
+    worksheet = teachers_worksheet(sheets, school.link, [['1-А', 'A', 'A', '', 'first'],
+                                                         ['1-Б', 'B', 'B', '', 'second']])
+
+    sheets.google_sheets_teacher_code_generate(school.link, 'second', 'new', row=2)
+
+    assert [line[4] for line in worksheet.rows[1:]] == ['first', 'new']
+
+
+def test_code_of_removed_row_is_not_written(add_school, sheets, worker):
+    school = add_school(classes=0)
+    worksheet = teachers_worksheet(sheets, school.link, [['1-А', 'A', 'A', '', 'first']])
+    item = SheetsOutbox(kind='code', link=school.link,
+                        payload={'position': TEACHERS_SHEET, 'row': 2, 'old_code': 'removed', 'code': 'new'})
+
+    worker.handlers[item.kind](None, item)
+
+    assert [line[4] for line in worksheet.rows[1:]] == ['first']
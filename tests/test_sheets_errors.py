@@ -0,0 +1,76 @@
+import pytest
+from gspread.exceptions import APIError
+
+from data.school import School
+from data.sheets_outbox import SheetsOutbox
+from data.teacher import Teacher
+from google_spreadsheets.backends import FakeSheetsBackend
+from google_spreadsheets.google_spread_sheets import GoogleSpreadSheetsApi
+from google_spreadsheets.rate_limiter import RateLimitedBackend, SheetsRateLimiter, sheets_request_limits
+from routers.school import school_router
+from tools.error_book import SheetsThrottledError, SheetsUnavailableError
+
+LINK = 'https://docs.google.com/spreadsheets/d/test/edit'
+
+
+@pytest.fixture
+def failing_sheets(monkeypatch):
+    """Sheets client which open_by_url fails with given error"""
+    def create(error: Exception):
+        backend = FakeSheetsBackend()
+
+        def open_by_url(link: str):
+            raise error
+
+        monkeypatch.setattr(backend, 'open_by_url', open_by_url)
+        monkeypatch.setattr(school_router, 'google_spread_sheets', GoogleSpreadSheetsApi(backend))
+
+    return create
+
+
+@pytest.mark.parametrize('code, status', [(429, 'RESOURCE_EXHAUSTED'), (503, 'UNAVAILABLE')])
+def test_outage_keeps_school_and_queues_link_check(client, db_sess, failing_sheets, code, status):
+    failing_sheets(FakeSheetsBackend.error(code, 'Sheets is down', status))
+
+    response = client.put('/v1/school', json={'school_name': 'school', 'link': LINK})
+
+    assert response.status_code == 201
+    assert db_sess.query(School).one().link_checked is False
+    assert db_sess.query(SheetsOutbox.kind).scalar() == 'link_check'
+
+
+@pytest.mark.parametrize('code, status', [(403, 'PERMISSION_DENIED'), (404, 'NOT_FOUND')])
+def test_bad_link_is_rejected(client, db_sess, failing_sheets, code, status):
+    failing_sheets(FakeSheetsBackend.error(code, 'Requested entity was not found', status))
+
+    response = client.put('/v1/school', json={'school_name': 'school', 'link': LINK})
+
+    assert response.status_code == 400
+    assert db_sess.query(School).count() == 0
+    assert db_sess.query(SheetsOutbox).count() == 0
+
+
+@pytest.mark.parametrize('error, retry_after', [(SheetsThrottledError('test', 5), '60'),
+                                                (SheetsUnavailableError(12.3), '13')])
+def test_roster_read_outage_is_service_unavailable(client, db_sess, add_school, failing_sheets, error, retry_after):
+    add_school(classes=1, students=0)
+    failing_sheets(error)
+
+    response = client.post('/v1/school/teachers/sync', params={'school_name': 'school'})
+
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == retry_after
+    assert db_sess.query(Teacher).count() == 1
+
+
+def test_request_calls_retry_less_than_worker():
+    backend = FakeSheetsBackend(error_rate=1.0)
+    sheets = RateLimitedBackend(backend, SheetsRateLimiter(0, 0, 1), 3, 0, 0)
+
+    with sheets_request_limits(0, 1), pytest.raises(APIError):
+        sheets.open_by_url(LINK)
+    assert backend.calls == 1
+
+    with pytest.raises(APIError):
+        sheets.open_by_url(LINK)
+    assert backend.calls == 1 + 4
@@ -0,0 +1,138 @@
+import abc
+import hashlib
+import os
+import re
+import tempfile
+
+from tools.error_book import BlobNotFoundError
+from tools.settings import BLOB_STORE_BACKEND, BLOB_STORE_PATH
+
+
+class BlobStore(abc.ABC):
+    """
+        Storage of absent proof files keyed by sha256 of content, equal files are stored once
+
+        put returns (key, size), absents row keeps only them
+    """
+    chunk_size = 64 * 1024
+
+    @abc.abstractmethod
+    def put(self, data: bytes) -> tuple:
+        pass
+
+    @abc.abstractmethod
+    def put_stream(self, file) -> tuple:
+        """Store content of binary file object read by chunk_size, returns (key, size)"""
+        pass
+
+    @abc.abstractmethod
+    def size(self, key: str) -> int:
+        pass
+
+    @abc.abstractmethod
+    def delete(self, key: str):
+        """Remove blob, missing blob is ignored, caller checks that no absent keeps its key"""
+        pass
+
+    @abc.abstractmethod
+    def open(self, key: str):
+        """Binary file object for reading blob, raise BlobNotFoundError if blob does not exist"""
+        pass
+
+    def iter_chunks(self, file, start: int = 0, length: int = None):
+        """
+            Generator of bytes of blob file returned by open from start, length bytes or up to the end, closes file
+
+            Blob is opened by caller before response starts, so missing blob is reported before any byte is sent
+        """
+        with file:
+            file.seek(start)
+            left = length
+            while left is None or left > 0:
+                chunk = file.read(self.chunk_size if left is None else min(self.chunk_size, left))
+                if not chunk:
+                    break
+                if left is not None:
+                    left -= len(chunk)
+                yield chunk
+
+
+class LocalBlobStore(BlobStore):
+    """Blobs in local directory: root/ab/cd/abcd..."""
+    key_pattern = re.compile(r'^[0-9a-f]{64}$')
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def _path(self, key: str) -> str:
+        if not self.key_pattern.match(key):
+            raise BlobNotFoundError(key)
+        return os.path.join(self.root, key[:2], key[2:4], key)
+
+    def put(self, data: bytes) -> tuple:
+        key = hashlib.sha256(data).hexdigest()
+        path = self._path(key)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+            with os.fdopen(fd, 'wb') as file:
+                file.write(data)
+            os.replace(tmp_path, path)
+        return key, len(data)
+
+    def put_stream(self, file) -> tuple:
+        # key is known only after the last chunk, so content goes to temp file and is renamed
+        os.makedirs(self.root, exist_ok=True)
+        digest = hashlib.sha256()
+        size = 0
+        fd, tmp_path = tempfile.mkstemp(dir=self.root)
+        try:
+            with os.fdopen(fd, 'wb') as tmp_file:
+                while True:
+                    chunk = file.read(self.chunk_size)
+                    if not chunk:
+                        break
+                    digest.update(chunk)
+                    size += len(chunk)
+                    tmp_file.write(chunk)
+
+            key = digest.hexdigest()
+            path = self._path(key)
+            if os.path.exists(path):
+                os.remove(tmp_path)
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return key, size
+
+    def size(self, key: str) -> int:
+        try:
+            return os.path.getsize(self._path(key))
+        except FileNotFoundError:
+            raise BlobNotFoundError(key)
+
+    def delete(self, key: str):
+        try:
+            os.remove(self._path(key))
+        except (FileNotFoundError, BlobNotFoundError):
+            pass
+
+    def open(self, key: str):
+        try:
+            return open(self._path(key), 'rb')
+        except FileNotFoundError:
+            raise BlobNotFoundError(key)
+
+
+def create_blob_store() -> BlobStore:
+    """Blob store selected by BLOB_STORE_BACKEND setting"""
+    if BLOB_STORE_BACKEND == 'local':
+        return LocalBlobStore(BLOB_STORE_PATH)
+    raise ValueError(f'Unknown blob store backend {BLOB_STORE_BACKEND}')
+
+
+blob_store = create_blob_store()
@@ -0,0 +1,58 @@
+import threading
+
+from concurrent.futures import Future, ThreadPoolExecutor
+from tools.error_book import ExecutorOverloadError
+
+
+class BoundedExecutor:
+    """
+        Thread pool with a limited queue, new work is rejected instead of queued when it is full
+
+        max_workers: int - number of worker threads
+        max_pending: int - number of tasks allowed to wait for a free worker
+        name: str - executor name, used for thread names and errors
+    """
+    def __init__(self, max_workers: int, max_pending: int, name: str):
+        self.name = name
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        self._slots = threading.BoundedSemaphore(max_workers + max_pending)
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self.submitted = 0
+        self.rejected = 0
+
+    def submit(self, fn, *args, **kwargs) -> Future:
+        """Submit task or raise ExecutorOverloadError if all workers and queue slots are taken"""
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+            raise ExecutorOverloadError(self.name)
+
+        with self._lock:
+            self._in_flight += 1
+            self.submitted += 1
+
+        try:
+            future = self._executor.submit(fn, *args, **kwargs)
+        except BaseException:
+            self._release()
+            raise
+        future.add_done_callback(lambda _: self._release())
+        return future
+
+    def _release(self):
+        with self._lock:
+            self._in_flight -= 1
+        self._slots.release()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'workers': self.max_workers,
+                'queue_limit': self.max_pending,
+                'in_flight': self._in_flight,
+                'submitted': self.submitted,
+                'rejected': self.rejected,
+            }
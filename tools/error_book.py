@@ -188,4 +188,74 @@ class TableLinkError(Exception):
         self.link = link
 
     def __str__(self):
-        return f'Wrong table link {self.link}'
\ No newline at end of file
+        return f'Wrong table link {self.link}'
+
+
+class ExecutorOverloadError(Exception):
+    """Exception raised when executor queue is full and new task is rejected"""
+    def __init__(self, executor_name: str):
+        self.executor_name = executor_name
+
+    def __str__(self):
+        return f'Executor {self.executor_name} is overloaded, try again later'
+
+
+class BlobNotFoundError(Exception):
+    """Exception raised when file with given key not found in blob store"""
+    def __init__(self, key: str):
+        self.key = key
+
+    def __str__(self):
+        return f'File {self.key} not found'
+
+
+class AbsentNotFoundError(Exception):
+    """Exception raised when student absent in given date not found"""
+    def __init__(self, date: datetime.date, student_code: str = None, student_tg_user_id: int = None):
+        self.date = date
+        self.student_code = student_code
+        self.student_tg_user_id = student_tg_user_id
+
+    def __str__(self):
+        if not (self.student_code is None):
+            return f'Absent of student with code: {self.student_code} in {self.date.isoformat()} not found'
+        return f'Absent of student with tg_id: {self.student_tg_user_id} in {self.date.isoformat()} not found'
+
+
+class RangeNotSatisfiableError(Exception):
+    """Exception raised when requested byte range is outside of file"""
+    def __init__(self, range_header: str, size: int):
+        self.range_header = range_header
+        self.size = size
+
+    def __str__(self):
+        return f'Range {self.range_header} not satisfiable for file of {self.size} bytes'
+
+
+class AbsentDuplicatesError(Exception):
+    """Exception raised on start when absents have duplicates of one student and date left by old code"""
+    def __init__(self, count: int):
+        self.count = count
+
+    def __str__(self):
+        return f'{self.count} students have several absents of one date, ' \
+               f'review and remove them with python -m tools.migrations dedupe_absents'
+
+
+class SheetsThrottledError(Exception):
+    """Exception raised when Google Sheets API call waits for quota longer than allowed"""
+    def __init__(self, spreadsheet_id: str, timeout: float):
+        self.spreadsheet_id = spreadsheet_id
+        self.timeout = timeout
+
+    def __str__(self):
+        return f'Google Sheets quota of {self.spreadsheet_id} is exhausted for {self.timeout} seconds, try again later'
+
+
+class SheetsUnavailableError(Exception):
+    """Exception raised when Google Sheets calls are stopped by open circuit breaker"""
+    def __init__(self, retry_after: float):
+        self.retry_after = retry_after
+
+    def __str__(self):
+        return f'Google Sheets is unavailable, next try in {round(self.retry_after, 1)} seconds'
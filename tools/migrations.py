@@ -0,0 +1,180 @@
+"""
+    One-off data migrations, they are run by hand from project root, not on app start:
+
+        python -m tools.migrations dedupe_absents --dry-run
+        python -m tools.migrations dedupe_absents
+        python -m tools.migrations move_files
+        python -m tools.migrations drop_moved_files
+
+    dedupe_absents must run before first start after uq_absents_student_id_date was added, app refuses to start
+    while absents have duplicates. absents.file column can be dropped by hand when drop_moved_files reports no
+    rows left.
+"""
+import argparse
+import base64
+import binascii
+import hashlib
+import logging
+
+import sqlalchemy as sa
+
+from tools.blob_store import BlobStore, blob_store
+from tools.error_book import BlobNotFoundError
+from tools.settings import DB_USER, DB_PASSWORD, DB_HOST, DB_NAME
+
+
+BATCH_SIZE = 100
+
+
+def _has_column(connection, table: str, column: str) -> bool:
+    return any(item['name'] == column for item in sa.inspect(connection).get_columns(table))
+
+
+def decode_proof(content: bytes) -> bytes:
+    """Old code kept base64 of json field that was base64 itself, patched absents kept json field as is"""
+    content = bytes(content)
+    for _ in range(2):
+        try:
+            content = base64.b64decode(content, validate=True)
+        except binascii.Error:
+            break
+    return content
+
+
+def blob_matches(store: BlobStore, key: str, size: int) -> bool:
+    """True if blob is read back from store and its sha256 and size are the ones it was stored with"""
+    digest = hashlib.sha256()
+    read = 0
+    try:
+        with store.open(key) as file:
+            while True:
+                chunk = file.read(store.chunk_size)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                read += len(chunk)
+    except BlobNotFoundError:
+        return False
+    return digest.hexdigest() == key and read == size
+
+
+def dedupe_absents(connection, dry_run: bool = False) -> list:
+    """
+        Function that delete duplicate absents of one student and date left by old code, return removed rows
+
+        Absent with proof is kept, then the newest one, every removed row is logged with its reason and file,
+        with dry_run rows are only logged
+    """
+    has_proof = 'file_key IS NOT NULL'
+    if _has_column(connection, 'absents', 'file'):
+        has_proof += ' OR file IS NOT NULL'
+
+    rows = connection.execute(sa.text(
+        f'SELECT id, student_id, date, reason, file_key, ({has_proof}) AS has_proof FROM absents a '
+        'WHERE EXISTS (SELECT 1 FROM absents b WHERE b.student_id = a.student_id AND b.date = a.date '
+        'AND b.id <> a.id) ORDER BY student_id, date, id'
+    )).all()
+
+    groups = {}
+    for row in rows:
+        groups.setdefault((row.student_id, row.date), []).append(row)
+
+    removed = []
+    for (student_id, date), group in groups.items():
+        kept = max(group, key=lambda item: (bool(item.has_proof), item.id))
+        for row in group:
+            if row.id == kept.id:
+                continue
+            logging.warning(f'Duplicate absent {row.id} of student {student_id} on {date} is removed, '
+                            f'absent {kept.id} is kept: reason {row.reason!r}, file {row.file_key}')
+            removed.append(row)
+
+    if removed and not dry_run:
+        delete = sa.text('DELETE FROM absents WHERE id IN :ids').bindparams(sa.bindparam('ids', expanding=True))
+        for start in range(0, len(removed), BATCH_SIZE):
+            connection.execute(delete, {'ids': [row.id for row in removed[start:start + BATCH_SIZE]]})
+    return removed
+
+
+def move_files(connection, store: BlobStore = blob_store) -> tuple:
+    """
+        Function that copy proofs of old absents.file column into blob store, return (copied, failed) counts
+
+        Copied blob is read back and checked by sha256 before file_key is set, absents.file is kept,
+        it is cleared by drop_moved_files
+    """
+    if not _has_column(connection, 'absents', 'file'):
+        return 0, 0
+
+    select_files = sa.text('SELECT id, file FROM absents WHERE file IS NOT NULL AND file_key IS NULL AND id > :last '
+                           'ORDER BY id LIMIT :limit')
+    update_key = sa.text('UPDATE absents SET file_key = :key, file_size = :size WHERE id = :id')
+    copied = failed = 0
+    last = 0
+    while True:
+        rows = connection.execute(select_files, {'last': last, 'limit': BATCH_SIZE}).all()
+        if not rows:
+            break
+        for row in rows:
+            key, size = store.put(decode_proof(row.file))
+            if blob_matches(store, key, size):
+                connection.execute(update_key, {'key': key, 'size': size, 'id': row.id})
+                copied += 1
+            else:
+                logging.error(f'Proof of absent {row.id} is not read back from blob store as {key}, file is kept')
+                failed += 1
+        last = rows[-1].id
+    return copied, failed
+
+
+def drop_moved_files(connection, store: BlobStore = blob_store) -> tuple:
+    """
+        Function that clear absents.file of rows whose blob is in store with content of that file,
+        return (cleared, kept) counts, rows with missing or different blob keep their file
+    """
+    if not _has_column(connection, 'absents', 'file'):
+        return 0, 0
+
+    select_files = sa.text('SELECT id, file, file_key, file_size FROM absents '
+                           'WHERE file IS NOT NULL AND file_key IS NOT NULL AND id > :last ORDER BY id LIMIT :limit')
+    clear_file = sa.text('UPDATE absents SET file = NULL WHERE id = :id')
+    cleared = kept = 0
+    last = 0
+    while True:
+        rows = connection.execute(select_files, {'last': last, 'limit': BATCH_SIZE}).all()
+        if not rows:
+            break
+        for row in rows:
+            content = decode_proof(row.file)
+            if hashlib.sha256(content).hexdigest() == row.file_key and len(content) == row.file_size \
+                    and blob_matches(store, row.file_key, row.file_size):
+                connection.execute(clear_file, {'id': row.id})
+                cleared += 1
+            else:
+                logging.error(f'Blob {row.file_key} of absent {row.id} is missing or differs from file, file is kept')
+                kept += 1
+        last = rows[-1].id
+    return cleared, kept
+
+
+def main():
+    parser = argparse.ArgumentParser(description='One-off data migrations')
+    parser.add_argument('migration', choices=['dedupe_absents', 'move_files', 'drop_moved_files'])
+    parser.add_argument('--dry-run', action='store_true', help='dedupe_absents only logs rows it would remove')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    # own engine without create_all, app start is refused while absents have duplicates
+    engine = sa.create_engine(f'postgresql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}/{DB_NAME}')
+    with engine.begin() as connection:
+        if args.migration == 'dedupe_absents':
+            removed = dedupe_absents(connection, args.dry_run)
+            logging.info(f'{len(removed)} duplicate absents {"would be" if args.dry_run else "are"} removed')
+        elif args.migration == 'move_files':
+            logging.info('%s proofs are copied to blob store, %s failed' % move_files(connection))
+        else:
+            logging.info('%s files are cleared, %s kept' % drop_moved_files(connection))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,151 @@
+import hashlib
+
+from sqlalchemy import delete, insert, select, update
+
+from data.student import Student
+from data.teacher import Teacher
+from .settings import ROSTER_INSERT_BATCH
+from .tools import generate_unique_codes, delete_students, chunked
+
+
+ROSTER_FIELDS = ('class_name', 'surname', 'name', 'patronymic')
+
+
+def row_fields(values: list) -> dict:
+    """Function that turn A..D values of roster row into record fields with normalized spaces"""
+    values = (list(values) + [''] * 4)[:4]
+    return {field: ' '.join(value.split()) for field, value in zip(ROSTER_FIELDS, values)}
+
+
+def row_fingerprint(fields: dict) -> str:
+    """Function that hash roster row fields, code column is not part of fingerprint"""
+    return hashlib.sha1('\x1f'.join(fields[field] for field in ROSTER_FIELDS).encode()).hexdigest()
+
+
+def sync_roster(db_sess, model, school_name: str, rows, absents: bool = False) -> tuple:
+    """
+        Function that sync teachers or students of school with roster worksheet rows, caller commits
+
+        Row is matched to existing record by code in E column, then by fingerprint of other columns.
+        Records imported from request body have no fingerprint and their codes are not in worksheet yet,
+        so their fingerprint is computed from their fields.
+        Matched records keep their codes and are updated only if fingerprint or row number changed,
+        rows without record are inserted with new codes, records without row are deleted.
+        Returns ({'inserted', 'updated', 'deleted'}, code_cells) where code_cells are (row number, code)
+        of E cells that do not hold the record code yet
+
+        db_sess: Session - database session
+        model: Teacher or Student
+        rows: iterable of (row number, [A..E] values)
+        absents: bool - delete absents of deleted students, otherwise they are detached
+    """
+    existing = db_sess.execute(
+        select(model.id, model.code, model.class_name, model.surname, model.name, model.patronymic,
+               model.sheet_row, model.sheet_fingerprint)
+        .where(model.school_name == school_name)
+    ).all()
+
+    by_code = {record.code: record for record in existing}
+    by_fingerprint = {}
+    for record in existing:
+        fingerprint = record.sheet_fingerprint
+        if fingerprint is None:
+            fingerprint = row_fingerprint(row_fields([getattr(record, field) or '' for field in ROSTER_FIELDS]))
+        by_fingerprint.setdefault(fingerprint, []).append(record)
+
+    matched = set()
+    inserts, updates, code_cells, class_moves = [], [], [], []
+    for row, values in rows:
+        fields = row_fields(values)
+        sheet_code = values[4].strip() if len(values) > 4 else ''
+        fingerprint = row_fingerprint(fields)
+
+        record = by_code.get(sheet_code) if sheet_code else None
+        if record is None or record.id in matched:
+            record = next((item for item in by_fingerprint.get(fingerprint, ()) if item.id not in matched), None)
+
+        if record is None:
+            inserts.append({**fields, 'school_name': school_name, 'sheet_row': row, 'sheet_fingerprint': fingerprint})
+            continue
+
+        matched.add(record.id)
+        if record.sheet_fingerprint != fingerprint:
+            updates.append({'id': record.id, **fields, 'sheet_row': row, 'sheet_fingerprint': fingerprint})
+            if model is Teacher and record.class_name != fields['class_name']:
+                class_moves.append((record.class_name, fields['class_name']))
+        elif record.sheet_row != row:
+            updates.append({'id': record.id, 'sheet_row': row})
+
+        if sheet_code != record.code:
+            code_cells.append((row, record.code))
+
+    removed = [record.id for record in existing if record.id not in matched]
+    deleted = 0
+    if removed and model is Student:
+        deleted, _ = delete_students(db_sess, Student.id.in_(removed), absents)
+    elif removed:
+        # students of deleted teachers lose their class as in teacher_delete
+        class_names = select(Teacher.class_name).where(Teacher.id.in_(removed))
+        db_sess.execute(update(Student).where(Student.class_name.in_(class_names)).values(class_name=None)
+                        .execution_options(synchronize_session=False))
+        deleted = db_sess.execute(delete(Teacher).where(Teacher.id.in_(removed))
+                                  .execution_options(synchronize_session=False)).rowcount
+
+    # teacher class rename: students.class_name references it, so students are detached and attached back
+    moved_students = []
+    for old_class, new_class in class_moves:
+        if old_class is None:
+            continue  # teacher had no class, class_name == None would move all students without class
+        student_ids = db_sess.execute(select(Student.id).where(Student.class_name == old_class)).scalars().all()
+        if student_ids:
+            db_sess.execute(update(Student).where(Student.id.in_(student_ids)).values(class_name=None)
+                            .execution_options(synchronize_session=False))
+            moved_students.append((student_ids, new_class))
+
+    if updates:
+        db_sess.bulk_update_mappings(model, updates)
+
+    for student_ids, new_class in moved_students:
+        db_sess.execute(update(Student).where(Student.id.in_(student_ids)).values(class_name=new_class)
+                        .execution_options(synchronize_session=False))
+
+    if inserts:
+        for item, code in zip(inserts, generate_unique_codes(db_sess, len(inserts))):
+            item['code'] = code
+            code_cells.append((item['sheet_row'], code))
+        db_sess.bulk_insert_mappings(model, inserts)
+
+    return {'inserted': len(inserts), 'updated': len(updates), 'deleted': deleted}, code_cells
+
+
+def import_roster(db_sess, model, school_name: str, rows, batch_size: int = ROSTER_INSERT_BATCH) -> tuple:
+    """
+        Function that insert teachers or students of roster rows with new codes by batches, caller commits
+
+        Rows are consumed lazily, so only one batch is in memory. Returns (number of inserted records, code_cells)
+        where code_cells are (row number, code) for rows that came from worksheet
+
+        db_sess: Session - database session
+        model: Teacher or Student
+        rows: iterable of (row number or None, [A..D] values)
+    """
+    count = 0
+    code_cells = []
+    for batch in chunked(rows, batch_size):
+        items = []
+        for (row, values), code in zip(batch, generate_unique_codes(db_sess, len(batch))):
+            fields = row_fields(values)
+            items.append({
+                **fields,
+                'school_name': school_name,
+                'code': code,
+                'sheet_row': row,
+                'sheet_fingerprint': None if row is None else row_fingerprint(fields)
+            })
+            if not (row is None):
+                code_cells.append((row, code))
+
+        db_sess.execute(insert(model), items)
+        count += len(items)
+
+    return count, code_cells
@@ -17,6 +17,90 @@ DB_PASSWORD = os.environ['DB_PASSWORD']
 DB_HOST = os.environ['DB_HOST']
 DB_NAME = os.environ['DB_NAME']
 
+# database connection pool (per gunicorn worker)
+DB_POOL_SETTINGS = {
+    'pool_size': int(os.environ.get('DB_POOL_SIZE', 5)),
+    'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 10)),
+    # async engine has its own pool, connections per worker are at most sum of both pools
+    'async_pool_size': int(os.environ.get('DB_ASYNC_POOL_SIZE', 2)),
+    'async_max_overflow': int(os.environ.get('DB_ASYNC_MAX_OVERFLOW', 3)),
+    'pool_timeout': int(os.environ.get('DB_POOL_TIMEOUT', 30)),
+    'pool_recycle': int(os.environ.get('DB_POOL_RECYCLE', 1800)),
+    'pool_pre_ping': os.environ.get('DB_POOL_PRE_PING', 'true').lower() == 'true',
+    'statement_timeout': int(os.environ.get('DB_STATEMENT_TIMEOUT', 15000)),  # ms, 0 - disabled
+}
+
+# requests that run more database queries are logged as possible N+1, 0 - disabled
+QUERY_COUNT_WARN = int(os.environ.get('QUERY_COUNT_WARN', 20))
+
+# student search by name, minimal pg_trgm word similarity of result
+STUDENT_SEARCH_THRESHOLD = float(os.environ.get('STUDENT_SEARCH_THRESHOLD', 0.3))
+
+# password hashing pool
+HASH_WORKERS = int(os.environ.get('HASH_WORKERS', 2))
+HASH_QUEUE_LIMIT = int(os.environ.get('HASH_QUEUE_LIMIT', 16))
+
+# token_check cache, revoked token stops working at most after TOKEN_CACHE_TTL seconds on other workers
+TOKEN_CACHE_SIZE = int(os.environ.get('TOKEN_CACHE_SIZE', 1024))
+TOKEN_CACHE_TTL = float(os.environ.get('TOKEN_CACHE_TTL', 30))
+
+# google sheets outbox worker
+OUTBOX_POLL_INTERVAL = float(os.environ.get('OUTBOX_POLL_INTERVAL', 2))  # seconds between polls of empty outbox
+OUTBOX_BATCH_SIZE = int(os.environ.get('OUTBOX_BATCH_SIZE', 100))
+OUTBOX_MAX_ATTEMPTS = int(os.environ.get('OUTBOX_MAX_ATTEMPTS', 10))
+OUTBOX_RETRY_DELAY = float(os.environ.get('OUTBOX_RETRY_DELAY', 5))  # first retry delay, doubles every attempt
+SHEETS_FLUSH_SIZE = int(os.environ.get('SHEETS_FLUSH_SIZE', 50))  # absents of one tab sent in one append
+SHEETS_FLUSH_DELAY = float(os.environ.get('SHEETS_FLUSH_DELAY', 5))  # max seconds absent waits for its batch
+
+# google sheets backend: gspread - real Google Sheets, fake - in-memory sheets for offline tests and benchmarks
+SHEETS_BACKEND = os.environ.get('SHEETS_BACKEND', 'gspread')
+SHEETS_CREDENTIALS = os.environ.get('SHEETS_CREDENTIALS', 'google_spreadsheets/google_credentials.json')
+SHEETS_FAKE_LATENCY = float(os.environ.get('SHEETS_FAKE_LATENCY', 0))  # seconds per API call
+SHEETS_FAKE_ERROR_RATE = float(os.environ.get('SHEETS_FAKE_ERROR_RATE', 0))  # share of calls failed with 503
+SHEETS_FAKE_QUOTA = int(os.environ.get('SHEETS_FAKE_QUOTA', 0))  # calls per minute before 429, 0 - unlimited
+SHEETS_FAKE_PATH = os.environ.get('SHEETS_FAKE_PATH', '')  # json file to keep fake sheets, empty - memory only
+
+# google sheets quota: calls per minute of this process to all spreadsheets and to one spreadsheet, 0 - unlimited.
+# Buckets are not shared between processes, with several uvicorn/gunicorn workers set quota divided by worker count
+SHEETS_RATE_PER_MINUTE = int(os.environ.get('SHEETS_RATE_PER_MINUTE', 60))
+SHEETS_SPREADSHEET_RATE_PER_MINUTE = int(os.environ.get('SHEETS_SPREADSHEET_RATE_PER_MINUTE', 0))
+SHEETS_RATE_WAIT_TIMEOUT = float(os.environ.get('SHEETS_RATE_WAIT_TIMEOUT', 30))  # max seconds call waits for quota
+SHEETS_RETRIES = int(os.environ.get('SHEETS_RETRIES', 4))  # retries of call failed with 429 or 5xx
+SHEETS_RETRY_BASE_DELAY = float(os.environ.get('SHEETS_RETRY_BASE_DELAY', 1))  # backoff is random up to base * 2^n
+SHEETS_RETRY_MAX_DELAY = float(os.environ.get('SHEETS_RETRY_MAX_DELAY', 32))
+# calls made in http request wait and retry less, the rest is left to outbox worker or to client on 503
+SHEETS_REQUEST_RETRIES = int(os.environ.get('SHEETS_REQUEST_RETRIES', 1))
+SHEETS_REQUEST_WAIT_TIMEOUT = float(os.environ.get('SHEETS_REQUEST_WAIT_TIMEOUT', 5))
+
+# google sheets outage handling: request timeout and circuit breaker
+SHEETS_TIMEOUT = float(os.environ.get('SHEETS_TIMEOUT', 10))  # seconds per http request
+SHEETS_BREAKER_FAILURES = int(os.environ.get('SHEETS_BREAKER_FAILURES', 5))  # failures in a row that open circuit
+SHEETS_BREAKER_RESET = float(os.environ.get('SHEETS_BREAKER_RESET', 30))  # seconds before trial call
+
+# absent worksheets: daily, weekly or monthly tab, rows of new tab (it grows on append), weekly or monthly tab of
+# next period is created by outbox worker the day before; daily keeps the tab per date existing spreadsheets
+# already have, it is created by the first absent of the date
+SHEETS_ABSENT_LAYOUT = os.environ.get('SHEETS_ABSENT_LAYOUT', 'daily')
+SHEETS_ABSENT_TAB_ROWS = int(os.environ.get('SHEETS_ABSENT_TAB_ROWS', 100))
+SHEETS_ABSENT_PREWARM = os.environ.get('SHEETS_ABSENT_PREWARM', 'true').lower() == 'true'
+
+# async google sheets client of outbox worker: one keep-alive connection pool for all spreadsheets
+SHEETS_ASYNC = os.environ.get('SHEETS_ASYNC', 'true').lower() == 'true'
+SHEETS_ASYNC_MAX_CONNECTIONS = int(os.environ.get('SHEETS_ASYNC_MAX_CONNECTIONS', 20))
+
+# google sheets handles cache
+SHEETS_TABLE_CACHE_SIZE = int(os.environ.get('SHEETS_TABLE_CACHE_SIZE', 256))  # number of cached spreadsheets
+SHEETS_TABLE_CACHE_TTL = float(os.environ.get('SHEETS_TABLE_CACHE_TTL', 3600))
+SHEETS_WORKSHEET_CACHE_TTL = float(os.environ.get('SHEETS_WORKSHEET_CACHE_TTL', 300))
+
+# roster import: sheet rows read per request and rows inserted per statement
+SHEETS_READ_CHUNK_ROWS = int(os.environ.get('SHEETS_READ_CHUNK_ROWS', 500))
+ROSTER_INSERT_BATCH = int(os.environ.get('ROSTER_INSERT_BATCH', 500))
+
+# absent proof files
+BLOB_STORE_BACKEND = os.environ.get('BLOB_STORE_BACKEND', 'local')
+BLOB_STORE_PATH = os.environ.get('BLOB_STORE_PATH', './blobs')
+
 TAGS_METADATA = [
     {
         "name": "Auth",
@@ -37,6 +121,10 @@ TAGS_METADATA = [
     {
         "name": "School",
         "description": "Operations with schools",
+    },
+    {
+        "name": "Metrics",
+        "description": "Service metrics",
     }
 ]
 
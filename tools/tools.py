@@ -1,46 +1,138 @@
+import asyncio
+import base64
+import binascii
 import datetime
-import random
+import itertools
+import secrets
+import string
 
 from passlib.context import CryptContext
-from fuzzywuzzy import process
 from jose import JWTError, jwt
+from sqlalchemy import delete, select, union, update
 
+from data.absent import Absent
 from data.student import Student
 from data.teacher import Teacher
 from data.user import User
+from .bounded_executor import BoundedExecutor
+from .error_book import RangeNotSatisfiableError
 from .settings import *
 
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+hashing_executor = BoundedExecutor(HASH_WORKERS, HASH_QUEUE_LIMIT, 'hashing')
+
+
+CODE_ALPHABET = string.ascii_letters + string.digits
+CODE_LENGTH = 10
 
 
 def generate_random_code() -> str:
     """Function that generate random code for teachers or students """
-    etalon = list('qwertyuiopadfghjklzxcvbnm1234567890QWERTYUIOPASDFGHJKLZZXCVBNM')
-    random.shuffle(etalon)
-    return ''.join(etalon[:10])
+    return ''.join(secrets.choice(CODE_ALPHABET) for _ in range(CODE_LENGTH))
+
+
+def generate_unique_codes(db_sess, count: int) -> list:
+    """
+        Function that generate list of unique codes, one query to teachers and students per round
+
+        db_sess: Session - database session
+        count: int - number of codes
+    """
+    codes = set()
+    while len(codes) < count:
+        candidates = set()
+        while len(candidates) < count - len(codes):
+            code = generate_random_code()
+            if code not in codes:
+                candidates.add(code)
+
+        taken = db_sess.execute(union(
+            select(Teacher.code).where(Teacher.code.in_(candidates)),
+            select(Student.code).where(Student.code.in_(candidates))
+        )).scalars().all()
+
+        codes |= candidates.difference(taken)
+
+    return list(codes)
 
 
 def generate_unique_code(db_sess) -> str:
     """Function that generate random code until it be unique"""
-    code = generate_random_code()
-    while not (db_sess.query(Teacher).filter(Teacher.code == code).first() is None and
-               db_sess.query(Student).filter(Student.code == code).first() is None):
-        code = generate_random_code()
-    return code
+    return generate_unique_codes(db_sess, 1)[0]
 
 
-def find_student(student_list: list, key: str) -> list:
+def delete_students(db_sess, condition, absents: bool) -> tuple:
     """
-        Function that find 5 most similar in name students from list
+        Function that delete students matching condition with two set based statements, returns (students, absents)
+        numbers of deleted rows, absents of students are deleted or detached from them as ORM delete did
 
-        students_list: list - list of students used for search
-        key: str - search key
+        db_sess: Session - database session, caller commits
+        condition - where clause on Student columns
+        absents: bool - delete absents of students too
     """
-    student_name_list = list(map(lambda x: x[0], student_list))
-    find = process.extract(key, student_name_list)
-    find = list(map(lambda x: student_list[student_name_list.index(x[0])][1], find))
-    return find
+    student_ids = select(Student.id).where(condition)
+    if absents:
+        absents_deleted = db_sess.execute(
+            delete(Absent).where(Absent.student_id.in_(student_ids)).execution_options(synchronize_session=False)
+        ).rowcount
+    else:
+        absents_deleted = 0
+        db_sess.execute(
+            update(Absent).where(Absent.student_id.in_(student_ids)).values(student_id=None)
+            .execution_options(synchronize_session=False)
+        )
+
+    students_deleted = db_sess.execute(
+        delete(Student).where(condition).execution_options(synchronize_session=False)
+    ).rowcount
+    return students_deleted, absents_deleted
+
+
+def chunked(iterable, size: int):
+    """Generator of lists with up to size items of iterable"""
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def decode_proof(data: bytes) -> bytes:
+    """Function that decode base64 proof file given in json body, data that is not base64 is kept as is"""
+    try:
+        return base64.b64decode(data, validate=True)
+    except binascii.Error:
+        return data
+
+
+def parse_byte_range(range_header: str, size: int):
+    """
+        Function that parse Range header for file of given size, returns (start, end) inclusive
+
+        None is returned for missing, malformed or multi range header, file is sent whole then
+        RangeNotSatisfiableError is raised when range is outside of file
+    """
+    if not range_header or not range_header.startswith('bytes=') or ',' in range_header:
+        return None
+
+    first, sep, last = range_header[len('bytes='):].strip().partition('-')
+    if not sep or not (first.isdigit() or last.isdigit()) or (first and not first.isdigit()) \
+            or (last and not last.isdigit()):
+        return None
+
+    if not first:
+        suffix = int(last)
+        if suffix == 0 or size == 0:
+            raise RangeNotSatisfiableError(range_header, size)
+        return max(size - suffix, 0), size - 1
+
+    start = int(first)
+    end = int(last) if last else size - 1
+    if start >= size or end < start:
+        raise RangeNotSatisfiableError(range_header, size)
+    return start, min(end, size - 1)
 
 
 def create_access_token(login: str, token_id: int) -> str:
@@ -66,3 +158,13 @@ def generate_hashed_password(password: str) -> str:
 def check_password(password: str, hashed_password: str) -> bool:
     """Function that check password for current user"""
     return pwd_context.verify(password, hashed_password)
+
+
+async def check_password_async(password: str, hashed_password: str) -> bool:
+    """Function that check password in hashing pool without blocking event loop"""
+    return await asyncio.wrap_future(hashing_executor.submit(check_password, password, hashed_password))
+
+
+def generate_hashed_password_pooled(password: str) -> str:
+    """Function that generate hashed password in hashing pool, raise ExecutorOverloadError if pool is full"""
+    return hashing_executor.submit(generate_hashed_password, password).result()